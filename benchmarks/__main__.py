@@ -0,0 +1,132 @@
+"""Runs the Pubsub benchmark suite and writes results as JSON.
+
+Measures local publish throughput by subscriber count and callback cost,
+queueing cost of remote topics by payload type, PubsubServer and
+PubsubClient round trips over loopback, the same over shared memory, and the
+Kafka bridge. --quick runs small counts to fit in CI, which is enough to catch
+large regressions but noisier than a full run.
+
+Results of runs are comparable when taken on the same machine. Each JSON
+document holds the environment and revision it was taken with:
+  {"revision": ..., "quick": ..., "results": {"publish": [...], ...}}
+
+Usage:
+  python -m common.benchmarks --quick --output=benchmarks.json
+"""
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from absl import app as absl_app
+from absl import flags
+
+from common import pubsub
+from common.benchmarks import pubsub_enqueue
+from common.benchmarks import pubsub_kafka
+from common.benchmarks import pubsub_loopback
+from common.benchmarks import pubsub_publish
+from common.benchmarks import pubsub_shm
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_bool('quick', False, 'Whether to run small counts only.')
+flags.DEFINE_string('output', None,
+                    'File to write results to. Defaults to stdout.')
+
+_FULL = {
+    'publish': [
+        dict(subscribers=subscribers, callback_us=callback_us, mode=mode,
+             publishes=20000)
+        for mode in (pubsub.Pubsub.SYNC, pubsub.Pubsub.ASYNC)
+        for callback_us in (0, 10)
+        for subscribers in (0, 1, 10, 100)
+    ],
+    'enqueue': [
+        dict(payload=payload, enqueues=100000)
+        for payload in pubsub_enqueue.payloads()
+    ],
+    'loopback': [
+        dict(unix_socket=unix_socket, round_trips=1000, messages=20000)
+        for unix_socket in (False, True)
+    ],
+    'shm': [dict(round_trips=1000, messages=20000)],
+    'kafka': [dict(topics=100000)],
+}
+
+_QUICK = {
+    'publish': [
+        dict(subscribers=subscribers, callback_us=callback_us, publishes=2000)
+        for callback_us in (0, 10)
+        for subscribers in (0, 1, 10)
+    ],
+    'enqueue': [
+        dict(payload=payload, enqueues=5000)
+        for payload in pubsub_enqueue.payloads()
+    ],
+    'loopback': [dict(round_trips=100, messages=1000)],
+    'shm': [dict(round_trips=100, messages=1000)],
+    'kafka': [dict(topics=5000)],
+}
+
+_BENCHMARKS = {
+    'publish': pubsub_publish.run,
+    'enqueue': pubsub_enqueue.run,
+    'kafka': pubsub_kafka.run,
+    'loopback': pubsub_loopback.run,
+    'shm': pubsub_shm.run,
+}
+
+
+def _revision():
+  """Returns the git commit of the source tree, or None if unknown."""
+  try:
+    return subprocess.check_output(
+        ['git', 'rev-parse', 'HEAD'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stderr=subprocess.DEVNULL).decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def run(quick=False):
+  """Runs all benchmarks.
+
+  Args:
+    quick: whether to run small counts only.
+  Returns:
+    A dict of environment and results, where results is a dict of benchmark
+    name => list of result dicts, one for each set of parameters.
+  """
+  suite = _QUICK if quick else _FULL
+  start = time.time()
+  results = {}
+  for name, benchmark in sorted(_BENCHMARKS.items()):
+    results[name] = [benchmark(**kwargs) for kwargs in suite[name]]
+  return {
+      'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+      'revision': _revision(),
+      'quick': quick,
+      'python': platform.python_version(),
+      'platform': platform.platform(),
+      'cpu_count': os.cpu_count(),
+      'seconds': time.time() - start,
+      'results': results,
+  }
+
+
+def main(_):
+  report = run(FLAGS.quick)
+  if FLAGS.output:
+    with open(FLAGS.output, 'w') as f:
+      json.dump(report, f, indent=2, sort_keys=True)
+  else:
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    print()
+
+
+if __name__ == '__main__':
+  absl_app.run(main)
@@ -0,0 +1,120 @@
+"""Load test of AsyncPubsubServer with many concurrent listener streams.
+
+Opens the given number of Listen streams against a local server on loopback,
+publishes topics on the server side and waits until every stream received
+all of them.
+
+Usage:
+  python -m common.benchmarks.pubsub_aio_load --listeners=2000 --topics=100
+"""
+import asyncio
+import threading
+import time
+
+import grpc
+from absl import app as absl_app
+from absl import flags
+
+from common import pubsub
+from common import pubsub_aio
+from common.proto import pubsub_pb2
+from common.proto import pubsub_pb2_grpc
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer('listeners', 2000, 'Number of listener streams.')
+flags.DEFINE_integer('topics', 100, 'Number of topics to publish.')
+flags.DEFINE_integer('streams_per_channel', 100,
+                     'Number of listener streams sharing a channel.')
+
+_TOPIC_ID = 1
+_RAMP_UP_STREAMS = 200
+
+
+async def run_async(listeners=2000, topics=100, streams_per_channel=100):
+  """Runs the load test on the running event loop.
+
+  Args:
+    listeners: number of listener streams.
+    topics: number of topics to publish.
+    streams_per_channel: number of listener streams sharing a channel.
+  Returns:
+    A dict of results.
+  """
+  server = pubsub_aio.AsyncPubsubServer(port=0, queue_size=topics)
+  await server.start()
+  target = 'localhost:{0}'.format(server.port)
+  # Each channel gets its own connection instead of sharing a global one.
+  channels = [
+      grpc.aio.insecure_channel(
+          target, options=[('grpc.use_local_subchannel_pool', 1)])
+      for _ in range(0, listeners, streams_per_channel)
+  ]
+  try:
+    start = time.time()
+    tasks = []
+    for i in range(listeners):
+      stub = pubsub_pb2_grpc.PubsubStub(channels[i // streams_per_channel])
+      tasks.append(asyncio.ensure_future(_listen(stub, topics)))
+      # Ramps up so that gRPC does not cancel calls pending in the server
+      # before their handlers start.
+      if i % _RAMP_UP_STREAMS == _RAMP_UP_STREAMS - 1:
+        await _wait_for_streams(server, i + 1)
+    await _wait_for_streams(server, listeners)
+    connect_seconds = time.time() - start
+
+    start = time.time()
+    instance = pubsub.Pubsub.get_instance()
+    for i in range(topics):
+      instance.publish(_TOPIC_ID, i)
+    received = await asyncio.gather(*tasks)
+    deliver_seconds = time.time() - start
+    threads = threading.active_count()
+  finally:
+    for channel in channels:
+      await channel.close()
+    await server.stop()
+
+  return {
+      'listeners': listeners,
+      'topics': topics,
+      'connect_seconds': connect_seconds,
+      'deliver_seconds': deliver_seconds,
+      'deliveries_per_second': sum(received) / deliver_seconds,
+      'lost': listeners * topics - sum(received),
+      'threads': threads,
+  }
+
+
+def run(listeners=2000, topics=100, streams_per_channel=100):
+  """Runs the load test on a new event loop. See run_async()."""
+  return asyncio.run(run_async(listeners, topics, streams_per_channel))
+
+
+async def _wait_for_streams(server, streams):
+  while server.streams < streams:
+    await asyncio.sleep(0.01)
+
+
+async def _listen(stub, topics):
+  received = 0
+  request = pubsub_pb2.ListenRequest(topic_id=[_TOPIC_ID], max_batch_size=100)
+  call = stub.Listen(request)
+  async for response in call:
+    received += len(response.topics)
+    if received >= topics:
+      call.cancel()
+      break
+  return received
+
+
+def main(_):
+  result = run(FLAGS.listeners, FLAGS.topics, FLAGS.streams_per_channel)
+  print('{listeners} listeners connected in {connect_seconds:.2f}s, '
+        '{topics} topics delivered in {deliver_seconds:.2f}s '
+        '({deliveries_per_second:.0f} deliveries/s, {lost} lost, '
+        '{threads} threads)'.format(**result))
+
+
+if __name__ == '__main__':
+  absl_app.run(main)
@@ -0,0 +1,186 @@
+"""Measures Pubsub throughput over a slow link with and without compression.
+
+A PubsubServer streams compressible topics to a listener through a local
+proxy limiting the bandwidth from server to listener, as a radio or WAN link
+would. Compression trades CPU time for fewer bytes on the link, so it pays
+off when the link rather than the CPU is the bottleneck.
+
+Usage:
+  python -m common.benchmarks.pubsub_compression --bandwidth=1000000
+"""
+import json
+import socket
+import threading
+import time
+
+import grpc
+from absl import app as absl_app
+from absl import flags
+
+from common import pubsub
+from common.proto import pubsub_pb2
+from common.proto import pubsub_pb2_grpc
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_list('compressions', ['none', 'gzip', 'deflate'],
+                  'Compression algorithms to measure with.')
+flags.DEFINE_integer('bandwidth', 1000000,
+                     'Bytes per second from server to listener.')
+flags.DEFINE_integer('publishes', 2000, 'Number of topics to publish.')
+flags.DEFINE_integer('port', 50161,
+                     'First port for the Pubsub server and the proxy.')
+
+_COMPRESSIONS = {
+    'none': None,
+    'gzip': grpc.Compression.Gzip,
+    'deflate': grpc.Compression.Deflate,
+}
+
+_TOPIC_ID = 1
+
+
+class _ThrottledProxy(object):
+  """Forwards TCP connections, limiting bandwidth from target to client."""
+
+  _CHUNK_SIZE = 4096
+
+  def __init__(self, port, target_port, bandwidth):
+    self._target_port = target_port
+    self._bandwidth = bandwidth
+    self._bytes = 0
+    self._lock = threading.Lock()
+    self._sockets = []
+    self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self._socket.bind(('localhost', port))
+    self._socket.listen(5)
+    threading.Thread(target=self._accept, daemon=True).start()
+
+  @property
+  def bytes(self):
+    """Returns the number of bytes forwarded from target to client."""
+    return self._bytes
+
+  def close(self):
+    for sock in [self._socket] + self._sockets:
+      try:
+        sock.shutdown(socket.SHUT_RDWR)
+      except OSError:
+        pass
+      sock.close()
+
+  def _accept(self):
+    while True:
+      try:
+        client, _ = self._socket.accept()
+      except OSError:
+        return
+      target = socket.create_connection(('localhost', self._target_port))
+      self._sockets += [client, target]
+      threading.Thread(
+          target=self._pump, args=(client, target, False), daemon=True).start()
+      threading.Thread(
+          target=self._pump, args=(target, client, True), daemon=True).start()
+
+  def _pump(self, source, destination, throttled):
+    # Token bucket holding at most a tenth of a second of bandwidth.
+    tokens = 0
+    last = time.time()
+    while True:
+      try:
+        data = source.recv(self._CHUNK_SIZE)
+        if not data:
+          return
+        if throttled:
+          with self._lock:
+            self._bytes += len(data)
+          now = time.time()
+          tokens = min(tokens + (now - last) * self._bandwidth,
+                       self._bandwidth / 10)
+          last = now
+          tokens -= len(data)
+          if tokens < 0:
+            time.sleep(-tokens / self._bandwidth)
+        destination.sendall(data)
+      except OSError:
+        return
+
+
+def run(compression=None, bandwidth=1000000, publishes=2000, port=50161):
+  """Runs the benchmark with given compression.
+
+  Args:
+    compression: a grpc.Compression, or None for no compression.
+    bandwidth: bytes per second from server to listener.
+    publishes: number of topics to publish.
+    port: port for the Pubsub server. The proxy listens on port + 1.
+  Returns:
+    A dict of results. cpu_seconds is the CPU time used by this process,
+    which hosts the server, the proxy and the listener.
+  """
+  server = pubsub.PubsubServer(
+      port=port, queue_size=publishes, compression=compression)
+  server.start()
+  proxy = _ThrottledProxy(port + 1, port, bandwidth)
+  channel = grpc.insecure_channel('localhost:{0}'.format(port + 1))
+  stub = pubsub_pb2_grpc.PubsubStub(channel)
+  call = stub.Listen(
+      pubsub_pb2.ListenRequest(topic_id=[_TOPIC_ID], max_batch_size=100))
+  try:
+    # Waits for the stream to be served before publishing.
+    while not server.dropped:
+      time.sleep(0.01)
+
+    instance = pubsub.Pubsub.get_instance()
+    start_bytes = proxy.bytes
+    start_cpu = time.process_time()
+    start = time.time()
+    for i in range(publishes):
+      instance.publish(_TOPIC_ID, _payload(i))
+    received = 0
+    for response in call:
+      received += len(response.topics) or 1
+      if received >= publishes:
+        break
+    elapsed = time.time() - start
+    cpu = time.process_time() - start_cpu
+    link_bytes = proxy.bytes - start_bytes
+  finally:
+    call.cancel()
+    channel.close()
+    server.stop()
+    proxy.close()
+
+  return {
+      'publishes': publishes,
+      'seconds': elapsed,
+      'cpu_seconds': cpu,
+      'link_bytes': link_bytes,
+      'topics_per_second': publishes / elapsed,
+  }
+
+
+def _payload(i):
+  return json.dumps({
+      'sequence': i,
+      'status': 'nominal',
+      'readings': [{
+          'sensor': 'sensor-{0}'.format(x),
+          'value': x * 0.5,
+          'unit': 'celsius',
+      } for x in range(10)],
+  })
+
+
+def main(_):
+  for i, name in enumerate(FLAGS.compressions):
+    result = run(_COMPRESSIONS[name], FLAGS.bandwidth, FLAGS.publishes,
+                 FLAGS.port + 2 * i)
+    print('{name}: {topics_per_second:.0f} topics/s, {link_bytes} bytes on '
+          'link, {cpu_seconds:.2f}s CPU over {seconds:.2f}s'.format(
+              name=name, **result))
+
+
+if __name__ == '__main__':
+  absl_app.run(main)
@@ -0,0 +1,88 @@
+"""Measures the cost of queueing a topic for a remote listener by payload type.
+
+Topics are handed to a _PubsubReceiver one at a time, as Pubsub does for a
+PubsubClient or a listener of PubsubServer, so each enqueue converts one
+payload into a pubsub_pb2.Topic and puts it on the topic queue.
+
+Usage:
+  python -m common.benchmarks.pubsub_enqueue --payloads=integer,string
+"""
+import time
+
+from absl import app as absl_app
+from absl import flags
+
+from common import pubsub
+from common.proto import pubsub_pb2
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+FLAGS = flags.FLAGS
+
+_PAYLOADS = {
+    'integer': lambda: 12345,
+    'float': lambda: 1.5,
+    'string': lambda: 'x' * 100,
+    'message': lambda: pubsub_pb2.Topic(id=1, string_value='x' * 100),
+    'int_list': lambda: list(range(100)),
+    'float_list': lambda: [x * 0.5 for x in range(100)],
+}
+if np is not None:
+  _PAYLOADS['ndarray'] = lambda: np.zeros((10, 10), dtype=np.float32)
+
+flags.DEFINE_list('payloads', sorted(_PAYLOADS),
+                  'Payload types to measure with.')
+flags.DEFINE_integer('enqueues', 100000, 'Number of topics to enqueue.')
+
+_TOPIC_ID = 1
+
+
+def payloads():
+  """Returns names of payload types available to measure with."""
+  return sorted(_PAYLOADS)
+
+
+def run(payload='integer', enqueues=100000):
+  """Runs the benchmark with given payload type.
+
+  Args:
+    payload: name of the payload type, one of payloads().
+    enqueues: number of topics to enqueue.
+  Returns:
+    A dict of results.
+  """
+  assert payload in _PAYLOADS
+  data = _PAYLOADS[payload]()
+  receiver = pubsub._PubsubReceiver([_TOPIC_ID], queue_size=enqueues)
+  topics = [(_TOPIC_ID, data)]
+
+  start_cpu = time.process_time()
+  start = time.perf_counter()
+  for _ in range(enqueues):
+    receiver._on_topics(topics)
+  elapsed = time.perf_counter() - start
+  cpu = time.process_time() - start_cpu
+  assert not receiver.dropped
+
+  return {
+      'payload': payload,
+      'enqueues': enqueues,
+      'seconds': elapsed,
+      'cpu_seconds': cpu,
+      'enqueues_per_second': enqueues / elapsed,
+      'us_per_enqueue': 1e6 * elapsed / enqueues,
+  }
+
+
+def main(_):
+  for payload in FLAGS.payloads:
+    result = run(payload, FLAGS.enqueues)
+    print('{payload}: {enqueues_per_second:.0f} enqueues/s, '
+          '{us_per_enqueue:.2f}us per enqueue'.format(**result))
+
+
+if __name__ == '__main__':
+  absl_app.run(main)
@@ -0,0 +1,81 @@
+"""Measures the cost of a publish with many remote listeners.
+
+Topics are published to a _FanoutHub with the given numbers of listeners, as
+PubsubServer does for its Listen streams. Each topic is converted and
+serialized once, so only queueing grows with the number of listeners.
+
+With --topic_ids, listeners are spread over that many topic ids, and as many
+other topic ids without listeners are published too. Only listeners of a
+topic cost anything, and topics without listeners are not converted.
+
+Usage:
+  python -m common.benchmarks.pubsub_fanout --listeners=1,10,50
+  python -m common.benchmarks.pubsub_fanout --listeners=500 --topic_ids=100
+"""
+import time
+
+from absl import app as absl_app
+from absl import flags
+
+from common import pubsub
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_list('listeners', ['1', '10', '50'],
+                  'Numbers of listeners to measure with.')
+flags.DEFINE_integer('publishes', 10000, 'Number of topics to publish.')
+flags.DEFINE_integer('topic_ids', 1,
+                     'Number of topic ids listeners are spread over.')
+flags.DEFINE_integer('replay_size', 1000,
+                     'Size of the replay ring, as in PubsubServer.')
+
+
+def run(listeners=50, publishes=10000, topic_ids=1, replay_size=1000):
+  """Runs the benchmark with given number of listeners.
+
+  Args:
+    listeners: number of listeners.
+    publishes: number of topics to publish.
+    topic_ids: number of topic ids listeners are spread over. As many other
+               topic ids without listeners are published.
+    replay_size: size of the replay ring.
+  Returns:
+    A dict of results.
+  """
+  hub = pubsub._FanoutHub(replay_size)
+  receivers = [
+      pubsub._HubListener([i % topic_ids + 1], queue_size=publishes)
+      for i in range(listeners)
+  ]
+  hub.__enter__()
+  for receiver in receivers:
+    hub.add(receiver)
+  try:
+    instance = pubsub.Pubsub.get_instance()
+    start_cpu = time.process_time()
+    for i in range(publishes):
+      instance.publish(i % (2 * topic_ids) + 1, 'value {0}'.format(i))
+    cpu = time.process_time() - start_cpu
+  finally:
+    for receiver in receivers:
+      hub.remove(receiver)
+    hub.__exit__(None, None, None)
+
+  return {
+      'listeners': listeners,
+      'publishes': publishes,
+      'topic_ids': topic_ids,
+      'cpu_us_per_publish': 1e6 * cpu / publishes,
+  }
+
+
+def main(_):
+  for listeners in FLAGS.listeners:
+    result = run(
+        int(listeners), FLAGS.publishes, FLAGS.topic_ids, FLAGS.replay_size)
+    print('{listeners} listeners over {topic_ids} topic ids: '
+          '{cpu_us_per_publish:.1f}us CPU per publish'.format(**result))
+
+
+if __name__ == '__main__':
+  absl_app.run(main)
@@ -0,0 +1,93 @@
+"""Measures CPU used by a PubsubServer with idle listener streams.
+
+Listener streams must block while no topic is published, so the CPU time used
+over the measurement should stay near zero regardless of the number of
+listeners. Each stream holds one of the server's 10 worker threads, so at most
+10 listeners are served at a time.
+
+Usage:
+  python -m common.benchmarks.pubsub_idle_listeners --listeners=8
+"""
+import threading
+import time
+
+import grpc
+from absl import app as absl_app
+from absl import flags
+
+from common import pubsub
+from common.proto import pubsub_pb2
+from common.proto import pubsub_pb2_grpc
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer('listeners', 8, 'Number of idle listener streams.')
+flags.DEFINE_float('duration', 5, 'Seconds to measure CPU time over.')
+flags.DEFINE_integer('port', 50151, 'Port for the Pubsub server.')
+
+
+def run(listeners=8, duration=5, port=50151):
+  """Runs the benchmark.
+
+  Args:
+    listeners: number of idle listener streams.
+    duration: seconds to measure CPU time over.
+    port: port for the Pubsub server.
+  Returns:
+    A dict of results. cpu_percent is the CPU time used by this process,
+    which hosts both the server and the listeners, as a percentage of one
+    core.
+  """
+  server = pubsub.PubsubServer(port=port)
+  server.start()
+  channel = grpc.insecure_channel('localhost:{0}'.format(port))
+  stub = pubsub_pb2_grpc.PubsubStub(channel)
+  calls = []
+  threads = []
+  try:
+    for _ in range(listeners):
+      call = stub.Listen(pubsub_pb2.ListenRequest(topic_id=[1]))
+      thread = threading.Thread(target=_consume, args=(call,))
+      thread.start()
+      calls.append(call)
+      threads.append(thread)
+    # Lets the streams settle before measuring.
+    time.sleep(min(1, duration))
+
+    start_cpu = time.process_time()
+    start = time.time()
+    time.sleep(duration)
+    cpu = time.process_time() - start_cpu
+    elapsed = time.time() - start
+  finally:
+    for call in calls:
+      call.cancel()
+    for thread in threads:
+      thread.join()
+    channel.close()
+    server.stop()
+
+  return {
+      'listeners': listeners,
+      'seconds': elapsed,
+      'cpu_seconds': cpu,
+      'cpu_percent': 100 * cpu / elapsed,
+  }
+
+
+def _consume(call):
+  try:
+    for _ in call:
+      pass
+  except grpc.RpcError:
+    pass
+
+
+def main(_):
+  result = run(FLAGS.listeners, FLAGS.duration, FLAGS.port)
+  print('{listeners} idle listeners: {cpu_percent:.2f}% CPU '
+        '({cpu_seconds:.3f}s over {seconds:.1f}s)'.format(**result))
+
+
+if __name__ == '__main__':
+  absl_app.run(main)
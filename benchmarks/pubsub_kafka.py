@@ -0,0 +1,99 @@
+"""Measures throughput of the Pubsub Kafka bridge.
+
+Topics published to local Pubsub are sent by PubsubKafkaProducer to an
+in-memory stand-in for Kafka, then published again by PubsubKafkaConsumer,
+as a node of another origin would. Kafka itself is left out, so results are
+the cost of the bridge alone.
+
+Usage:
+  python -m common.benchmarks.pubsub_kafka --topics=100000
+"""
+import time
+
+from absl import app as absl_app
+from absl import flags
+
+from common import kafka_util
+from common import pubsub
+from common import pubsub_kafka
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer('topics', 100000, 'Number of topics to publish.')
+flags.DEFINE_integer('max_batch_size', 1000,
+                     'Max number of topics in a Kafka message.')
+
+_TOPIC_ID = 1
+
+
+def run(topics=100000, max_batch_size=1000):
+  """Runs the benchmark.
+
+  Args:
+    topics: number of topics to publish.
+    max_batch_size: max number of topics in a Kafka message.
+  Returns:
+    A dict of results. Producer rates include publishing topics.
+  """
+  kafka = kafka_util.InMemoryKafka()
+  instance = pubsub.Pubsub.get_instance()
+  node_id = pubsub.get_node_id()
+  # Consumers drop topics of their own node.
+  pubsub.set_node_id('benchmark-producer')
+  producer = pubsub_kafka.PubsubKafkaProducer(
+      kafka.producer,
+      'pubsub',
+      queue_size=topics,
+      max_batch_size=max_batch_size)
+  producer.start()
+  try:
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    for i in range(topics):
+      instance.publish(_TOPIC_ID, i)
+    while producer.sent + sum(producer.dropped.values()) < topics:
+      time.sleep(0.001)
+    produce_elapsed = time.perf_counter() - start
+    produce_cpu = time.process_time() - start_cpu
+    dropped = sum(producer.dropped.values())
+  finally:
+    producer.stop()
+    pubsub.set_node_id(node_id)
+
+  received = []
+  on_topics = received.extend
+  instance.subscribe(_TOPIC_ID, on_topics, batch=True)
+  consumer = pubsub_kafka.PubsubKafkaConsumer(kafka.consumer, 'pubsub',
+                                              'benchmark')
+  try:
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    consumer.start()
+    while len(received) < producer.sent:
+      time.sleep(0.001)
+    consume_elapsed = time.perf_counter() - start
+    consume_cpu = time.process_time() - start_cpu
+  finally:
+    consumer.stop()
+    instance.unsubscribe(_TOPIC_ID, on_topics)
+
+  return {
+      'topics': topics,
+      'dropped': dropped,
+      'messages': len(kafka.records('pubsub')),
+      'produce_topics_per_second': producer.sent / produce_elapsed,
+      'produce_cpu_seconds': produce_cpu,
+      'consume_topics_per_second': len(received) / consume_elapsed,
+      'consume_cpu_seconds': consume_cpu,
+  }
+
+
+def main(_):
+  result = run(FLAGS.topics, FLAGS.max_batch_size)
+  print('Produced {produce_topics_per_second:.0f} topics/s in {messages} '
+        'messages ({dropped} dropped), consumed '
+        '{consume_topics_per_second:.0f} topics/s'.format(**result))
+
+
+if __name__ == '__main__':
+  absl_app.run(main)
@@ -0,0 +1,181 @@
+"""Measures PubsubServer and PubsubClient latency and throughput over loopback.
+
+A PubsubServer in a child process echoes topics dispatched by a PubsubClient
+in this process back to it, so both ends run their own Pubsub as on separate
+nodes. Round trips are timed one at a time, then topics are published as
+fast as possible and echoes counted.
+
+Both ends linger for more topics to fill a batch, which adds up to twice
+--linger to a round trip, so latency is measured without lingering by
+default. PubsubClient and PubsubServer linger 5ms by default.
+
+Usage:
+  python -m common.benchmarks.pubsub_loopback --round_trips=1000
+"""
+import multiprocessing
+import threading
+import time
+
+from absl import app as absl_app
+from absl import flags
+
+from common import pubsub
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer('round_trips', 1000, 'Number of round trips to time.')
+flags.DEFINE_integer('messages', 20000,
+                     'Number of topics to echo for throughput.')
+flags.DEFINE_float('linger', 0,
+                   'Seconds both ends wait for more topics to fill a batch.')
+flags.DEFINE_integer('port', 50191, 'Port for the Pubsub server.')
+flags.DEFINE_bool('unix_socket', False,
+                  'Whether to connect through the unix domain socket.')
+
+_ECHO_TOPIC_ID = 1
+_REQUEST_TOPIC_ID = 2
+
+
+def _serve(port, queue_size, linger, stop):
+  server = pubsub.PubsubServer(
+      port=port, queue_size=queue_size, linger=linger)
+  instance = pubsub.Pubsub.get_instance()
+  echo = lambda topic, data: instance.publish(_ECHO_TOPIC_ID, data)
+  instance.subscribe(_REQUEST_TOPIC_ID, echo)
+  server.start()
+  stop.wait()
+  server.stop()
+
+
+class _Echoes(object):
+  """Waits for echoes of topics received from server."""
+
+  def __init__(self):
+    self._condition = threading.Condition()
+    self._last = None
+    self._count = 0
+
+  def on_topic(self, topic, data):
+    with self._condition:
+      self._last = data
+      self._count += 1
+      self._condition.notify_all()
+
+  def reset(self):
+    with self._condition:
+      self._last = None
+      self._count = 0
+
+  def wait_for(self, value, timeout):
+    with self._condition:
+      return self._condition.wait_for(lambda: self._last == value, timeout)
+
+  def wait_for_count(self, count, timeout):
+    with self._condition:
+      self._condition.wait_for(lambda: self._count >= count, timeout)
+      return self._count
+
+
+def run(round_trips=1000,
+        messages=20000,
+        linger=0,
+        port=50191,
+        unix_socket=False,
+        timeout=60):
+  """Runs the benchmark against a PubsubServer in a child process.
+
+  Args:
+    round_trips: number of round trips to time.
+    messages: number of topics to echo for throughput.
+    linger: seconds both ends wait for more topics to fill a batch.
+    port: port for the Pubsub server.
+    unix_socket: whether to connect through the unix domain socket of the
+                 server instead of its TCP port.
+    timeout: max seconds to wait for echoes of the throughput run.
+  Returns:
+    A dict of results. messages_per_second counts echoes received, which
+    falls short of messages if server or client dropped topics.
+  """
+  context = multiprocessing.get_context('spawn')
+  stop = context.Event()
+  process = context.Process(
+      target=_serve, args=(port, messages, linger, stop), daemon=True)
+  process.start()
+  instance = pubsub.Pubsub.get_instance()
+  echoes = _Echoes()
+  instance.subscribe(_ECHO_TOPIC_ID, echoes.on_topic)
+  client = None
+  try:
+    client = _connect(port, messages, linger, unix_socket, process)
+    # Waits for the listen stream to be served before measuring.
+    while not echoes.wait_for(-1, 0.1):
+      instance.publish(_REQUEST_TOPIC_ID, -1)
+
+    latencies = []
+    for i in range(round_trips):
+      start = time.perf_counter()
+      instance.publish(_REQUEST_TOPIC_ID, i)
+      if not echoes.wait_for(i, timeout):
+        raise RuntimeError('Echo of round trip {0} timed out.'.format(i))
+      latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    echoes.reset()
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    for i in range(messages):
+      instance.publish(_REQUEST_TOPIC_ID, i)
+    received = echoes.wait_for_count(messages, timeout)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - start_cpu
+  finally:
+    if client:
+      client.stop()
+    instance.unsubscribe(_ECHO_TOPIC_ID, echoes.on_topic)
+    stop.set()
+    process.join()
+
+  return {
+      'transport': 'unix' if unix_socket else 'tcp',
+      'linger': linger,
+      'round_trips': round_trips,
+      'median_round_trip_us': 1e6 * latencies[len(latencies) // 2],
+      'p99_round_trip_us': 1e6 * latencies[len(latencies) * 99 // 100],
+      'messages': messages,
+      'received': received,
+      'seconds': elapsed,
+      'client_cpu_seconds': cpu,
+      'messages_per_second': received / elapsed,
+  }
+
+
+def _connect(port, queue_size, linger, unix_socket, process, timeout=10):
+  """Returns a PubsubClient, once the server in process is up."""
+  deadline = time.time() + timeout
+  while True:
+    try:
+      return pubsub.PubsubClient(
+          'localhost:{0}'.format(port),
+          inbound_topics=[_ECHO_TOPIC_ID],
+          outbound_topics=[_REQUEST_TOPIC_ID],
+          queue_size=queue_size,
+          overflow=pubsub.OverflowPolicy.BLOCK,
+          linger=linger,
+          prefer_local=unix_socket,
+          set_clock=False)
+    except Exception:
+      if not process.is_alive() or time.time() > deadline:
+        raise
+      time.sleep(0.1)
+
+
+def main(_):
+  result = run(FLAGS.round_trips, FLAGS.messages, FLAGS.linger, FLAGS.port,
+               FLAGS.unix_socket)
+  print('{transport}: round trip {median_round_trip_us:.0f}us median, '
+        '{p99_round_trip_us:.0f}us p99, {messages_per_second:.0f} messages/s '
+        '({received} of {messages} echoed)'.format(**result))
+
+
+if __name__ == '__main__':
+  absl_app.run(main)
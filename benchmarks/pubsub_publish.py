@@ -0,0 +1,113 @@
+"""Measures local Pubsub publish throughput.
+
+Topics are published to subscribers of the local Pubsub whose callbacks
+spin for a given time, as callbacks doing real work would. In 'sync' mode
+callbacks run on the publisher's thread, so their cost adds up per
+subscriber. In 'async' mode they run on dispatcher threads, and throughput
+is measured until the last callback is done.
+
+Usage:
+  python -m common.benchmarks.pubsub_publish --subscribers=1,10,100
+  python -m common.benchmarks.pubsub_publish --callback_us=0,100 --mode=async
+"""
+import threading
+import time
+
+from absl import app as absl_app
+from absl import flags
+
+from common import pubsub
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_list('subscribers', ['0', '1', '10', '100'],
+                  'Numbers of subscribers to measure with.')
+flags.DEFINE_list('callback_us', ['0', '10'],
+                  'Microseconds spent in each callback to measure with.')
+flags.DEFINE_integer('publishes', 100000, 'Number of topics to publish.')
+flags.DEFINE_enum('mode', pubsub.Pubsub.SYNC,
+                  [pubsub.Pubsub.SYNC, pubsub.Pubsub.ASYNC],
+                  'Mode of subscribers.')
+
+_TOPIC_ID = 1
+
+
+def _callback(callback_us, last, done):
+  cost = callback_us / 1e6
+
+  def callback(topic, data):
+    if cost:
+      deadline = time.perf_counter() + cost
+      while time.perf_counter() < deadline:
+        pass
+    if data == last:
+      done.release()
+
+  return callback
+
+
+def run(subscribers=10,
+        callback_us=0,
+        publishes=100000,
+        mode=pubsub.Pubsub.SYNC):
+  """Runs the benchmark with given subscribers.
+
+  Args:
+    subscribers: number of subscribers.
+    callback_us: microseconds spent in each callback.
+    publishes: number of topics to publish.
+    mode: mode of subscribers, Pubsub.SYNC or Pubsub.ASYNC.
+  Returns:
+    A dict of results.
+  """
+  instance = pubsub.Pubsub.get_instance()
+  done = threading.Semaphore(0)
+  callbacks = [
+      _callback(callback_us, publishes - 1, done) for _ in range(subscribers)
+  ]
+  for callback in callbacks:
+    # Async subscribers block publishing rather than drop topics, so every
+    # topic is delivered.
+    instance.subscribe(
+        _TOPIC_ID,
+        callback,
+        mode=mode,
+        queue_size=publishes,
+        overflow=pubsub.OverflowPolicy.BLOCK)
+  try:
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    for i in range(publishes):
+      instance.publish(_TOPIC_ID, i)
+    for _ in callbacks:
+      done.acquire()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - start_cpu
+  finally:
+    for callback in callbacks:
+      instance.unsubscribe(_TOPIC_ID, callback)
+
+  return {
+      'subscribers': subscribers,
+      'callback_us': callback_us,
+      'mode': mode,
+      'publishes': publishes,
+      'seconds': elapsed,
+      'cpu_seconds': cpu,
+      'publishes_per_second': publishes / elapsed,
+      'us_per_publish': 1e6 * elapsed / publishes,
+  }
+
+
+def main(_):
+  for callback_us in FLAGS.callback_us:
+    for subscribers in FLAGS.subscribers:
+      result = run(
+          int(subscribers), float(callback_us), FLAGS.publishes, FLAGS.mode)
+      print('{subscribers} subscribers, {callback_us:g}us callbacks: '
+            '{publishes_per_second:.0f} publishes/s, {us_per_publish:.2f}us '
+            'per publish'.format(**result))
+
+
+if __name__ == '__main__':
+  absl_app.run(main)
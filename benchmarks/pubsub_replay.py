@@ -0,0 +1,65 @@
+"""Measures Pubsub throughput on topics recorded by PubsubRecorder.
+
+Recorded traffic is played as fast as possible into local Pubsub, with a
+PubsubServer listener stream subscribed to all topics, so topic sizes and
+mixes are those of production rather than synthetic ones.
+
+Usage:
+  python -m common.benchmarks.pubsub_replay --journal=/var/log/pubsub
+"""
+import time
+
+from absl import app as absl_app
+from absl import flags
+
+from common import pubsub
+from common import pubsub_journal
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('journal', None, 'Directory of journal files to play.')
+flags.DEFINE_string('prefix', 'pubsub_', 'Prefix of journal file names.')
+flags.mark_flag_as_required('journal')
+
+
+def run(journal, prefix='pubsub_'):
+  """Runs the benchmark.
+
+  Args:
+    journal: directory of journal files, or a list of journal files.
+    prefix: prefix of journal file names, if journal is a directory.
+  Returns:
+    A dict of results. cpu_seconds includes reading journal files.
+  """
+  hub = pubsub._FanoutHub()
+  listener = pubsub._HubListener(None, queue_size=1 << 30)
+  hub.__enter__()
+  hub.add(listener)
+  try:
+    player = pubsub_journal.PubsubPlayer(journal, prefix, speed=None)
+    start_cpu = time.process_time()
+    start = time.time()
+    player.start()
+    player.wait()
+    elapsed = time.time() - start
+    cpu = time.process_time() - start_cpu
+  finally:
+    hub.remove(listener)
+    hub.__exit__(None, None, None)
+
+  return {
+      'topics': player.played,
+      'seconds': elapsed,
+      'cpu_seconds': cpu,
+      'topics_per_second': player.played / elapsed if elapsed else 0,
+  }
+
+
+def main(_):
+  result = run(FLAGS.journal, FLAGS.prefix)
+  print('{topics} topics in {seconds:.2f}s: {topics_per_second:.0f} topics/s, '
+        '{cpu_seconds:.2f}s CPU'.format(**result))
+
+
+if __name__ == '__main__':
+  absl_app.run(main)
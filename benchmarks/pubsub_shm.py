@@ -0,0 +1,115 @@
+"""Measures SharedMemoryServer and SharedMemoryClient latency and throughput.
+
+A SharedMemoryServer in a child process echoes topics sent by a
+SharedMemoryClient in this process back to it, as the loopback benchmark does
+with PubsubServer and PubsubClient, so results of both compare directly.
+
+Usage:
+  python -m common.benchmarks.pubsub_shm --round_trips=1000
+"""
+import multiprocessing
+import os
+import time
+
+from absl import app as absl_app
+from absl import flags
+
+from common import pubsub
+from common import pubsub_shm
+# Also defines --round_trips and --messages used here.
+from common.benchmarks import pubsub_loopback
+
+FLAGS = flags.FLAGS
+
+_ECHO_TOPIC_ID = 1
+_REQUEST_TOPIC_ID = 2
+
+
+def _serve(name, stop):
+  server = pubsub_shm.SharedMemoryServer(name)
+  instance = pubsub.Pubsub.get_instance()
+  echo = lambda topic, data: instance.publish(_ECHO_TOPIC_ID, data)
+  instance.subscribe(_REQUEST_TOPIC_ID, echo)
+  server.start()
+  stop.wait()
+  server.stop()
+
+
+def run(round_trips=1000, messages=20000, timeout=60):
+  """Runs the benchmark against a SharedMemoryServer in a child process.
+
+  Args:
+    round_trips: number of round trips to time.
+    messages: number of topics to echo for throughput.
+    timeout: max seconds to wait for echoes of the throughput run.
+  Returns:
+    A dict of results. messages_per_second counts echoes received, which
+    falls short of messages if a ring buffer was full.
+  """
+  name = 'pubsub_benchmark.{0}'.format(os.getpid())
+  context = multiprocessing.get_context('spawn')
+  stop = context.Event()
+  process = context.Process(
+      target=_serve, args=(name, stop), daemon=True)
+  process.start()
+  instance = pubsub.Pubsub.get_instance()
+  echoes = pubsub_loopback._Echoes()
+  instance.subscribe(_ECHO_TOPIC_ID, echoes.on_topic)
+  client = pubsub_shm.SharedMemoryClient(
+      name,
+      inbound_topics=[_ECHO_TOPIC_ID],
+      outbound_topics=[_REQUEST_TOPIC_ID])
+  client.start()
+  try:
+    # Waits for the client to be connected to the server before measuring.
+    deadline = time.time() + timeout
+    while not echoes.wait_for(-1, 0.1):
+      if not process.is_alive() or time.time() > deadline:
+        raise RuntimeError('Server did not echo.')
+      instance.publish(_REQUEST_TOPIC_ID, -1)
+
+    latencies = []
+    for i in range(round_trips):
+      start = time.perf_counter()
+      instance.publish(_REQUEST_TOPIC_ID, i)
+      if not echoes.wait_for(i, timeout):
+        raise RuntimeError('Echo of round trip {0} timed out.'.format(i))
+      latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    echoes.reset()
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    for i in range(messages):
+      instance.publish(_REQUEST_TOPIC_ID, i)
+    received = echoes.wait_for_count(messages, timeout)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - start_cpu
+  finally:
+    client.stop()
+    instance.unsubscribe(_ECHO_TOPIC_ID, echoes.on_topic)
+    stop.set()
+    process.join()
+
+  return {
+      'transport': 'shm',
+      'round_trips': round_trips,
+      'median_round_trip_us': 1e6 * latencies[len(latencies) // 2],
+      'p99_round_trip_us': 1e6 * latencies[len(latencies) * 99 // 100],
+      'messages': messages,
+      'received': received,
+      'seconds': elapsed,
+      'client_cpu_seconds': cpu,
+      'messages_per_second': received / elapsed,
+  }
+
+
+def main(_):
+  result = run(FLAGS.round_trips, FLAGS.messages)
+  print('{transport}: round trip {median_round_trip_us:.0f}us median, '
+        '{p99_round_trip_us:.0f}us p99, {messages_per_second:.0f} messages/s '
+        '({received} of {messages} echoed)'.format(**result))
+
+
+if __name__ == '__main__':
+  absl_app.run(main)
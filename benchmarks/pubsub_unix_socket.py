@@ -0,0 +1,120 @@
+"""Compares Pubsub latency and throughput over unix domain socket and TCP.
+
+A PubsubServer echoes topics dispatched by a client back to its listener
+stream, once through the loopback TCP port and once through the unix domain
+socket of the server, as PubsubClient picks for a server on the same host.
+
+Usage:
+  python -m common.benchmarks.pubsub_unix_socket --round_trips=2000
+"""
+import queue
+import time
+
+import grpc
+from absl import app as absl_app
+from absl import flags
+
+from common import net
+from common import pubsub
+from common.proto import pubsub_pb2
+from common.proto import pubsub_pb2_grpc
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer('round_trips', 2000, 'Number of round trips to time.')
+flags.DEFINE_integer('publishes', 20000,
+                     'Number of topics to stream for throughput.')
+flags.DEFINE_integer('port', 50181, 'Port for the Pubsub server.')
+
+_ECHO_TOPIC_ID = 1
+_REQUEST_TOPIC_ID = 2
+_STREAM_TOPIC_ID = 3
+
+
+def run(server, target, round_trips=2000, publishes=20000):
+  """Runs the benchmark against a PubsubServer started in this process.
+
+  Args:
+    server: the PubsubServer.
+    target: a grpc target of the server.
+    round_trips: number of round trips to time.
+    publishes: number of topics to stream for throughput.
+  Returns:
+    A dict of results.
+  """
+  instance = pubsub.Pubsub.get_instance()
+  echo = lambda topic, data: instance.publish(_ECHO_TOPIC_ID, data)
+  instance.subscribe(_REQUEST_TOPIC_ID, echo)
+  channel = grpc.insecure_channel(target)
+  stub = pubsub_pb2_grpc.PubsubStub(channel)
+  requests = queue.Queue()
+  dispatch = stub.Dispatch.future(iter(requests.get, None))
+  echoes = stub.Listen(pubsub_pb2.ListenRequest(topic_id=[_ECHO_TOPIC_ID]))
+  stream = stub.Listen(
+      pubsub_pb2.ListenRequest(
+          topic_id=[_STREAM_TOPIC_ID], max_batch_size=100))
+  try:
+    while len(server.dropped) < 2:
+      time.sleep(0.01)
+    # Warms up both streams before measuring.
+    _round_trip(requests, echoes, 0)
+    instance.publish(_STREAM_TOPIC_ID, 0)
+    next(stream)
+
+    latencies = []
+    for i in range(round_trips):
+      start = time.perf_counter()
+      _round_trip(requests, echoes, i)
+      latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    start = time.perf_counter()
+    for i in range(publishes):
+      instance.publish(_STREAM_TOPIC_ID, i)
+    received = 0
+    for response in stream:
+      received += len(response.topics) or 1
+      if received >= publishes:
+        break
+    elapsed = time.perf_counter() - start
+  finally:
+    requests.put(None)
+    dispatch.result()
+    echoes.cancel()
+    stream.cancel()
+    channel.close()
+    instance.unsubscribe(_REQUEST_TOPIC_ID, echo)
+    while server.dropped:
+      time.sleep(0.01)
+
+  return {
+      'target': target,
+      'median_round_trip_us': 1e6 * latencies[len(latencies) // 2],
+      'p99_round_trip_us': 1e6 * latencies[len(latencies) * 99 // 100],
+      'topics_per_second': publishes / elapsed,
+  }
+
+
+def _round_trip(requests, echoes, value):
+  requests.put(
+      pubsub_pb2.DispatchRequest(
+          topic=pubsub_pb2.Topic(id=_REQUEST_TOPIC_ID, integer_value=value)))
+  next(echoes)
+
+
+def main(_):
+  server = pubsub.PubsubServer(port=FLAGS.port, queue_size=FLAGS.publishes)
+  server.start()
+  try:
+    for target in ('localhost:{0}'.format(FLAGS.port),
+                   'unix:' + net.local_socket_path(FLAGS.port)):
+      result = run(server, target, FLAGS.round_trips, FLAGS.publishes)
+      print('{target}: round trip {median_round_trip_us:.0f}us median, '
+            '{p99_round_trip_us:.0f}us p99, {topics_per_second:.0f} '
+            'topics/s'.format(**result))
+  finally:
+    server.stop()
+
+
+if __name__ == '__main__':
+  absl_app.run(main)
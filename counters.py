@@ -1,3 +1,4 @@
+import math
 import time
 
 class Counter(object):
@@ -150,4 +151,60 @@ class Aggregator(object):
         elif self._count == 0:
             return 0
         else:
-            return min(self._data[0:self._index])
\ No newline at end of file
+            return min(self._data[0:self._index])
+
+
+class Histogram(Counter):
+    """Counts values into exponentially growing buckets.
+
+    Bucket 0 holds values below base, bucket i holds values in
+    [base * 2^(i-1), base * 2^i) and the last bucket holds everything above.
+    """
+    def __init__(self, base=1e-6, size=32):
+        self._base = base
+        self._buckets = [0] * size
+        self._sum = 0
+        self._count = 0
+        self._max = 0
+
+    def add(self, value):
+        if value < self._base:
+            index = 0
+        else:
+            index = min(int(math.log2(value / self._base)) + 1,
+                        len(self._buckets) - 1)
+        self._buckets[index] += 1
+        self._sum += value
+        self._count += 1
+        self._max = max(self._max, value)
+
+    def count(self):
+        return self._count
+
+    def sum(self):
+        return self._sum
+
+    def max(self):
+        return self._max
+
+    def percentile(self, percent):
+        """Returns upper bound of the bucket holding given percentile."""
+        if self._count == 0:
+            return 0
+        target = self._count * percent / 100.0
+        total = 0
+        for i, count in enumerate(self._buckets):
+            total += count
+            if total >= target:
+                return min(self._upper_bound(i), self._max)
+        return self._max
+
+    def buckets(self):
+        """Returns a list of (upper_bound, count) for non-empty buckets."""
+        return [(self._upper_bound(i), count)
+                for i, count in enumerate(self._buckets) if count]
+
+    def _upper_bound(self, index):
+        if index == len(self._buckets) - 1:
+            return float('inf')
+        return self._base * 2 ** index
@@ -5,6 +5,7 @@ import threading
 import time
 
 from common import auth
+from common import net
 from common import pattern
 from common.proto import event_pb2
 from common.proto import event_pb2_grpc
@@ -22,8 +23,26 @@ class _ClientInfo(object):
 
 class EventService(event_pb2_grpc.EventServiceServicer, pattern.Logger,
                    pattern.Stopable):
-  def __init__(self, server, *args, **kwargs):
+  def __init__(self,
+               server,
+               compression=None,
+               compression_threshold=1024,
+               *args,
+               **kwargs):
+    """Creates an EventService instance.
+
+    Args:
+      server: a grpc.Server to serve on. Listen on a port with
+              net.add_insecure_ports() so local clients can connect through
+              its unix domain socket.
+      compression: a grpc.Compression for events sent to clients which accept
+                   it, or None for the default of the server.
+      compression_threshold: events smaller than this number of bytes are sent
+                             uncompressed.
+    """
     super(EventService, self).__init__(*args, **kwargs)
+    self._compression = compression
+    self._compression_threshold = compression_threshold if compression else 0
     self._clients = {}
     self._lock = threading.Lock()
     self._abort = False
@@ -60,11 +79,15 @@ class EventService(event_pb2_grpc.EventServiceServicer, pattern.Logger,
         self._clients[client_id.id] = _ClientInfo()
       events = self._clients[client_id.id].events
 
+    if self._compression:
+      context.set_compression(self._compression)
     try:
       while context.is_active() and not self._abort:
         try:
           event = events.get(block=True, timeout=5)
           if event:
+            if event.ByteSize() < self._compression_threshold:
+              context.disable_next_message_compression()
             yield event
         except queue.Empty as e:
           pass
@@ -80,10 +103,26 @@ class EventService(event_pb2_grpc.EventServiceServicer, pattern.Logger,
 
 
 class EventClient(pattern.EventEmitter, pattern.Worker):
-  def __init__(self, client_id, grpc_channel, *args, **kwargs):
+  def __init__(self, client_id, grpc_channel, compression=None, *args,
+               **kwargs):
+    """Creates an EventClient instance.
+
+    Args:
+      client_id: id of this client.
+      grpc_channel: a grpc.Channel to the EventService, or a host:port or
+                    unix:path target to connect to. A host:port target of
+                    this host is reached through its unix domain socket if
+                    the server listens on one.
+      compression: a grpc.Compression for events sent to server, or None for
+                   the default of the channel.
+    """
     super(EventClient, self).__init__(*args, **kwargs)
     self._client = event_pb2.Client(id=client_id)
+    if isinstance(grpc_channel, str):
+      grpc_channel = grpc.insecure_channel(
+          net.prefer_local_target(grpc_channel))
     self._grpc_channel = grpc_channel
+    self._compression = compression
     self._stub = None
     self._listen_response = None
     self._send_future = None
@@ -128,8 +167,10 @@ class EventClient(pattern.EventEmitter, pattern.Worker):
 
     self.logger.info('Connected')
     self._events = queue.Queue(maxsize=100)
-    self._send_future = self._stub.Send.future(self._get_events())
-    self._listen_response = self._stub.Listen(self._client)
+    self._send_future = self._stub.Send.future(
+        self._get_events(), compression=self._compression)
+    self._listen_response = self._stub.Listen(
+        self._client, compression=self._compression)
     threading.Thread(name='EventClient', target=self._listen).start()
     return True
 
@@ -8,6 +8,7 @@ import time
 from concurrent import futures
 
 from common import event
+from common import net
 from common.proto import event_pb2
 from common.proto import event_pb2_grpc
 
@@ -17,15 +18,15 @@ PORT = 50051
 def run_server():
   server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
   monitoring_service = event.EventService(server=server)
-  server.add_insecure_port('[::]:{0}'.format(PORT))
+  net.add_insecure_ports(server, PORT)
   server.start()
   input()
 
 
 def run_client():
   client_id = str(random.randint(0, 10000))
-  channel = grpc.insecure_channel('127.0.0.1:{0}'.format(PORT))
-  client = event.EventClient(client_id=client_id, grpc_channel=channel)
+  client = event.EventClient(
+      client_id=client_id, grpc_channel='127.0.0.1:{0}'.format(PORT))
   client.on('event', on_event)
   client.start()
   try:
@@ -1,3 +1,6 @@
+import collections
+import threading
+
 from . import pattern
 
 
@@ -21,14 +24,22 @@ class EventConsumer(pattern.Worker):
   def _on_run(self):
     message_groups = self._consumer.poll(timeout_ms=500)
     for messages in message_groups.values():
-      for message in messages:
-        self.logger.debug('[{0}:{1}] Received message:\n{2}'.format(
-            message.topic, self._group, message.value))
-        try:
-          self._on_event(message.value)
-        except EventConsumerException as ex:
-          self.logger.warn('[{0}:{1}] Failed to consume message: {2}'.format(
-              message.topic, self._group, ex))
+      self._on_messages(messages)
+
+  def _on_messages(self, messages):
+    """Consumes messages polled from a partition, in order.
+
+    Calls _on_event() with each message by default. Override it to consume
+    messages in batches.
+    """
+    for message in messages:
+      self.logger.debug('[{0}:{1}] Received message:\n{2}'.format(
+          message.topic, self._group, message.value))
+      try:
+        self._on_event(message.value)
+      except EventConsumerException as ex:
+        self.logger.warn('[{0}:{1}] Failed to consume message: {2}'.format(
+            message.topic, self._group, ex))
 
   def _on_event(self, event):
     raise NotImplementedError()
@@ -36,3 +47,89 @@ class EventConsumer(pattern.Worker):
 
 class EventConsumerException(Exception):
   pass
+
+
+KafkaRecord = collections.namedtuple(
+    'KafkaRecord', ['topic', 'partition', 'offset', 'key', 'value'])
+
+KafkaTopicPartition = collections.namedtuple('KafkaTopicPartition',
+                                             ['topic', 'partition'])
+
+
+class InMemoryKafka(object):
+  """Stand-in for a Kafka cluster in tests, holding messages in memory.
+
+  Each topic has a single partition, and each consumer group its own offset.
+  Producers and consumers mimic those of kafka-python closely enough for
+  EventConsumer and code producing messages:
+    kafka = InMemoryKafka()
+    producer = kafka.producer()
+    producer.send('events', value=b'...')
+    consumer = MyEventConsumer(kafka.consumer, 'events', 'my-group')
+  """
+
+  def __init__(self):
+    self._condition = threading.Condition()
+    self._records = collections.defaultdict(list)
+    self._offsets = collections.defaultdict(int)
+
+  def producer(self, *args, **kwargs):
+    """Returns a producer. Arguments are ignored."""
+    return _InMemoryProducer(self)
+
+  def consumer(self, topic, group, *args, **kwargs):
+    """Returns a consumer of given topic for given group."""
+    return _InMemoryConsumer(self, topic, group)
+
+  def records(self, topic):
+    """Returns a list of KafkaRecord of given topic."""
+    with self._condition:
+      return list(self._records[topic])
+
+  def _append(self, topic, key, value):
+    with self._condition:
+      records = self._records[topic]
+      records.append(KafkaRecord(topic, 0, len(records), key, value))
+      self._condition.notify_all()
+
+  def _poll(self, topic, group, timeout, max_records):
+    with self._condition:
+      records = self._records[topic]
+      key = (topic, group)
+      self._condition.wait_for(lambda: len(records) > self._offsets[key],
+                               timeout)
+      offset = self._offsets[key]
+      end = len(records) if max_records is None else offset + max_records
+      polled = records[offset:end]
+      self._offsets[key] = offset + len(polled)
+    return {KafkaTopicPartition(topic, 0): polled} if polled else {}
+
+
+class _InMemoryProducer(object):
+
+  def __init__(self, kafka):
+    self._kafka = kafka
+
+  def send(self, topic, value=None, key=None):
+    self._kafka._append(topic, key, value)
+
+  def flush(self, timeout=None):
+    pass
+
+  def close(self, timeout=None):
+    pass
+
+
+class _InMemoryConsumer(object):
+
+  def __init__(self, kafka, topic, group):
+    self._kafka = kafka
+    self._topic = topic
+    self._group = group
+
+  def poll(self, timeout_ms=0, max_records=None):
+    return self._kafka._poll(self._topic, self._group, timeout_ms / 1000,
+                             max_records)
+
+  def close(self):
+    pass
@@ -1,3 +1,8 @@
+import os
+import socket
+import stat
+import tempfile
+
 import netifaces
 
 
@@ -37,3 +42,121 @@ class Interface(object):
       if addr and 'addr' in addr[0]:
         return addr[0]['addr']
     return None
+
+
+def local_socket_dir():
+  """Returns the directory of unix domain sockets of servers of this user.
+
+  It is $XDG_RUNTIME_DIR/grpc-<uid>, or grpc-<uid> in the temporary directory,
+  and only used if no other user may enter it, so other users can neither
+  take the path of a socket nor connect to it.
+  """
+  base = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+  return os.path.join(base, 'grpc-{0}'.format(os.getuid()))
+
+
+def local_socket_path(port):
+  """Returns path of the unix domain socket a server on given port listens on.
+
+  Servers on this host listen on this socket in addition to the TCP port, so
+  local clients of the same user can skip the TCP stack. See
+  prefer_local_target().
+  """
+  return os.path.join(local_socket_dir(), '{0}.sock'.format(port))
+
+
+def _is_owned(path, file_type, private=False):
+  """Returns whether path is of given type and owned by this user.
+
+  Args:
+    path: path of a file.
+    file_type: a function of the stat module, such as stat.S_ISDIR.
+    private: whether other users must not have any permission on the file.
+  """
+  try:
+    info = os.lstat(path)
+  except OSError:
+    return False
+  if private and info.st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+    return False
+  return file_type(info.st_mode) and info.st_uid == os.getuid()
+
+
+def is_local_host(host):
+  """Returns whether host is an address or name of this host."""
+  host = host.strip('[]')
+  if host in ('', 'localhost', '::1', socket.gethostname()):
+    return True
+  if host.startswith('127.'):
+    return True
+  for name in netifaces.interfaces():
+    for addresses in netifaces.ifaddresses(name).values():
+      if any(x.get('addr') == host for x in addresses):
+        return True
+  return False
+
+
+def prefer_local_target(target):
+  """Returns a unix: target for a host:port target served on this host.
+
+  The target is returned unchanged if it is not a host:port of this host, or
+  if no server of this user is listening on the unix domain socket of its
+  port.
+  """
+  host, sep, port = target.rpartition(':')
+  if not sep or not port.isdigit() or '/' in host or not is_local_host(host):
+    return target
+
+  path = local_socket_path(port)
+  # Only this user can create sockets in a private directory, but the socket
+  # is checked too in case the directory was made private later.
+  if not _is_owned(local_socket_dir(), stat.S_ISDIR, private=True) or (
+      not _is_owned(path, stat.S_ISSOCK)):
+    return target
+  # A socket left by a crashed server refuses connections.
+  probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    probe.connect(path)
+  except OSError:
+    return target
+  finally:
+    probe.close()
+  return 'unix:' + path
+
+
+def add_insecure_ports(server, port, unix_socket=True):
+  """Adds a TCP port and a unix domain socket to a grpc server.
+
+  Args:
+    server: a grpc.Server or grpc.aio.Server.
+    port: TCP port to listen on, or 0 to pick a free port.
+    unix_socket: True to also listen on local_socket_path() of the port, a
+                 path to listen on instead, or False to only listen on TCP.
+                 With True, the server only listens on TCP if
+                 local_socket_dir() can't be made private to this user.
+  Returns:
+    The TCP port listened on.
+  """
+  port = server.add_insecure_port('[::]:{0}'.format(port))
+  if unix_socket is True:
+    unix_socket = local_socket_path(port) if _make_private_dir(
+        local_socket_dir()) else None
+  if unix_socket:
+    server.add_insecure_port('unix:' + unix_socket)
+  return port
+
+
+def _make_private_dir(path):
+  """Creates a directory private to this user unless it exists.
+
+  Returns:
+    False if the directory can't be created, or exists but is not owned by or
+    private to this user.
+  """
+  try:
+    os.mkdir(path, 0o700)
+  except FileExistsError:
+    pass
+  except OSError:
+    return False
+  return _is_owned(path, stat.S_ISDIR, private=True)
@@ -0,0 +1,87 @@
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+from common import net
+
+
+class _FakeServer(object):
+
+  def __init__(self):
+    self.targets = []
+
+  def add_insecure_port(self, target):
+    self.targets.append(target)
+    return NetTests._PORT
+
+
+class NetTests(unittest.TestCase):
+  _PORT = 50171
+
+  def setUp(self):
+    self._runtime_dir = tempfile.mkdtemp()
+    self._xdg_runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    os.environ['XDG_RUNTIME_DIR'] = self._runtime_dir
+    self._path = net.local_socket_path(self._PORT)
+    self.assertTrue(net._make_private_dir(net.local_socket_dir()))
+    self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+  def tearDown(self):
+    self._socket.close()
+    shutil.rmtree(self._runtime_dir)
+    if self._xdg_runtime_dir is None:
+      del os.environ['XDG_RUNTIME_DIR']
+    else:
+      os.environ['XDG_RUNTIME_DIR'] = self._xdg_runtime_dir
+
+  def test_is_local_host(self):
+    self.assertTrue(net.is_local_host('localhost'))
+    self.assertTrue(net.is_local_host('127.0.0.1'))
+    self.assertTrue(net.is_local_host('[::1]'))
+    self.assertTrue(net.is_local_host(socket.gethostname()))
+    self.assertFalse(net.is_local_host('192.0.2.1'))
+
+  def test_prefer_local_target(self):
+    self._socket.bind(self._path)
+    self._socket.listen(1)
+    local_target = 'unix:' + self._path
+    self.assertEqual(
+        net.prefer_local_target('localhost:{0}'.format(self._PORT)),
+        local_target)
+    self.assertEqual(
+        net.prefer_local_target('[::1]:{0}'.format(self._PORT)), local_target)
+    for target in ('192.0.2.1:{0}'.format(self._PORT), 'localhost:50172',
+                   local_target):
+      self.assertEqual(net.prefer_local_target(target), target)
+
+  def test_prefer_local_target_in_shared_dir(self):
+    self._socket.bind(self._path)
+    self._socket.listen(1)
+    os.chmod(net.local_socket_dir(), 0o777)
+    target = 'localhost:{0}'.format(self._PORT)
+    self.assertEqual(net.prefer_local_target(target), target)
+
+  def test_add_insecure_ports(self):
+    server = _FakeServer()
+    os.rmdir(net.local_socket_dir())
+    self.assertEqual(net.add_insecure_ports(server, 0), self._PORT)
+    self.assertEqual(server.targets, ['[::]:0', 'unix:' + self._path])
+    self.assertEqual(os.stat(net.local_socket_dir()).st_mode & 0o777, 0o700)
+
+  def test_add_insecure_ports_with_shared_dir(self):
+    server = _FakeServer()
+    os.chmod(net.local_socket_dir(), 0o755)
+    net.add_insecure_ports(server, 0)
+    self.assertEqual(server.targets, ['[::]:0'])
+
+  def test_prefer_local_target_without_server(self):
+    # A socket left by a crashed server.
+    self._socket.bind(self._path)
+    target = 'localhost:{0}'.format(self._PORT)
+    self.assertEqual(net.prefer_local_target(target), target)
+
+
+if __name__ == '__main__':
+  unittest.main()
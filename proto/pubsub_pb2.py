@@ -21,7 +21,7 @@ DESCRIPTOR = _descriptor.FileDescriptor(
   package='common',
   syntax='proto3',
   serialized_options=None,
-  serialized_pb=_b('\n\x0cpubsub.proto\x12\x06\x63ommon\x1a\x19google/protobuf/any.proto\"\x11\n\x0fRegisterRequest\"%\n\x10RegisterResponse\x12\x11\n\ttimestamp\x18\x01 \x01(\x02\"!\n\rListenRequest\x12\x10\n\x08topic_id\x18\x02 \x03(\x05\".\n\x0eListenResponse\x12\x1c\n\x05topic\x18\x02 \x01(\x0b\x32\r.common.Topic\"/\n\x0f\x44ispatchRequest\x12\x1c\n\x05topic\x18\x02 \x01(\x0b\x32\r.common.Topic\"\x12\n\x10\x44ispatchResponse\"\xbc\x01\n\x05Topic\x12\n\n\x02id\x18\x01 \x01(\x05\x12\x11\n\ttimestamp\x18\x02 \x01(\x02\x12-\n\rmessage_value\x18\n \x01(\x0b\x32\x14.google.protobuf.AnyH\x00\x12\x16\n\x0cstring_value\x18\x0b \x01(\tH\x00\x12\x17\n\rinteger_value\x18\x0c \x01(\x05H\x00\x12\x15\n\x0b\x66loat_value\x18\r \x01(\x02H\x00\x12\x15\n\x0b\x62ytes_value\x18\x0e \x01(\x0cH\x00\x42\x06\n\x04\x64\x61ta2\xc9\x01\n\x06Pubsub\x12?\n\x08Register\x12\x17.common.RegisterRequest\x1a\x18.common.RegisterResponse\"\x00\x12;\n\x06Listen\x12\x15.common.ListenRequest\x1a\x16.common.ListenResponse\"\x00\x30\x01\x12\x41\n\x08\x44ispatch\x12\x17.common.DispatchRequest\x1a\x18.common.DispatchResponse\"\x00(\x01\x62\x06proto3')
+  serialized_pb=_b('\n\x0cpubsub.proto\x12\x06\x63ommon\x1a\x19google/protobuf/any.proto\"\x11\n\x0fRegisterRequest\"^\n\x10RegisterResponse\x12\x11\n\ttimestamp\x18\x01 \x01(\x02\x12\x10\n\x08\x62\x61tching\x18\x02 \x01(\x08\x12\x14\n\x0ctimestamp_ns\x18\x03 \x01(\x03\x12\x0f\n\x07node_id\x18\x04 \x01(\t\"O\n\rListenRequest\x12\x10\n\x08topic_id\x18\x02 \x03(\x05\x12\x16\n\x0emax_batch_size\x18\x03 \x01(\x05\x12\x14\n\x0cresume_after\x18\x04 \x01(\x04\"M\n\x0eListenResponse\x12\x1c\n\x05topic\x18\x02 \x01(\x0b\x32\r.common.Topic\x12\x1d\n\x06topics\x18\x03 \x03(\x0b\x32\r.common.Topic\"N\n\x0f\x44ispatchRequest\x12\x1c\n\x05topic\x18\x02 \x01(\x0b\x32\r.common.Topic\x12\x1d\n\x06topics\x18\x03 \x03(\x0b\x32\r.common.Topic\"\x12\n\x10\x44ispatchResponse\"\x87\x03\n\x05Topic\x12\n\n\x02id\x18\x01 \x01(\x05\x12\x11\n\ttimestamp\x18\x02 \x01(\x02\x12\x10\n\x08sequence\x18\x03 \x01(\x04\x12\x14\n\x0ctimestamp_ns\x18\x04 \x01(\x03\x12\x0e\n\x06origin\x18\x05 \x01(\t\x12\x0c\n\x04hops\x18\x06 \x01(\r\x12-\n\rmessage_value\x18\n \x01(\x0b\x32\x14.google.protobuf.AnyH\x00\x12\x16\n\x0cstring_value\x18\x0b \x01(\tH\x00\x12\x17\n\rinteger_value\x18\x0c \x01(\x05H\x00\x12\x15\n\x0b\x66loat_value\x18\r \x01(\x02H\x00\x12\x15\n\x0b\x62ytes_value\x18\x0e \x01(\x0cH\x00\x12+\n\x0c\x64ouble_array\x18\x0f \x01(\x0b\x32\x13.common.DoubleArrayH\x00\x12)\n\x0bint64_array\x18\x10 \x01(\x0b\x32\x12.common.Int64ArrayH\x00\x12+\n\x0ctyped_buffer\x18\x11 \x01(\x0b\x32\x13.common.TypedBufferH\x00\x42\x06\n\x04\x64\x61ta\"\x1d\n\x0b\x44oubleArray\x12\x0e\n\x06values\x18\x01 \x03(\x01\"\x1c\n\nInt64Array\x12\x0e\n\x06values\x18\x01 \x03(\x12\"9\n\x0bTypedBuffer\x12\r\n\x05\x64type\x18\x01 \x01(\t\x12\r\n\x05shape\x18\x02 \x03(\x03\x12\x0c\n\x04\x64\x61ta\x18\x03 \x01(\x0c\x32\xc9\x01\n\x06Pubsub\x12?\n\x08Register\x12\x17.common.RegisterRequest\x1a\x18.common.RegisterResponse\"\x00\x12;\n\x06Listen\x12\x15.common.ListenRequest\x1a\x16.common.ListenResponse\"\x00\x30\x01\x12\x41\n\x08\x44ispatch\x12\x17.common.DispatchRequest\x1a\x18.common.DispatchResponse\"\x00(\x01\x62\x06proto3')
   ,
   dependencies=[google_dot_protobuf_dot_any__pb2.DESCRIPTOR,])
 
@@ -66,6 +66,27 @@ _REGISTERRESPONSE = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='batching', full_name='common.RegisterResponse.batching', index=1,
+      number=2, type=8, cpp_type=7, label=1,
+      has_default_value=False, default_value=False,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='timestamp_ns', full_name='common.RegisterResponse.timestamp_ns', index=2,
+      number=3, type=3, cpp_type=2, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='node_id', full_name='common.RegisterResponse.node_id', index=3,
+      number=4, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b("").decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
   ],
   extensions=[
   ],
@@ -79,7 +100,7 @@ _REGISTERRESPONSE = _descriptor.Descriptor(
   oneofs=[
   ],
   serialized_start=70,
-  serialized_end=107,
+  serialized_end=164,
 )
 
 
@@ -97,6 +118,20 @@ _LISTENREQUEST = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='max_batch_size', full_name='common.ListenRequest.max_batch_size', index=1,
+      number=3, type=5, cpp_type=1, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='resume_after', full_name='common.ListenRequest.resume_after', index=2,
+      number=4, type=4, cpp_type=4, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
   ],
   extensions=[
   ],
@@ -109,8 +144,8 @@ _LISTENREQUEST = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=109,
-  serialized_end=142,
+  serialized_start=166,
+  serialized_end=245,
 )
 
 
@@ -128,6 +163,13 @@ _LISTENRESPONSE = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='topics', full_name='common.ListenResponse.topics', index=1,
+      number=3, type=11, cpp_type=10, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
   ],
   extensions=[
   ],
@@ -140,8 +182,8 @@ _LISTENRESPONSE = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=144,
-  serialized_end=190,
+  serialized_start=247,
+  serialized_end=324,
 )
 
 
@@ -159,6 +201,13 @@ _DISPATCHREQUEST = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='topics', full_name='common.DispatchRequest.topics', index=1,
+      number=3, type=11, cpp_type=10, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
   ],
   extensions=[
   ],
@@ -171,8 +220,8 @@ _DISPATCHREQUEST = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=192,
-  serialized_end=239,
+  serialized_start=326,
+  serialized_end=404,
 )
 
 
@@ -195,8 +244,8 @@ _DISPATCHRESPONSE = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=241,
-  serialized_end=259,
+  serialized_start=406,
+  serialized_end=424,
 )
 
 
@@ -222,40 +271,89 @@ _TOPIC = _descriptor.Descriptor(
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR),
     _descriptor.FieldDescriptor(
-      name='message_value', full_name='common.Topic.message_value', index=2,
+      name='sequence', full_name='common.Topic.sequence', index=2,
+      number=3, type=4, cpp_type=4, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='timestamp_ns', full_name='common.Topic.timestamp_ns', index=3,
+      number=4, type=3, cpp_type=2, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='origin', full_name='common.Topic.origin', index=4,
+      number=5, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b("").decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='hops', full_name='common.Topic.hops', index=5,
+      number=6, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='message_value', full_name='common.Topic.message_value', index=6,
       number=10, type=11, cpp_type=10, label=1,
       has_default_value=False, default_value=None,
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR),
     _descriptor.FieldDescriptor(
-      name='string_value', full_name='common.Topic.string_value', index=3,
+      name='string_value', full_name='common.Topic.string_value', index=7,
       number=11, type=9, cpp_type=9, label=1,
       has_default_value=False, default_value=_b("").decode('utf-8'),
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR),
     _descriptor.FieldDescriptor(
-      name='integer_value', full_name='common.Topic.integer_value', index=4,
+      name='integer_value', full_name='common.Topic.integer_value', index=8,
       number=12, type=5, cpp_type=1, label=1,
       has_default_value=False, default_value=0,
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR),
     _descriptor.FieldDescriptor(
-      name='float_value', full_name='common.Topic.float_value', index=5,
+      name='float_value', full_name='common.Topic.float_value', index=9,
       number=13, type=2, cpp_type=6, label=1,
       has_default_value=False, default_value=float(0),
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR),
     _descriptor.FieldDescriptor(
-      name='bytes_value', full_name='common.Topic.bytes_value', index=6,
+      name='bytes_value', full_name='common.Topic.bytes_value', index=10,
       number=14, type=12, cpp_type=9, label=1,
       has_default_value=False, default_value=_b(""),
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='double_array', full_name='common.Topic.double_array', index=11,
+      number=15, type=11, cpp_type=10, label=1,
+      has_default_value=False, default_value=None,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='int64_array', full_name='common.Topic.int64_array', index=12,
+      number=16, type=11, cpp_type=10, label=1,
+      has_default_value=False, default_value=None,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='typed_buffer', full_name='common.Topic.typed_buffer', index=13,
+      number=17, type=11, cpp_type=10, label=1,
+      has_default_value=False, default_value=None,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
   ],
   extensions=[
   ],
@@ -271,13 +369,125 @@ _TOPIC = _descriptor.Descriptor(
       name='data', full_name='common.Topic.data',
       index=0, containing_type=None, fields=[]),
   ],
-  serialized_start=262,
-  serialized_end=450,
+  serialized_start=427,
+  serialized_end=818,
+)
+
+
+_DOUBLEARRAY = _descriptor.Descriptor(
+  name='DoubleArray',
+  full_name='common.DoubleArray',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='values', full_name='common.DoubleArray.values', index=0,
+      number=1, type=1, cpp_type=5, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=820,
+  serialized_end=849,
+)
+
+
+_INT64ARRAY = _descriptor.Descriptor(
+  name='Int64Array',
+  full_name='common.Int64Array',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='values', full_name='common.Int64Array.values', index=0,
+      number=1, type=18, cpp_type=2, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=851,
+  serialized_end=879,
+)
+
+
+_TYPEDBUFFER = _descriptor.Descriptor(
+  name='TypedBuffer',
+  full_name='common.TypedBuffer',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='dtype', full_name='common.TypedBuffer.dtype', index=0,
+      number=1, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b("").decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='shape', full_name='common.TypedBuffer.shape', index=1,
+      number=2, type=3, cpp_type=2, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='data', full_name='common.TypedBuffer.data', index=2,
+      number=3, type=12, cpp_type=9, label=1,
+      has_default_value=False, default_value=_b(""),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=881,
+  serialized_end=938,
 )
 
 _LISTENRESPONSE.fields_by_name['topic'].message_type = _TOPIC
+_LISTENRESPONSE.fields_by_name['topics'].message_type = _TOPIC
 _DISPATCHREQUEST.fields_by_name['topic'].message_type = _TOPIC
+_DISPATCHREQUEST.fields_by_name['topics'].message_type = _TOPIC
 _TOPIC.fields_by_name['message_value'].message_type = google_dot_protobuf_dot_any__pb2._ANY
+_TOPIC.fields_by_name['double_array'].message_type = _DOUBLEARRAY
+_TOPIC.fields_by_name['int64_array'].message_type = _INT64ARRAY
+_TOPIC.fields_by_name['typed_buffer'].message_type = _TYPEDBUFFER
 _TOPIC.oneofs_by_name['data'].fields.append(
   _TOPIC.fields_by_name['message_value'])
 _TOPIC.fields_by_name['message_value'].containing_oneof = _TOPIC.oneofs_by_name['data']
@@ -293,6 +503,15 @@ _TOPIC.fields_by_name['float_value'].containing_oneof = _TOPIC.oneofs_by_name['d
 _TOPIC.oneofs_by_name['data'].fields.append(
   _TOPIC.fields_by_name['bytes_value'])
 _TOPIC.fields_by_name['bytes_value'].containing_oneof = _TOPIC.oneofs_by_name['data']
+_TOPIC.oneofs_by_name['data'].fields.append(
+  _TOPIC.fields_by_name['double_array'])
+_TOPIC.fields_by_name['double_array'].containing_oneof = _TOPIC.oneofs_by_name['data']
+_TOPIC.oneofs_by_name['data'].fields.append(
+  _TOPIC.fields_by_name['int64_array'])
+_TOPIC.fields_by_name['int64_array'].containing_oneof = _TOPIC.oneofs_by_name['data']
+_TOPIC.oneofs_by_name['data'].fields.append(
+  _TOPIC.fields_by_name['typed_buffer'])
+_TOPIC.fields_by_name['typed_buffer'].containing_oneof = _TOPIC.oneofs_by_name['data']
 DESCRIPTOR.message_types_by_name['RegisterRequest'] = _REGISTERREQUEST
 DESCRIPTOR.message_types_by_name['RegisterResponse'] = _REGISTERRESPONSE
 DESCRIPTOR.message_types_by_name['ListenRequest'] = _LISTENREQUEST
@@ -300,6 +519,9 @@ DESCRIPTOR.message_types_by_name['ListenResponse'] = _LISTENRESPONSE
 DESCRIPTOR.message_types_by_name['DispatchRequest'] = _DISPATCHREQUEST
 DESCRIPTOR.message_types_by_name['DispatchResponse'] = _DISPATCHRESPONSE
 DESCRIPTOR.message_types_by_name['Topic'] = _TOPIC
+DESCRIPTOR.message_types_by_name['DoubleArray'] = _DOUBLEARRAY
+DESCRIPTOR.message_types_by_name['Int64Array'] = _INT64ARRAY
+DESCRIPTOR.message_types_by_name['TypedBuffer'] = _TYPEDBUFFER
 _sym_db.RegisterFileDescriptor(DESCRIPTOR)
 
 RegisterRequest = _reflection.GeneratedProtocolMessageType('RegisterRequest', (_message.Message,), {
@@ -351,6 +573,27 @@ Topic = _reflection.GeneratedProtocolMessageType('Topic', (_message.Message,), {
   })
 _sym_db.RegisterMessage(Topic)
 
+DoubleArray = _reflection.GeneratedProtocolMessageType('DoubleArray', (_message.Message,), {
+  'DESCRIPTOR' : _DOUBLEARRAY,
+  '__module__' : 'pubsub_pb2'
+  # @@protoc_insertion_point(class_scope:common.DoubleArray)
+  })
+_sym_db.RegisterMessage(DoubleArray)
+
+Int64Array = _reflection.GeneratedProtocolMessageType('Int64Array', (_message.Message,), {
+  'DESCRIPTOR' : _INT64ARRAY,
+  '__module__' : 'pubsub_pb2'
+  # @@protoc_insertion_point(class_scope:common.Int64Array)
+  })
+_sym_db.RegisterMessage(Int64Array)
+
+TypedBuffer = _reflection.GeneratedProtocolMessageType('TypedBuffer', (_message.Message,), {
+  'DESCRIPTOR' : _TYPEDBUFFER,
+  '__module__' : 'pubsub_pb2'
+  # @@protoc_insertion_point(class_scope:common.TypedBuffer)
+  })
+_sym_db.RegisterMessage(TypedBuffer)
+
 
 
 _PUBSUB = _descriptor.ServiceDescriptor(
@@ -359,8 +602,8 @@ _PUBSUB = _descriptor.ServiceDescriptor(
   file=DESCRIPTOR,
   index=0,
   serialized_options=None,
-  serialized_start=453,
-  serialized_end=654,
+  serialized_start=941,
+  serialized_end=1142,
   methods=[
   _descriptor.MethodDescriptor(
     name='Register',
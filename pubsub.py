@@ -1,8 +1,17 @@
 import queue
 import abc
+import collections
 import datetime
 import enum
+import functools
 import grpc
+import heapq
+import itertools
+import numbers
+import operator
+import os
+import random
+import socket
 import sys
 import threading
 import time
@@ -10,77 +19,814 @@ import traceback
 
 from concurrent import futures
 
-from google.protobuf.internal import python_message
+from google.protobuf import message
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
 
 from common import clocks
-from common import io
+from common import counters
+from common import net
 from common import pattern
+from common import serialization
 from common.proto import pubsub_pb2
 from common.proto import pubsub_pb2_grpc
 
 
+class OverflowPolicy(enum.Enum):
+  """What to do when a bounded topic queue is full."""
+  DROP_OLDEST = 'drop_oldest'
+  DROP_NEWEST = 'drop_newest'
+  BLOCK = 'block'
+  # Keeps only the latest pending value of each topic. Only supported by
+  # queues of remote topics.
+  COALESCE = 'coalesce'
+
+
 class _SubscriberInfo(object):
 
-  def __init__(self, callback, min_interval):
+  def __init__(self, callback, min_interval, delivery=None):
+    self.topic = None
     self.callback = callback
-    self.min_interval = min_interval
+    self.min_interval = min_interval.total_seconds()
     self.last_transmission = time.time()
+    self.delivery = delivery
+    self.deliver = delivery.put if delivery else callback
+
+  def offer(self, ts, topic, data):
+    """Delivers a topic unless it arrives within min_interval of last delivery.
+
+    Returns:
+      True if the topic was delivered.
+    """
+    # Without min_interval nothing is dropped, even if concurrent publishers
+    # offer topics out of timestamp order.
+    if self.min_interval and ts - self.last_transmission < self.min_interval:
+      return False
+    self.last_transmission = ts
+    self.deliver(topic, data)
+    return True
+
+  def close(self):
+    if self.delivery:
+      self.delivery.close()
+
+  def hold(self):
+    """Holds back deliveries until seed(), so that seeded topics come first."""
+    self._seed_lock = threading.RLock()
+    self._held = []
+    self._deliver_now = self.deliver
+    self.deliver = self._hold
+
+  def seed(self, topics, on_error):
+    """Delivers topics, then deliveries held back since hold().
+
+    Topics also held back are skipped, as held values are newer.
+
+    Args:
+      topics: a list of (topic, data) tuples.
+      on_error: a function called without arguments on exceptions.
+    """
+    with self._seed_lock:
+      held, self._held = self._held, None
+      self.deliver = self._deliver_now
+      newer = self._held_topics(held)
+      topics = [x for x in topics if x[0] not in newer]
+      for args in self._seed_calls(topics) + held:
+        try:
+          self._deliver_now(*args)
+        except:
+          on_error()
+
+  def _hold(self, *args):
+    # Publishers which looked up deliver before seed() wait for it to finish.
+    with self._seed_lock:
+      if self._held is not None:
+        self._held.append(args)
+        return
+    self._deliver_now(*args)
+
+  @staticmethod
+  def _held_topics(held):
+    return set(args[0] for args in held)
+
+  @staticmethod
+  def _seed_calls(topics):
+    return list(topics)
+
+
+class _BatchSubscriberInfo(_SubscriberInfo):
+  """Subscriber whose callback takes a list of (topic, data) tuples."""
+
+  def offer(self, ts, topic, data):
+    return self.offer_many(ts, [(topic, data)])
+
+  def offer_many(self, ts, topics):
+    if self.min_interval and ts - self.last_transmission < self.min_interval:
+      return False
+    self.last_transmission = ts
+    self.deliver(topics)
+    return True
+
+  @staticmethod
+  def _held_topics(held):
+    return set(topic for args in held for topic, _ in args[0])
+
+  @staticmethod
+  def _seed_calls(topics):
+    return [(topics,)] if topics else []
+
+
+class _ConflatingSubscriberInfo(_SubscriberInfo):
+  """Holds back topics arriving within min_interval instead of dropping them.
+
+  Only the newest value of each topic is kept, and it is delivered by the
+  shared timer as soon as the interval expires, even if nothing else is
+  published afterwards.
+  """
+
+  def __init__(self, callback, min_interval, delivery, timer, on_error):
+    super(_ConflatingSubscriberInfo, self).__init__(callback, min_interval,
+                                                    delivery)
+    self._timer = timer
+    self._on_error = on_error
+    self._lock = threading.RLock()
+    self._pending = collections.OrderedDict()
+    self._armed = False
+    self._closed = False
+
+  def offer(self, ts, topic, data):
+    with self._lock:
+      if ts - self.last_transmission < self.min_interval:
+        self._pending.pop(topic, None)
+        self._pending[topic] = data
+        if not self._armed and not self._closed:
+          self._armed = True
+          self._timer.schedule(self.last_transmission + self.min_interval,
+                               self._flush)
+        return False
+
+      self._pending.pop(topic, None)
+      self.last_transmission = ts
+      self.deliver(topic, data)
+      return True
+
+  def close(self):
+    with self._lock:
+      self._closed = True
+      self._pending.clear()
+    super(_ConflatingSubscriberInfo, self).close()
+
+  def _flush(self):
+    with self._lock:
+      self._armed = False
+      if not self._pending:
+        return
+      self.last_transmission = time.time()
+      while self._pending:
+        topic, data = self._pending.popitem(last=False)
+        try:
+          self.deliver(topic, data)
+        except:
+          self._on_error()
+
+
+class _Timer(object):
+  """Runs callbacks at given times on a single shared thread."""
+
+  def __init__(self, name):
+    self._name = name
+    self._condition = threading.Condition()
+    self._schedule = []
+    self._counter = itertools.count()
+    self._thread = None
+
+  def schedule(self, when, callback):
+    """Schedules callback to run at given time.
+
+    Args:
+      when: a timestamp as returned by time.time().
+      callback: a function taking no argument.
+    """
+    with self._condition:
+      heapq.heappush(self._schedule, (when, next(self._counter), callback))
+      if not self._thread:
+        self._thread = threading.Thread(name=self._name, target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+      self._condition.notify()
+
+  def _run(self):
+    while True:
+      with self._condition:
+        if not self._schedule:
+          self._condition.wait()
+          continue
+        delay = self._schedule[0][0] - time.time()
+        if delay > 0:
+          self._condition.wait(delay)
+          continue
+        _, _, callback = heapq.heappop(self._schedule)
+
+      callback()
+
+
+class _AsyncDelivery(object):
+  """Queues topics for one subscriber and runs its callback on a shared pool.
+
+  At most one dispatcher thread drains a given queue at a time, so the
+  subscriber still receives topics in publishing order.
+  """
+
+  # Max topics delivered per dispatcher task before yielding the thread to
+  # other subscribers.
+  _MAX_DRAIN = 64
+
+  def __init__(self, callback, executor, queue_size, overflow, on_error):
+    self._callback = callback
+    self._executor = executor
+    self._queue_size = queue_size
+    self._overflow = overflow
+    self._on_error = on_error
+    self._queue = collections.deque()
+    self._condition = threading.Condition()
+    self._scheduled = False
+    self._closed = False
+    self._dropped = 0
+
+  @property
+  def dropped(self):
+    return self._dropped
+
+  def put(self, topic, data):
+    with self._condition:
+      if len(self._queue) >= self._queue_size:
+        if self._overflow == OverflowPolicy.DROP_NEWEST:
+          self._dropped += 1
+          return
+        elif self._overflow == OverflowPolicy.DROP_OLDEST:
+          self._queue.popleft()
+          self._dropped += 1
+        else:
+          while len(self._queue) >= self._queue_size and not self._closed:
+            self._condition.wait()
+      if self._closed:
+        return
+
+      self._queue.append((topic, data))
+      if not self._scheduled:
+        self._scheduled = True
+        self._executor.submit(self._drain)
+
+  def close(self):
+    with self._condition:
+      self._closed = True
+      self._queue.clear()
+      self._condition.notify_all()
+
+  def _drain(self):
+    for _ in range(self._MAX_DRAIN):
+      with self._condition:
+        if not self._queue:
+          self._scheduled = False
+          return
+        topic, data = self._queue.popleft()
+        self._condition.notify()
+
+      try:
+        self._callback(topic, data)
+      except:
+        self._on_error()
+
+    with self._condition:
+      if self._queue:
+        self._executor.submit(self._drain)
+      else:
+        self._scheduled = False
+
+
+def _is_topic_pattern(topic):
+  return isinstance(topic, str) and any(
+      x in ('*', '#') for x in topic.split('/'))
+
+
+def _check_topic_pattern(topic):
+  """Raises ValueError if topic is a pattern with '#' before its last level."""
+  if isinstance(topic, str) and '#' in topic.split('/')[:-1]:
+    raise ValueError('Invalid topic pattern: ' + topic)
+
+
+class _TopicTrie(object):
+  """Index of topic patterns, such as 'sensors/*/temp' or 'gps/#'.
+
+  Levels of a topic are separated by '/'. '*' matches exactly one level and
+  '#', which must be the last level, matches zero or more trailing levels.
+  """
+
+  class _Node(object):
+
+    def __init__(self):
+      self.children = {}
+      self.subscribers = ()
+
+  def __init__(self, patterns):
+    """Creates a _TopicTrie instance.
+
+    Args:
+      patterns: a dict of topic pattern => tuple of _SubscriberInfo.
+    """
+    self._root = self._Node()
+    for pattern, subscribers in patterns.items():
+      node = self._root
+      for level in pattern.split('/'):
+        node = node.children.setdefault(level, self._Node())
+      node.subscribers += subscribers
+
+  def match(self, topic):
+    """Returns a tuple of _SubscriberInfo whose pattern matches given topic."""
+    subscribers = ()
+    nodes = [self._root]
+    for level in topic.split('/'):
+      next_nodes = []
+      for node in nodes:
+        children = node.children
+        if '#' in children:
+          subscribers += children['#'].subscribers
+        if level in children:
+          next_nodes.append(children[level])
+        if '*' in children:
+          next_nodes.append(children['*'])
+      nodes = next_nodes
+      if not nodes:
+        return subscribers
+
+    for node in nodes:
+      subscribers += node.subscribers
+      if '#' in node.children:
+        subscribers += node.children['#'].subscribers
+    return subscribers
+
+
+class _DispatchTable(object):
+  """Immutable snapshot of subscribers, looked up by Pubsub.publish().
+
+  A new table is built on every subscribe/unsubscribe and swapped in with a
+  single assignment, so publishing never takes a lock and never observes a
+  partially updated subscriber list. Subscribers of each published topic are
+  resolved once against exact topics, topic patterns and default subscribers,
+  then cached in the table.
+  """
+
+  _MAX_RESOLVED_TOPICS = 10000
+
+  def __init__(self, subscriptions):
+    """Creates a _DispatchTable instance.
+
+    Args:
+      subscriptions: a dict of topic => {callback: _SubscriberInfo}. Default
+                     subscribers are stored under None.
+    """
+    self._default_subscribers = ()
+    self._topics = {}
+    patterns = {}
+    for topic, subscribers in subscriptions.items():
+      if topic is None:
+        self._default_subscribers = tuple(subscribers.values())
+      elif _is_topic_pattern(topic):
+        patterns[topic] = tuple(subscribers.values())
+      else:
+        self._topics[topic] = tuple(subscribers.values())
+    self._trie = _TopicTrie(patterns) if patterns else None
+    self._resolved = {}
+
+  def lookup(self, topic):
+    """Returns a tuple of _SubscriberInfo to receive given topic."""
+    subscribers = self._resolved.get(topic)
+    if subscribers is None:
+      subscribers = self._topics.get(topic, ())
+      if self._trie and isinstance(topic, str):
+        subscribers += self._trie.match(topic)
+      subscribers += self._default_subscribers
+      if len(self._resolved) >= self._MAX_RESOLVED_TOPICS:
+        self._resolved.clear()
+      self._resolved[topic] = subscribers
+    return subscribers
+
+
+class _RetainedValues(object):
+  """Bounded store of the last value published to each retained topic.
+
+  When full, the least recently published topic is evicted first.
+  """
+
+  def __init__(self, max_topics, retain_all):
+    self._max_topics = max_topics
+    self._retain_all = retain_all
+    self._retention = {}
+    self._values = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def set_retention(self, topic, retain):
+    with self._lock:
+      self._retention[topic] = retain
+      if not retain:
+        self._values.pop(topic, None)
+
+  def put(self, topic, data):
+    if not self._retention.get(topic, self._retain_all):
+      return
+    with self._lock:
+      self._values[topic] = data
+      self._values.move_to_end(topic)
+      if len(self._values) > self._max_topics:
+        self._values.popitem(last=False)
+
+  def get(self, key):
+    """Returns a list of (topic, data) tuples matching a subscription key."""
+    with self._lock:
+      if key is None:
+        return list(self._values.items())
+      if not _is_topic_pattern(key):
+        return [(key, self._values[key])] if key in self._values else []
+      items = list(self._values.items())
+
+    trie = _TopicTrie({key: (key,)})
+    return [(topic, data)
+            for topic, data in items
+            if isinstance(topic, str) and trie.match(topic)]
+
+
+def _payload_size(data):
+  if isinstance(data, (str, bytes)):
+    return len(data)
+  if hasattr(data, 'ByteSize'):
+    return data.ByteSize()
+  if hasattr(data, 'nbytes'):
+    return data.nbytes
+  return sys.getsizeof(data)
+
+
+class _Instrumentation(object):
+  """Per-topic and per-subscriber statistics of a Pubsub."""
+
+  class _TopicStats(object):
+
+    def __init__(self, topic):
+      self.publishes = counters.PerfCounter('{0}.publishes'.format(topic))
+      self.fanout = counters.PerfCounter('{0}.fanout'.format(topic))
+      self.bytes = counters.PerfCounter('{0}.bytes'.format(topic))
+
+  class _SubscriberStats(object):
+
+    def __init__(self, name):
+      self.name = name
+      self.latency = counters.Histogram()
+      self.exceptions = counters.PerfCounter(name + '.exceptions')
+      self.suppressed = counters.PerfCounter(name + '.suppressed')
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._topics = {}
+    self._subscribers = {}
+
+  def on_publish(self, topic, data, fanout):
+    with self._lock:
+      stats = self._topics.get(topic)
+      if not stats:
+        stats = self._topics[topic] = self._TopicStats(topic)
+      stats.publishes.increase()
+      stats.fanout.add(fanout)
+      stats.bytes.add(_payload_size(data))
+
+  def on_offer(self, info, delivered, latency):
+    with self._lock:
+      stats = self._get_subscriber_stats(info)
+      if delivered:
+        stats.latency.add(latency)
+      else:
+        stats.suppressed.increase()
+
+  def on_exception(self, info):
+    with self._lock:
+      self._get_subscriber_stats(info).exceptions.increase()
+
+  def snapshot(self):
+    with self._lock:
+      topics = {
+          topic: {
+              'publishes': stats.publishes.count(),
+              'publishes_last_minute': stats.publishes.last_minute.count(),
+              'average_fanout': stats.fanout.average(),
+              'bytes': stats.bytes.sum(),
+              'bytes_last_minute': stats.bytes.last_minute.sum(),
+          } for topic, stats in self._topics.items()
+      }
+      subscribers = {
+          stats.name: {
+              'deliveries': stats.latency.count(),
+              'average_latency': stats.latency.average(),
+              'p99_latency': stats.latency.percentile(99),
+              'max_latency': stats.latency.max(),
+              'latency_histogram': stats.latency.buckets(),
+              'exceptions': stats.exceptions.count(),
+              'suppressed': stats.suppressed.count(),
+          } for stats in self._subscribers.values()
+      }
+    return {'topics': topics, 'subscribers': subscribers}
+
+  def _get_subscriber_stats(self, info):
+    stats = self._subscribers.get(info)
+    if not stats:
+      callback = info.callback
+      name = getattr(callback, '__qualname__', None) or repr(callback)
+      owner = getattr(callback, '__self__', None)
+      if owner is not None:
+        name = '{0}@{1:x}'.format(name, id(owner))
+      name = '{0}:{1}'.format(info.topic, name)
+      stats = self._subscribers[info] = self._SubscriberStats(name)
+    return stats
 
 
 class Pubsub(pattern.Singleton, pattern.Logger):
 
-  def __init__(self, *args, **kwargs):
+  SYNC = 'sync'
+  ASYNC = 'async'
+
+  def __init__(self, dispatcher_workers=4, *args, **kwargs):
+    """Creates a Pubsub instance.
+
+    Args:
+      dispatcher_workers: number of threads shared by all subscribers of
+                          'async' mode.
+    """
     super(Pubsub, self).__init__(*args, **kwargs)
-    self._topics = {}
-    self._default_subscribers = []
+    self._lock = threading.Lock()
+    self._subscriptions = {}
+    self._table = _DispatchTable(self._subscriptions)
+    self._dispatcher_workers = dispatcher_workers
+    self._executor = None
+    self._timer = _Timer('Pubsub.Timer')
+    self._retained = None
+    self._instrumentation = None
+
+  def enable_instrumentation(self):
+    """Starts recording statistics of topics and subscribers.
+
+    Per topic: publish count and rate, fan-out and bytes published. Per
+    subscriber: callback latency, exceptions and deliveries suppressed by
+    min_interval. Latency of 'async' subscribers is the time to queue a topic.
+    Topics without any subscriber are not recorded.
+
+    Instrumented publishing methods are swapped in only while enabled, so
+    there is no cost otherwise.
+    """
+    self._instrumentation = _Instrumentation()
+    self._publish = self._publish_instrumented
+    self._publish_many = self._publish_many_instrumented
+
+  def disable_instrumentation(self):
+    if self._instrumentation is None:
+      return
+    self._instrumentation = None
+    del self._publish
+    del self._publish_many
+
+  def get_stats(self):
+    """Returns a snapshot of statistics as a dict.
+
+    Returns:
+      A dict with 'topics', a dict of topic => topic statistics, and
+      'subscribers', a dict of subscriber name => subscriber statistics. Empty
+      if instrumentation is not enabled.
+    """
+    if not self._instrumentation:
+      return {}
+    return self._instrumentation.snapshot()
+
+  def enable_retention(self, max_topics=1000, retain_all=True):
+    """Keeps the last value of topics for subscribers joining later.
+
+    A new subscriber immediately receives retained values of all topics it
+    subscribes to.
+
+    Args:
+      max_topics: max number of topics to retain. Least recently published
+                  topics are evicted first.
+      retain_all: whether topics are retained unless disabled by
+                  set_retention().
+    """
+    self._retained = _RetainedValues(max_topics, retain_all)
+
+  def set_retention(self, topic, retain):
+    """Enables or disables retention of a single topic."""
+    assert self._retained, 'Retention is not enabled.'
+    self._retained.set_retention(topic, retain)
+
+  def get_retained(self, topic=None):
+    """Returns a list of retained (topic, data) tuples matching given topic.
+
+    Args:
+      topic: topic id or pattern, or None for all retained topics.
+    """
+    if not self._retained:
+      return []
+    return self._retained.get(topic if topic else None)
 
   def publish(self, topic, data):
-    if topic in self._topics:
-      self._publish(self._topics[topic], topic, data)
-    if self._default_subscribers:
-      self._publish(self._default_subscribers, topic, data)
-
-  def subscribe(self, topic, callback, min_interval=None):
-    if topic:
-      if topic not in self._topics:
-        self._topics[topic] = []
-      self._subscribe(self._topics[topic], callback, min_interval)
-    else:
-      self._subscribe(self._default_subscribers, callback, min_interval)
+    if self._retained:
+      self._retained.put(topic, data)
+    subscribers = self._table.lookup(topic)
+    if subscribers:
+      self._publish(subscribers, topic, data)
+
+  def publish_many(self, topics):
+    """Publishes a batch of topics.
+
+    Subscribers are resolved once per distinct topic and the whole batch is
+    published with a single timestamp. Subscribers registered with batch=True
+    receive their share of the batch in one callback, as the given tuples.
+
+    Args:
+      topics: a list of (topic, data) tuples.
+    """
+    table = self._table
+    retained = self._retained
+    resolved = {}
+    batches = collections.OrderedDict()
+    for item in topics:
+      topic, data = item
+      if retained:
+        retained.put(topic, data)
+      subscribers = resolved.get(topic)
+      if subscribers is None:
+        subscribers = resolved[topic] = table.lookup(topic)
+      for info in subscribers:
+        batch = batches.get(info)
+        if batch is None:
+          batch = batches[info] = []
+        batch.append(item)
+
+    if batches:
+      self._publish_many(batches, time.time())
+
+  def subscribe(self,
+                topic,
+                callback,
+                min_interval=None,
+                mode=SYNC,
+                queue_size=100,
+                overflow=OverflowPolicy.DROP_OLDEST,
+                conflate=False,
+                batch=False):
+    """Subscribes callback to a topic.
+
+    Args:
+      topic: topic id to subscribe, or None to receive all topics. A string
+             topic may be a pattern, such as 'sensors/*/temp' or 'gps/#'.
+      callback: a function taking (topic, data), or a list of (topic, data)
+                tuples if batch is True.
+      min_interval: a datetime.timedelta object. Topics arriving within this
+                    interval since last delivery are dropped.
+      mode: 'sync' to call callback on publisher's thread, or 'async' to queue
+            topics and call callback on a shared dispatcher thread, so a slow
+            callback does not hold up publishers.
+      queue_size: max number of pending topics in 'async' mode.
+      overflow: an OverflowPolicy applied when the 'async' queue is full.
+      conflate: if True, topics arriving within min_interval are not dropped.
+                The newest value of each topic is delivered instead once the
+                interval expires.
+      batch: if True, callback receives topics of publish_many() in a single
+             call. Only supported in 'sync' mode without conflation.
+    Raises:
+      ValueError: if topic is a pattern with '#' before its last level.
+    """
+    _check_topic_pattern(topic)
+    assert mode in (self.SYNC, self.ASYNC)
+    assert not batch or (mode == self.SYNC and not conflate)
+    assert overflow != OverflowPolicy.COALESCE
+    if not min_interval:
+      min_interval = datetime.timedelta(seconds=0)
+
+    key = topic if topic else None
+    retained = self._retained
+    with self._lock:
+      subscribers = self._subscriptions.setdefault(key, {})
+      assert callback not in subscribers
+      delivery = None
+      if mode == self.ASYNC:
+        delivery = _AsyncDelivery(callback, self._get_executor(), queue_size,
+                                  overflow, self._log_exception)
+      if batch:
+        info = _BatchSubscriberInfo(callback, min_interval)
+      elif conflate:
+        info = _ConflatingSubscriberInfo(callback, min_interval, delivery,
+                                         self._timer, self._log_exception)
+      else:
+        info = _SubscriberInfo(callback, min_interval, delivery)
+      info.topic = key
+      if retained:
+        info.hold()
+      subscribers[callback] = info
+      self._table = _DispatchTable(self._subscriptions)
+
+    if retained:
+      # Read once publishers see the subscriber, so no value is missed, and
+      # values they deliver meanwhile are held back so none ends up stale.
+      info.seed(retained.get(key), self._log_exception)
 
   def unsubscribe(self, topic, callback):
-    if topic:
-      assert topic in self._topics
-      self._unsubscribe(self._topics[topic], callback)
-    else:
-      self._unsubscribe(self._default_subscribers, callback)
+    key = topic if topic else None
+    with self._lock:
+      assert key in self._subscriptions
+      subscribers = self._subscriptions[key]
+      assert callback in subscribers
+      info = subscribers.pop(callback)
+      if not subscribers:
+        del self._subscriptions[key]
+      self._table = _DispatchTable(self._subscriptions)
+    info.close()
 
   def _publish(self, subscribers, topic, data):
     ts = time.time()
     for info in subscribers:
-      if ts - info.last_transmission >= info.min_interval.total_seconds():
+      try:
+        info.offer(ts, topic, data)
+      except:
+        self._log_exception()
+
+  def _publish_many(self, batches, ts):
+    for info, topics in batches.items():
+      if isinstance(info, _BatchSubscriberInfo):
         try:
-          info.callback(topic, data)
+          info.offer_many(ts, topics)
         except:
-          exc_type, exc_value, exc_traceback = sys.exc_info()
-          msg = traceback.format_exception(exc_type, exc_value, exc_traceback)
-          self.logger.warn('\n'.join(msg))
-
-        info.last_transmission = ts
-
-  def _subscribe(self, subscribers, callback, min_interval):
-    info = [x for x in subscribers if x.callback == callback]
-    assert not info
-
-    if not min_interval:
-      min_interval = datetime.timedelta(seconds=0)
+          self._log_exception()
+      else:
+        for topic, data in topics:
+          try:
+            info.offer(ts, topic, data)
+          except:
+            self._log_exception()
+
+  def _publish_instrumented(self, subscribers, topic, data):
+    instrumentation = self._instrumentation
+    instrumentation.on_publish(topic, data, len(subscribers))
+    ts = time.time()
+    for info in subscribers:
+      start = time.perf_counter()
+      try:
+        delivered = info.offer(ts, topic, data)
+      except:
+        instrumentation.on_exception(info)
+        self._log_exception()
+      else:
+        instrumentation.on_offer(info, delivered, time.perf_counter() - start)
+
+  def _publish_many_instrumented(self, batches, ts):
+    instrumentation = self._instrumentation
+    fanout = collections.Counter()
+    for topics in batches.values():
+      fanout.update(set(topic for topic, _ in topics))
+    # Each topic is recorded from the batch of its first subscriber, which
+    # holds every occurrence of the topic.
+    recorders = {}
+    for info, topics in batches.items():
+      for topic, data in topics:
+        if recorders.setdefault(topic, info) is info:
+          instrumentation.on_publish(topic, data, fanout[topic])
+
+    for info, topics in batches.items():
+      if isinstance(info, _BatchSubscriberInfo):
+        calls = [functools.partial(info.offer_many, ts, topics)]
+      else:
+        calls = [
+            functools.partial(info.offer, ts, topic, data)
+            for topic, data in topics
+        ]
+      for call in calls:
+        start = time.perf_counter()
+        try:
+          delivered = call()
+        except:
+          instrumentation.on_exception(info)
+          self._log_exception()
+        else:
+          instrumentation.on_offer(info, delivered,
+                                   time.perf_counter() - start)
 
-    subscribers.append(_SubscriberInfo(callback, min_interval))
+  def _get_executor(self):
+    if not self._executor:
+      self._executor = futures.ThreadPoolExecutor(
+          max_workers=self._dispatcher_workers,
+          thread_name_prefix='Pubsub.Dispatcher')
+    return self._executor
 
-  def _unsubscribe(self, subscribers, callback):
-    info = [x for x in subscribers if x.callback == callback]
-    assert info
-    subscribers.remove(info[0])
+  def _log_exception(self):
+    exc_type, exc_value, exc_traceback = sys.exc_info()
+    msg = traceback.format_exception(exc_type, exc_value, exc_traceback)
+    self.logger.warn('\n'.join(msg))
 
 
 class Publisher(object):
@@ -92,6 +838,9 @@ class Publisher(object):
   def publish(self, topic, data):
     self._pubsub.publish(topic, data)
 
+  def publish_many(self, topics):
+    self._pubsub.publish_many(topics)
+
 
 class Subscriber(object):
 
@@ -99,8 +848,8 @@ class Subscriber(object):
     super(Subscriber, self).__init__(*args, **kwargs)
     self._pubsub = Pubsub.get_instance()
 
-  def subscribe(self, topic, callback):
-    self._pubsub.subscribe(topic, callback)
+  def subscribe(self, topic, callback, **kwargs):
+    self._pubsub.subscribe(topic, callback, **kwargs)
 
   def unsubscribe(self, topic, callback):
     self._pubsub.unsubscribe(topic, callback)
@@ -112,6 +861,11 @@ class Subscriber(object):
    Local Pubsub                                                                    Local Pubsub
      => _PubsubReceiver => PubsubServer --[grpc]--> PubsubClient => _PubsubTransmitter =>
      <= _PubsubTransmitter <= PubsubServer <--[grpc]-- PubsubClient <= _PubsubReceiver <=
+
+  A node running both a PubsubServer and a PubsubClient relays topics between
+  its links, so nodes can be chained into a tree:
+
+    Root PubsubServer <= Relay PubsubClient(relay_for=server), PubsubServer <= Leaf PubsubClient
 """
 
 _topic_enum_class = None
@@ -119,149 +873,1208 @@ _serializer_classes = {}
 _message_classes = {}
 
 
+def _default_node_id():
+  return '{0}:{1}'.format(socket.gethostname(), os.getpid())
+
+
+_node_id = _default_node_id()
+
+# Codecs resolved on first use: data type => encoder, and (topic id, field of
+# Topic.data) => (topic id, decoder).
+_encoders = {}
+_decoders = {}
+
+
 def init_topic_enum(enum_cls):
   global _topic_enum_class
   _topic_enum_class = enum_cls
+  _decoders.clear()
 
 
 def register_serializer(topic_id, serializer_cls):
   global _serializer_classes
   _serializer_classes[topic_id] = serializer_cls
+  _decoders.clear()
 
 
 def register_message(topic_id, message_cls):
   global _message_classes
   _message_classes[topic_id] = message_cls
+  _decoders.clear()
+
+
+def set_node_id(node_id):
+  """Sets the id of this node, sent as origin of local topics.
+
+  Defaults to hostname:pid. Forked processes are nodes of their own, so they
+  start over with the default of their own pid.
+  """
+  global _node_id
+  _node_id = node_id
+
+
+def get_node_id():
+  return _node_id
+
+
+def _reset_node_id():
+  # Topics between a forked child and its parent would otherwise be dropped
+  # as looped back to their origin.
+  set_node_id(_default_node_id())
+
+
+os.register_at_fork(after_in_child=_reset_node_id)
+
+
+def _topic_value(topic_id):
+  """Returns the value of a topic id as sent in pubsub_pb2.Topic.id."""
+  return topic_id.value if isinstance(topic_id, enum.Enum) else topic_id
+
+
+def _get_encoder(data_type):
+  """Returns a function filling Topic.data from data of given type, or None.
+
+  The function returns False if it can't encode given data after all.
+  """
+  try:
+    return _encoders[data_type]
+  except KeyError:
+    encoder = _encoders[data_type] = _resolve_encoder(data_type)
+    return encoder
+
+
+def _resolve_encoder(data_type):
+  if issubclass(data_type, numbers.Integral):
+    return _encode_integer
+  elif issubclass(data_type, numbers.Real):
+    return _encode_float
+  elif issubclass(data_type, str):
+    return _encode_string
+  elif issubclass(data_type, message.Message):
+    return _message_encoder(data_type)
+  elif issubclass(data_type, serialization.Serializer):
+    return _encode_serializer
+  elif np is not None and issubclass(data_type, np.ndarray):
+    return _encode_ndarray
+  elif issubclass(data_type, (list, tuple)):
+    return _encode_sequence
+  return None
+
+
+# Ranges of Topic.integer_value and of values of Int64Array.
+_INT32_MIN, _INT32_MAX = -2**31, 2**31 - 1
+_INT64_MIN, _INT64_MAX = -2**63, 2**63 - 1
+
+
+def _encode_integer(topic, data):
+  if not _INT32_MIN <= data <= _INT32_MAX:
+    return False
+  topic.integer_value = data
+  return True
+
+
+def _encode_float(topic, data):
+  topic.float_value = data
+  return True
+
+
+def _encode_string(topic, data):
+  topic.string_value = data
+  return True
+
+
+def _message_encoder(message_cls):
+  # Same as Any.Pack(), without looking up the type url for every message.
+  type_url = 'type.googleapis.com/' + message_cls.DESCRIPTOR.full_name
+
+  def encode(topic, data):
+    topic.message_value.type_url = type_url
+    topic.message_value.value = data.SerializeToString()
+    return True
+
+  return encode
+
+
+def _encode_serializer(topic, data):
+  topic.bytes_value = data.serialize()
+  return True
+
+
+def _encode_ndarray(topic, data):
+  if data.dtype.hasobject:
+    return False
+  topic.typed_buffer.dtype = data.dtype.str
+  topic.typed_buffer.shape.extend(data.shape)
+  topic.typed_buffer.data = data.tobytes()
+  return True
+
+
+def _encode_sequence(topic, data):
+  # Lists of ints beyond int64 are sent as doubles.
+  if data and all(
+      isinstance(x, int) and _INT64_MIN <= x <= _INT64_MAX for x in data):
+    topic.int64_array.values.extend(data)
+  elif all(isinstance(x, (int, float)) for x in data):
+    topic.double_array.values.extend(data)
+  else:
+    return False
+  return True
+
+
+def _get_decoder(topic_id, field):
+  """Returns (topic id, decoder) for given field of Topic.data.
+
+  Args:
+    topic_id: Topic.id.
+    field: name of the field set in Topic.data.
+  Returns:
+    A tuple of topic id as published locally, and a function returning data
+    of a Topic, or None if data can't be decoded.
+  """
+  key = (topic_id, field)
+  try:
+    return _decoders[key]
+  except KeyError:
+    decoder = _decoders[key] = _resolve_decoder(topic_id, field)
+    return decoder
+
+
+def _resolve_decoder(topic_id, field):
+  # Topics that can't be decoded get no decoder, so that callers log and skip
+  # them instead of failing whole batches.
+  if _topic_enum_class:
+    try:
+      topic_id = _topic_enum_class(topic_id)
+    except ValueError:
+      return topic_id, None
+  if field == 'bytes_value':
+    if topic_id not in _serializer_classes:
+      return topic_id, None
+    deserialize = _serializer_classes[topic_id].deserialize
+    return topic_id, lambda topic: deserialize(topic.bytes_value)
+  elif field == 'message_value':
+    if topic_id not in _message_classes:
+      return topic_id, None
+    from_string = _message_classes[topic_id].FromString
+    return topic_id, lambda topic: from_string(topic.message_value.value)
+  elif field == 'typed_buffer' and np is None:
+    return topic_id, None
+  return topic_id, _FIELD_DECODERS.get(field)
+
+
+def _decode_typed_buffer(topic):
+  # A read-only view of the received bytes, without copying.
+  buf = topic.typed_buffer
+  return np.frombuffer(buf.data, dtype=np.dtype(buf.dtype)).reshape(
+      tuple(buf.shape))
+
+
+_FIELD_DECODERS = {
+    'integer_value': operator.attrgetter('integer_value'),
+    'float_value': operator.attrgetter('float_value'),
+    'string_value': operator.attrgetter('string_value'),
+    'double_array': lambda topic: list(topic.double_array.values),
+    'int64_array': lambda topic: list(topic.int64_array.values),
+    'typed_buffer': _decode_typed_buffer,
+}
+
+
+class _TopicQueue(object):
+  """Bounded queue of pubsub_pb2.Topic with a configurable overflow policy.
+
+  Topics lost to overflow, or replaced by a newer value of the same topic
+  with OverflowPolicy.COALESCE, are counted per topic id.
+
+  Once closed, readers waiting for topics wake up and get queue.Empty, and
+  publishers waiting for room with OverflowPolicy.BLOCK drop their topics.
+  """
+
+  def __init__(self,
+               maxsize,
+               overflow=OverflowPolicy.DROP_NEWEST,
+               block_timeout=None):
+    """Creates a _TopicQueue instance.
+
+    Args:
+      maxsize: max number of pending topics.
+      overflow: an OverflowPolicy applied when the queue is full.
+      block_timeout: max seconds to wait for room with OverflowPolicy.BLOCK,
+                     after which the new topic is dropped. None to wait
+                     forever.
+    """
+    self._maxsize = maxsize
+    self._overflow = overflow
+    self._block_timeout = block_timeout
+    if overflow == OverflowPolicy.COALESCE:
+      self._queue = collections.OrderedDict()
+    else:
+      self._queue = collections.deque()
+    lock = threading.Lock()
+    self._not_empty = threading.Condition(lock)
+    self._not_full = threading.Condition(lock)
+    self._dropped = collections.Counter()
+    self._closed = False
+    # Number of topics a lingering reader waits for. Publishers only wake it
+    # up once there are as many, rather than on every topic.
+    self._wanted = 1
+
+  @property
+  def dropped(self):
+    """Returns a dict of topic id => number of topics dropped."""
+    with self._not_empty:
+      return dict(self._dropped)
+
+  @property
+  def closed(self):
+    return self._closed
+
+  def close(self):
+    with self._not_empty:
+      self._closed = True
+      self._not_empty.notify_all()
+      self._not_full.notify_all()
+
+  def __len__(self):
+    return len(self._queue)
+
+  def put(self, topic):
+    self.put_many([topic])
+
+  def put_many(self, topics, block=True):
+    """Appends topics to the queue.
+
+    Args:
+      topics: a list of topics.
+      block: False to drop topics instead of waiting for room with
+             OverflowPolicy.BLOCK.
+    """
+    with self._not_empty:
+      if self._overflow == OverflowPolicy.COALESCE:
+        for topic in topics:
+          self._put_coalesced(topic)
+      else:
+        for topic in topics:
+          self._put(topic, block)
+      if len(self._queue) == 1 or len(self._queue) >= self._wanted:
+        self._not_empty.notify()
+
+  def get(self, block=True, timeout=None):
+    """Removes and returns a topic.
+
+    Raises:
+      queue.Empty: if no topic is available within timeout.
+    """
+    with self._not_empty:
+      if block:
+        self._not_empty.wait_for(lambda: self._queue or self._closed, timeout)
+      if not self._queue:
+        raise queue.Empty()
+      topic = self._pop()
+      self._not_full.notify()
+      return topic
+
+  def get_many(self, max_items, timeout=None, linger=0):
+    """Removes and returns up to max_items topics.
+
+    Args:
+      max_items: max number of topics to return.
+      timeout: max seconds to wait for the first topic. None to wait until a
+               topic is available or the queue is closed.
+      linger: max seconds to wait for more topics after the first one,
+              until max_items topics are available.
+    Returns:
+      A list of topics.
+    Raises:
+      queue.Empty: if no topic is available within timeout.
+    """
+    with self._not_empty:
+      self._not_empty.wait_for(lambda: self._queue or self._closed, timeout)
+      if not self._queue:
+        raise queue.Empty()
+
+      if linger and len(self._queue) < max_items:
+        deadline = time.time() + linger
+        self._wanted = max_items
+        while len(self._queue) < max_items and not self._closed:
+          remaining = deadline - time.time()
+          if remaining <= 0:
+            break
+          self._not_empty.wait(remaining)
+        self._wanted = 1
+
+      topics = [self._pop() for _ in range(min(max_items, len(self._queue)))]
+      self._not_full.notify_all()
+      return topics
+
+  def clear(self):
+    with self._not_empty:
+      self._queue.clear()
+      self._not_full.notify_all()
+
+  def _put(self, topic, block=True):
+    if len(self._queue) >= self._maxsize:
+      if self._overflow == OverflowPolicy.DROP_NEWEST or not block:
+        self._dropped[topic.id] += 1
+        return
+      elif self._overflow == OverflowPolicy.DROP_OLDEST:
+        self._dropped[self._queue.popleft().id] += 1
+      else:
+        self._not_empty.notify()
+        if not self._not_full.wait_for(
+            lambda: len(self._queue) < self._maxsize or self._closed,
+            self._block_timeout) or self._closed:
+          self._dropped[topic.id] += 1
+          return
+    self._queue.append(topic)
+
+  def _put_coalesced(self, topic):
+    if topic.id in self._queue:
+      self._dropped[topic.id] += 1
+    elif len(self._queue) >= self._maxsize:
+      _, oldest = self._queue.popitem(last=False)
+      self._dropped[oldest.id] += 1
+    self._queue[topic.id] = topic
+
+  def _pop(self):
+    if self._overflow == OverflowPolicy.COALESCE:
+      return self._queue.popitem(last=False)[1]
+    return self._queue.popleft()
+
+
+# Where a topic received from a remote node comes from: the link it was
+# received from, and Topic.origin, Topic.hops and Topic.timestamp_ns as
+# received.
+_Inbound = collections.namedtuple('_Inbound',
+                                  ['link', 'origin', 'hops', 'timestamp_ns'])
+
+
+class _InboundBatch(object):
+  """Where topics of a batch being published come from.
+
+  Topics of a batch received from a link may each have their own origin,
+  hops and publish time. They are looked up by identity of the (topic id,
+  data) tuples given to Pubsub.publish_many(), which batch subscribers
+  receive as they are. Topics that subscribers publish from their callbacks
+  meanwhile, such as replies, are not part of the batch: they are local.
+  """
+
+  def __init__(self, link, inbounds):
+    """Creates an _InboundBatch instance.
+
+    Args:
+      link: name of the link topics were received from.
+      inbounds: a dict of id() of (topic id, data) tuples => _Inbound.
+    """
+    self.link = link
+    self._inbounds = inbounds
+
+  def of(self, item):
+    """Returns the _Inbound of a (topic id, data) tuple being published.
+
+    None if the topic is not part of the batch.
+    """
+    return self._inbounds.get(id(item))
 
 
 class _PubsubReceiver(Subscriber):
-  """Stores topics in queue for dispatching to remote clients."""
+  """Stores topics in queue for dispatching to remote clients.
+
+  If retention is enabled on Pubsub, retained topics are queued as soon as the
+  receiver subscribes, so new remote listeners start with current values.
+
+  Topics received from a remote node are relayed with their origin, except to
+  the link they were received from.
+  """
 
   _local = threading.local()
 
-  def __init__(self, topic_ids, *args, **kwargs):
+  def __init__(self,
+               topic_ids,
+               queue_size=1000,
+               overflow=OverflowPolicy.DROP_NEWEST,
+               block_timeout=None,
+               link=None,
+               *args,
+               **kwargs):
+    """Creates a _PubsubReceiver instance.
+
+    Args:
+      topic_ids: a list of topic ids to receive, or None for all topics.
+      queue_size: max number of topics pending for dispatch.
+      overflow: an OverflowPolicy applied when the queue is full.
+      block_timeout: max seconds a publisher waits with OverflowPolicy.BLOCK.
+      link: name of the link topics are dispatched to, such as the id of the
+            remote node. Topics received from this link are not sent back.
+    """
     super(_PubsubReceiver, self).__init__(*args, **kwargs)
     self._topic_ids = topic_ids
-    self._topics = queue.Queue(maxsize=1000)
+    self._topics = _TopicQueue(queue_size, overflow, block_timeout)
+    self._link = link
 
   @property
   def topics(self):
     return self._topics
 
+  @property
+  def dropped(self):
+    """Returns a dict of topic id => number of topics dropped."""
+    return self._topics.dropped
+
+  @property
+  def _subscribed_topic_ids(self):
+    return set(self._topic_ids) if self._topic_ids else [None]
+
   @classmethod
-  def disable(cls):
-    """Returns a disabler class instance to prevent echo.
+  def receiving(cls, inbound):
+    """Returns a context manager marking topics published within as inbound.
 
     Use it as:
-      with _PubsubReceiver.disable():
-        # publish topic
+      with _PubsubReceiver.receiving(_InboundBatch(link, inbounds)):
+        Pubsub.get_instance().publish_many(items)
+
+    Args:
+      inbound: an _InboundBatch of topics published with
+               Pubsub.publish_many().
     """
-    return cls._PubsubReceiverDisabler()
+    return cls._InboundScope(inbound)
+
+  @classmethod
+  def _current_inbound(cls):
+    """Returns the _InboundBatch of topics being published, or None."""
+    return getattr(cls._local, 'inbound', None)
+
+  @staticmethod
+  def _sources(topics, inbound):
+    """Yields (topic id, data, publish time in ns, _Inbound or None).
+
+    The _Inbound is None for topics published on this node.
+
+    Args:
+      topics: a list of (topic id, data) tuples being published.
+      inbound: the _current_inbound() of topics.
+    """
+    if inbound is None:
+      ts = time.time_ns()
+      for topic_id, data in topics:
+        yield topic_id, data, ts, None
+    else:
+      ts = None
+      for item in topics:
+        source = inbound.of(item)
+        if source:
+          yield item[0], item[1], source.timestamp_ns, source
+        else:
+          if ts is None:
+            ts = time.time_ns()
+          yield item[0], item[1], ts, None
 
   def __enter__(self):
-    self.subscribe(topic=None, callback=self._on_topic)
+    for topic_id in self._subscribed_topic_ids:
+      self.subscribe(topic=topic_id, callback=self._on_topics, batch=True)
     return self
 
   def __exit__(self, exc_type, exc_val, exc_tb):
-    self.unsubscribe(topic=None, callback=self._on_topic)
+    for topic_id in self._subscribed_topic_ids:
+      self.unsubscribe(topic=topic_id, callback=self._on_topics)
 
   def reset(self):
-    while True:
-      try:
-        self._topics.get(block=False)
-      except queue.Empty:
-        break
+    self._topics.clear()
+
+  def _on_topics(self, topics):
+    converted = []
+    for topic_id, data, ts, source in self._sources(topics,
+                                                    self._current_inbound()):
+      if source and source.link == self._link:
+        continue
+      topic = self._convert(topic_id, data, ts, source)
+      if topic:
+        converted.append(topic)
+    if converted:
+      self._topics.put_many(converted)
+
+  def _convert(self, topic_id, data, ts, inbound=None):
+    """Returns a pubsub_pb2.Topic, or None if data can't be sent.
+
+    Data can't be sent if its type is not supported, or if a value is out of
+    range of its field, such as an int beyond int32.
 
-  def _on_topic(self, topic_id, data):
-    if not self._enabled:
-      return
-    if self._topic_ids and topic_id not in self._topic_ids:
-      return
+    Args:
+      topic_id: topic id.
+      data: topic data.
+      ts: publish time in nanoseconds since epoch, or 0 if unknown.
+      inbound: an _Inbound if topic was received from a remote node, or None
+               if it was published on this node.
+    """
+    encoder = _get_encoder(type(data))
+    if not encoder:
+      return None
 
     topic = pubsub_pb2.Topic()
     if isinstance(topic_id, enum.Enum):
       topic.id = topic_id.value
     else:
       topic.id = topic_id
-    topic.timestamp = time.time()
-    if isinstance(data, int):
-      topic.integer_value = data
-    elif isinstance(data, float):
-      topic.float_value = data
-    elif isinstance(data, str):
-      topic.string_value = data
-    elif isinstance(data, python_message.GeneratedProtocolMessageType):
-      topic.message_value.Pack(data)
-    elif isinstance(data, io.Serializer):
-      topic.bytes_value = data.serialize()
+    topic.timestamp = (ts or time.time_ns()) / 1e9
+    topic.timestamp_ns = ts
+    if inbound:
+      topic.origin = inbound.origin
+      topic.hops = inbound.hops + 1
     else:
-      return
-
+      topic.origin = _node_id
     try:
-      self._topics.put(topic, block=False)
-    except queue.Full:
-      pass
+      if not encoder(topic, data):
+        return None
+    except (ValueError, OverflowError):
+      # Only this topic is lost, not the batch it was published with.
+      return None
+    return topic
 
-  @property
-  def _enabled(self):
-    cls = self.__class__
-    return not hasattr(cls._local, 'enabled') or cls._local.enabled
+  class _InboundScope(object):
 
-  class _PubsubReceiverDisabler(object):
+    def __init__(self, inbound):
+      self._inbound = inbound
+      self._previous = None
 
     def __enter__(self):
-      _PubsubReceiver._local.enabled = False
+      self._previous = _PubsubReceiver._current_inbound()
+      _PubsubReceiver._local.inbound = self._inbound
       return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-      _PubsubReceiver._local.enabled = True
+      _PubsubReceiver._local.inbound = self._previous
+
+
+# Tags of ListenResponse.topic and ListenResponse.topics as length-delimited
+# fields, for framing pre-encoded topics.
+_LISTEN_RESPONSE_TOPIC_TAG = b'\x12'
+_LISTEN_RESPONSE_TOPICS_TAG = b'\x1a'
+
+
+def _varint(value):
+  encoded = bytearray()
+  while value > 0x7f:
+    encoded.append((value & 0x7f) | 0x80)
+    value >>= 7
+  encoded.append(value)
+  return bytes(encoded)
+
+
+# A topic serialized once for all listeners. data is the length-prefixed
+# pubsub_pb2.Topic, so it only needs a field tag to become part of a
+# ListenResponse.
+_EncodedTopic = collections.namedtuple('_EncodedTopic', ['id', 'data'])
+
+
+def _encode_listen_response(topics, batch):
+  """Returns a serialized ListenResponse of given _EncodedTopics.
+
+  Args:
+    topics: a list of _EncodedTopic.
+    batch: True to put topics in ListenResponse.topics, or False for a single
+           topic in ListenResponse.topic.
+  """
+  if not batch:
+    assert len(topics) == 1
+    return _LISTEN_RESPONSE_TOPIC_TAG + topics[0].data
+  return b''.join(_LISTEN_RESPONSE_TOPICS_TAG + x.data for x in topics)
+
+
+class _HubListener(object):
+  """Queue of pre-encoded topics for one remote listener of _FanoutHub."""
+
+  def __init__(self,
+               topic_ids,
+               queue_size=1000,
+               overflow=OverflowPolicy.DROP_NEWEST,
+               block_timeout=None,
+               link=None):
+    """Creates a _HubListener instance.
+
+    Args:
+      topic_ids: a list of topic ids to receive, or None for all topics.
+      queue_size: max number of topics pending for dispatch.
+      overflow: an OverflowPolicy applied when the queue is full.
+      block_timeout: max seconds a publisher waits with OverflowPolicy.BLOCK.
+      link: name of the link to the listener, such as the id of the remote
+            node. Topics received from this link are not sent back.
+    """
+    self.topic_ids = set(topic_ids) if topic_ids else None
+    self.link = link
+    self._topics = _TopicQueue(queue_size, overflow, block_timeout)
+
+  @property
+  def topics(self):
+    return self._topics
+
+  @property
+  def dropped(self):
+    """Returns a dict of topic id => number of topics dropped."""
+    return self._topics.dropped
+
+  def put_many(self, topics, block=True):
+    self._topics.put_many(topics, block)
+
+
+class _FanoutHub(_PubsubReceiver):
+  """Encodes each local topic once for all remote listeners.
+
+  Topics are converted and serialized once no matter how many listeners ask
+  for them, so the cost of a publish does not grow with the number of
+  listeners. Each topic gets a sequence number, and the latest ones are kept
+  in a replay ring so that reconnecting listeners can resume where they left.
+
+  Listeners are indexed by topic id as they register, so a publish only
+  costs for listeners of its topic, and topics without listeners are not
+  even converted. The topic ids listened to make up the interest of the hub,
+  which relaying PubsubClients pass on to their server.
+
+  Use it as:
+    with hub:
+      with hub.listen(listener, resume_after):
+        # read encoded topics from listener.topics
+  """
+
+  # Seconds topics are still encoded after their last listener left, so the
+  # listener can resume from the replay ring.
+  _RESUME_WINDOW_SECS = 60
+
+  def __init__(self, replay_size=0, *args, **kwargs):
+    """Creates a _FanoutHub instance.
+
+    Args:
+      replay_size: max number of recent topics kept for resuming listeners.
+    """
+    # Topics go straight to listeners, so the receiver queue is never used.
+    super(_FanoutHub, self).__init__(None, 0, *args, **kwargs)
+    self._lock = threading.Lock()
+    # Copy-on-write: topic id => tuple of listeners, and a tuple of listeners
+    # of all topics.
+    self._listeners = {}
+    self._all_listeners = ()
+    # Starts from current time so that sequence numbers keep increasing across
+    # server restarts.
+    self._sequences = itertools.count(time.time_ns())
+    self._replay = collections.deque(maxlen=replay_size) if replay_size else None
+    # Topic id, or None for all topics => monotonic time until which topics
+    # are encoded for listeners which left.
+    self._lingering = {}
+    self._interest_callbacks = []
+    # Publishers queue topics in turns taken with sequence numbers, so that
+    # listeners get them in order, without holding the lock while a listener
+    # queue blocks.
+    self._turns = threading.Condition()
+    self._next_turn = 0
+    self._current_turn = 0
+
+  @property
+  def interest(self):
+    """Returns a frozenset of topic ids listened to, or None for all topics."""
+    if self._all_listeners:
+      return None
+    return frozenset(self._listeners)
+
+  def watch_interest(self, callback):
+    """Calls callback without arguments whenever interest changes."""
+    self._interest_callbacks.append(callback)
+
+  def unwatch_interest(self, callback):
+    self._interest_callbacks.remove(callback)
+
+  def listen(self, listener, resume_after=0):
+    """Returns a context manager that registers listener with this hub."""
+    return _FanoutHubRegistration(self, listener, resume_after)
+
+  def add(self, listener, resume_after=0):
+    """Registers a listener.
+
+    The listener first gets retained topics, unless it resumes without losing
+    any topic, then topics from the replay ring newer than resume_after.
+    Those are queued without waiting for room, as the listener does not read
+    its queue yet, so topics that do not fit are dropped and counted.
+
+    Args:
+      listener: a _HubListener.
+      resume_after: sequence number of the last topic the listener received on
+                    a previous stream, or 0 for a new listener.
+    """
+    with self._lock:
+      interest = self.interest
+      if listener.topic_ids is None:
+        self._all_listeners += (listener,)
+      else:
+        listeners = dict(self._listeners)
+        for topic_id in listener.topic_ids:
+          listeners[topic_id] = listeners.get(topic_id, ()) + (listener,)
+        self._listeners = listeners
+
+      # Queued under the lock so that no topic published meanwhile comes first.
+      replay = self._replay or ()
+      if resume_after:
+        replay = [
+            x for x in replay
+            if x[0] > resume_after and
+            (x[2] is None or x[2].link != listener.link) and
+            (listener.topic_ids is None or x[1] in listener.topic_ids)
+        ]
+      else:
+        replay = ()
+      seed = []
+      if not resume_after or not self._replay or (
+          self._replay[0][0] > resume_after + 1):
+        seed.extend(self._encode_retained(listener))
+      seed.extend(replay)
+      if seed:
+        listener.put_many([topic for _, _, _, topic in seed], block=False)
+    self._notify_interest(interest)
+
+  def remove(self, listener):
+    """Unregisters a listener.
+
+    Its queue is closed, so publishers blocked on it give up.
+    """
+    listener.topics.close()
+    with self._lock:
+      interest = self.interest
+      until = time.monotonic() + self._RESUME_WINDOW_SECS
+      if listener.topic_ids is None:
+        self._all_listeners = tuple(
+            x for x in self._all_listeners if x is not listener)
+        if self._replay is not None and not self._all_listeners:
+          self._lingering[None] = until
+      else:
+        listeners = dict(self._listeners)
+        for topic_id in listener.topic_ids:
+          remaining = tuple(x for x in listeners[topic_id] if x is not listener)
+          if remaining:
+            listeners[topic_id] = remaining
+          else:
+            del listeners[topic_id]
+            if self._replay is not None:
+              self._lingering[topic_id] = until
+        self._listeners = listeners
+    self._notify_interest(interest)
+
+  def _notify_interest(self, previous):
+    if self.interest != previous:
+      for callback in list(self._interest_callbacks):
+        callback()
+
+  def _encode_retained(self, listener):
+    instance = Pubsub.get_instance()
+    if listener.topic_ids is None:
+      retained = instance.get_retained()
+    else:
+      retained = [
+          x for topic_id in listener.topic_ids
+          for x in instance.get_retained(topic_id)
+      ]
+    # Publish time of retained topics is unknown.
+    return self._encode(((topic_id, data, 0, None)
+                         for topic_id, data in retained),
+                        sequence=False)
+
+  def _on_topics(self, topics):
+    inbound = self._current_inbound()
+    with self._lock:
+      listeners = self._listeners
+      all_listeners = self._all_listeners
+      if not all_listeners:
+        topics = self._wanted(topics, listeners)
+      encoded = self._encode(self._sources(topics, inbound))
+      if not encoded:
+        return
+      if self._replay is not None:
+        self._replay.extend(encoded)
+      turn = self._next_turn
+      self._next_turn += 1
+
+    # Groups topics per listener so each gets the batch in one put.
+    batches = collections.OrderedDict()
+    for _, topic_id, source, topic in encoded:
+      for listener in listeners.get(topic_id, ()) + all_listeners:
+        if not source or listener.link != source.link:
+          batches.setdefault(listener, []).append(topic)
+
+    with self._turns:
+      self._turns.wait_for(lambda: self._current_turn == turn)
+    try:
+      for listener, batch in batches.items():
+        listener.put_many(batch)
+    finally:
+      with self._turns:
+        self._current_turn += 1
+        self._turns.notify_all()
+
+  def _wanted(self, topics, listeners):
+    """Returns topics with listeners, or whose listeners left recently."""
+    lingering = self._lingering
+    if not lingering:
+      return [x for x in topics if x[0] in listeners]
+
+    now = time.monotonic()
+    if lingering.get(None, now) > now:
+      return topics
+    wanted = []
+    for topic in topics:
+      if topic[0] in listeners:
+        wanted.append(topic)
+      else:
+        until = lingering.get(topic[0])
+        if until is None:
+          continue
+        if until > now:
+          wanted.append(topic)
+        else:
+          del lingering[topic[0]]
+    lingering.pop(None, None)
+    return wanted
+
+  def _encode(self, sources, sequence=True):
+    """Returns a list of (sequence, topic id, _Inbound, _EncodedTopic).
+
+    Args:
+      sources: (topic id, data, publish time, _Inbound) of topics, as yielded
+               by _sources().
+      sequence: whether to number topics for the replay ring.
+    Topics which can't be converted are skipped.
+    """
+    encoded = []
+    for topic_id, data, ts, inbound in sources:
+      topic = self._convert(topic_id, data, ts, inbound)
+      if topic:
+        if sequence:
+          topic.sequence = next(self._sequences)
+        data = topic.SerializeToString()
+        encoded.append((topic.sequence, topic_id, inbound,
+                        _EncodedTopic(topic.id, _varint(len(data)) + data)))
+    return encoded
+
+
+class _FanoutHubRegistration(object):
+
+  def __init__(self, hub, listener, resume_after):
+    self._hub = hub
+    self._listener = listener
+    self._resume_after = resume_after
+
+  def __enter__(self):
+    self._hub.add(self._listener, self._resume_after)
+    return self._listener
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    self._hub.remove(self._listener)
+
+
+def _add_pubsub_servicer_to_server(servicer, server):
+  """Registers a Pubsub servicer whose Listen yields serialized responses.
+
+  Same as pubsub_pb2_grpc.add_PubsubServicer_to_server(), except that Listen
+  responses are passed through as bytes, as built by _encode_listen_response.
+  """
+  rpc_method_handlers = {
+      'Register':
+          grpc.unary_unary_rpc_method_handler(
+              servicer.Register,
+              request_deserializer=pubsub_pb2.RegisterRequest.FromString,
+              response_serializer=pubsub_pb2.RegisterResponse
+              .SerializeToString,
+          ),
+      'Listen':
+          grpc.unary_stream_rpc_method_handler(
+              servicer.Listen,
+              request_deserializer=pubsub_pb2.ListenRequest.FromString,
+              response_serializer=None,
+          ),
+      'Dispatch':
+          grpc.stream_unary_rpc_method_handler(
+              servicer.Dispatch,
+              request_deserializer=pubsub_pb2.DispatchRequest.FromString,
+              response_serializer=pubsub_pb2.DispatchResponse
+              .SerializeToString,
+          ),
+  }
+  generic_handler = grpc.method_handlers_generic_handler(
+      'common.Pubsub', rpc_method_handlers)
+  server.add_generic_rpc_handlers((generic_handler,))
+
+
+class _LatencyStats(object):
+  """Publish-to-delivery latency of remote topics, per topic and per link.
+
+  Latency is measured against the publish time on the node of origin, so it
+  is only meaningful with clocks in sync, as PubsubClient does on register.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._topics = collections.defaultdict(counters.Histogram)
+    self._links = collections.defaultdict(counters.Histogram)
+
+  def record(self, samples, link):
+    """Records latency of topics received from given link.
+
+    Args:
+      samples: a list of (Topic.id, Topic.timestamp_ns) of topics received.
+      link: name of the link topics were received from.
+    """
+    now = time.time_ns()
+    with self._lock:
+      for topic_id, ts in samples:
+        # Publish time of retained topics is unknown.
+        if ts:
+          latency = max(0, now - ts) / 1e9
+          self._topics[topic_id].add(latency)
+          self._links[link].add(latency)
+
+  def snapshot(self):
+    """Returns latency statistics in seconds.
+
+    Returns:
+      A dict with 'topics' of topic id => stats and 'links' of link => stats.
+    """
+    with self._lock:
+      return {
+          'topics': {
+              topic_id: self._summarize(histogram)
+              for topic_id, histogram in self._topics.items()
+          },
+          'links': {
+              link: self._summarize(histogram)
+              for link, histogram in self._links.items()
+          },
+      }
+
+  @staticmethod
+  def _summarize(histogram):
+    return {
+        'count': histogram.count(),
+        'average_latency': histogram.average(),
+        'p50_latency': histogram.percentile(50),
+        'p99_latency': histogram.percentile(99),
+        'max_latency': histogram.max(),
+        'latency_histogram': histogram.buckets(),
+    }
+
+
+# Routes of this node to origins of remote topics: origin => [link, hops,
+# monotonic time of last topic]. Shared by all transmitters, as each one
+# serves different links.
+_routes = {}
+_routes_lock = threading.Lock()
+
+
+def _reset_routes():
+  # Links of the parent are not links of a forked child.
+  global _routes_lock
+  _routes_lock = threading.Lock()
+  _routes.clear()
+
+
+os.register_at_fork(after_in_child=_reset_routes)
 
 
 class _PubsubTransmitter(Publisher, pattern.Logger):
+  """Publishes topics received from remote nodes to local Pubsub.
+
+  Topics are published as inbound from their link, so receivers relay them to
+  other links only. Loops and duplicates are suppressed with the origin and
+  hop count of topics: topics of this node are dropped, and topics of another
+  origin are only accepted from the link with fewest hops to it, among links
+  of all transmitters of this node. A link which stops delivering topics of
+  an origin loses it after _ROUTE_TIMEOUT_SECS.
+  """
+
+  _MAX_HOPS = 16
+  _ROUTE_TIMEOUT_SECS = 10
 
   def __init__(self, *args, **kwargs):
     super(_PubsubTransmitter, self).__init__(*args, **kwargs)
+    self._latency = _LatencyStats()
+    self._suppressed = 0
 
-  def transmit(self, topic):
-    if _topic_enum_class:
-      topic_id = _topic_enum_class(topic.id)
-    else:
-      topic_id = topic.id
-    self.logger.debug('Received %s...', topic_id)
-    data_type = topic.WhichOneof('data')
-    if data_type == 'integer_value':
-      data = topic.integer_value
-    elif data_type == 'integer_value':
-      data = topic.integer_value
-    elif data_type == 'float_value':
-      data = topic.float_value
-    elif data_type == 'string_value':
-      data = topic.string_value
-    elif data_type == 'bytes_value':
-      assert topic_id in _serializer_classes, 'Serializer not registered for topic {0}'.format(
-          topic.id)
-      data = _serializer_classes[topic_id].deserialize(topic.bytes_value)
-    elif data_type == 'message_value':
-      assert topic_id in _message_classes, 'Message not registered for topic {0}'.format(
-          topic.id)
-      data = _message_classes[topic_id]()
-      topic.message_value.Unpack(data)
-    else:
+  @property
+  def latency(self):
+    """Returns latency statistics as documented in _LatencyStats.snapshot()."""
+    return self._latency.snapshot()
+
+  @property
+  def suppressed(self):
+    """Returns number of topics dropped as looped back or duplicated."""
+    return self._suppressed
+
+  def transmit(self, topic, link=None):
+    """Publishes a pubsub_pb2.Topic.
+
+    Args:
+      topic: a pubsub_pb2.Topic.
+      link: name of the link topic was received from, such as the id of the
+            remote node, for relaying and latency statistics.
+    """
+    origin, hops, ts = topic.origin, topic.hops, topic.timestamp_ns
+    self._latency.record([(topic.id, ts)], link)
+    if not self._accept(origin, hops, link, time.monotonic()):
+      return
+    decoded = self._decode(topic)
+    if not decoded:
       return
 
-    with _PubsubReceiver.disable():
-      self.logger.debug('Publishing %s...', topic_id)
-      self.publish(topic_id, data)
+    # Published as a batch of one, so that receivers tell it apart from
+    # topics that subscribers publish in reply.
+    inbounds = {id(decoded): _Inbound(link, origin, hops, ts)}
+    with _PubsubReceiver.receiving(_InboundBatch(link, inbounds)):
+      self.logger.debug('Publishing %s...', decoded[0])
+      self.publish_many([decoded])
 
+  def transmit_many(self, topics, link=None):
+    """Publishes a list of pubsub_pb2.Topic with one Pubsub.publish_many().
 
-class _PubsubServicer(pubsub_pb2_grpc.PubsubServicer):
+    Each topic keeps its own origin, hops and publish time for receivers.
+    """
+    # Fields of each topic are read once, as reads are not free with the pure
+    # Python implementation of protobuf.
+    now = time.monotonic()
+    samples = []
+    items = []
+    # Relayed topics keep their own origin, hops and publish time.
+    inbounds = {}
+    inbound = None
+    for topic in topics:
+      origin, hops, ts = topic.origin, topic.hops, topic.timestamp_ns
+      samples.append((topic.id, ts))
+      if not self._accept(origin, hops, link, now):
+        continue
+      item = self._decode(topic)
+      if not item:
+        continue
+      # Topics published together at their origin share one _Inbound.
+      if not inbound or (origin, hops, ts) != inbound[1:]:
+        inbound = _Inbound(link, origin, hops, ts)
+      items.append(item)
+      inbounds[id(item)] = inbound
+    self._latency.record(samples, link)
+    if not items:
+      return
 
-  def __init__(self, *args, **kwargs):
+    self.logger.debug('Publishing %d topics...', len(items))
+    with _PubsubReceiver.receiving(_InboundBatch(link, inbounds)):
+      self.publish_many(items)
+
+  def _accept(self, origin, hops, link, now):
+    """Returns whether to accept a topic of given origin and hops from link.
+
+    Args:
+      origin: Topic.origin.
+      hops: Topic.hops.
+      link: name of the link topic was received from.
+      now: time.monotonic() of receiving topic.
+    """
+    # Topics of nodes predating origins can't be checked.
+    if not origin:
+      return True
+
+    if origin == _node_id or hops > self._MAX_HOPS:
+      self._suppressed += 1
+      return False
+
+    with _routes_lock:
+      route = _routes.get(origin)
+      if route and route[0] != link and route[1] <= hops and (
+          now - route[2] < self._ROUTE_TIMEOUT_SECS):
+        self._suppressed += 1
+        return False
+      if route and route[0] == link and route[1] == hops:
+        route[2] = now
+      else:
+        _routes[origin] = [link, hops, now]
+    return True
+
+  def _decode(self, topic):
+    field = topic.WhichOneof('data')
+    topic_id, decoder = _get_decoder(topic.id, field)
+    self.logger.debug('Received %s...', topic_id)
+    if not decoder:
+      if field:
+        self.logger.warn('Unable to decode %s of topic %s.', field, topic_id)
+      return None
+    return topic_id, decoder(topic)
+
+
+# Metadata of Listen and Dispatch calls naming the node of the client.
+_NODE_ID_METADATA_KEY = 'pubsub-node-id'
+
+
+def _remote_node_id(context):
+  """Returns the node id of the client of a call, or its address if unknown."""
+  for key, value in context.invocation_metadata():
+    if key == _NODE_ID_METADATA_KEY:
+      return value
+  return context.peer()
+
+
+class _PubsubServicer(pubsub_pb2_grpc.PubsubServicer, pattern.Logger):
+
+  def __init__(self,
+               receiver_options,
+               linger,
+               replay_size,
+               compression_threshold=0,
+               *args,
+               **kwargs):
+    """Creates a _PubsubServicer instance.
+
+    Listen yields serialized responses, so the servicer must be registered
+    with _add_pubsub_servicer_to_server().
+
+    Args:
+      receiver_options: a dict of keyword arguments for _HubListener of each
+                        listener.
+      linger: max seconds to wait for more topics to fill a batch.
+      replay_size: max number of recent topics kept for resuming listeners.
+      compression_threshold: Listen responses smaller than this number of
+                             bytes are sent uncompressed.
+    """
     super(_PubsubServicer, self).__init__(*args, **kwargs)
+    self._compression_threshold = compression_threshold
     self._transmitter = _PubsubTransmitter()
+    self._hub = _FanoutHub(replay_size)
+    self._receiver_options = receiver_options
+    self._linger = linger
+    self._receivers = {}
+    self._receivers_lock = threading.Lock()
+    self._stream_ids = itertools.count()
+
+  @property
+  def dropped(self):
+    """Returns a dict of listener => {topic id: number of topics dropped}."""
+    with self._receivers_lock:
+      receivers = list(self._receivers.items())
+    return {name: receiver.dropped for name, receiver in receivers}
+
+  @property
+  def latency(self):
+    return self._transmitter.latency
+
+  @property
+  def suppressed(self):
+    return self._transmitter.suppressed
+
+  @property
+  def hub(self):
+    return self._hub
+
+  def start(self):
+    self._hub.__enter__()
+
+  def stop(self):
+    self._hub.__exit__(None, None, None)
 
   def Register(self, request, context):
-    return pubsub_pb2.RegisterResponse(timestamp=time.time())
+    now = time.time_ns()
+    return pubsub_pb2.RegisterResponse(
+        timestamp=now / 1e9,
+        timestamp_ns=now,
+        batching=True,
+        node_id=_node_id)
 
   def Listen(self, request, context):
     if _topic_enum_class:
@@ -269,76 +2082,265 @@ class _PubsubServicer(pubsub_pb2_grpc.PubsubServicer):
     else:
       topic_ids = request.topic_id
 
-    with _PubsubReceiver(topic_ids) as receiver:
-      while context.is_active():
-        try:
-          topic = receiver.topics.get(block=False, timeout=1)
-          yield pubsub_pb2.ListenResponse(topic=topic)
-        except queue.Empty:
-          pass
+    name = '{0}#{1}'.format(context.peer(), next(self._stream_ids))
+    listener = _HubListener(
+        topic_ids, link=_remote_node_id(context), **self._receiver_options)
+    with self._hub.listen(listener, request.resume_after) as receiver:
+      # Wakes up the stream below as soon as the RPC is cancelled, times out or
+      # the server stops, so it can block on the queue without polling.
+      if not context.add_callback(receiver.topics.close):
+        return
+      with self._receivers_lock:
+        self._receivers[name] = receiver
+      try:
+        while not receiver.topics.closed:
+          try:
+            if request.max_batch_size:
+              topics = receiver.topics.get_many(
+                  request.max_batch_size, linger=self._linger)
+              response = _encode_listen_response(topics, batch=True)
+            else:
+              topic = receiver.topics.get()
+              response = _encode_listen_response([topic], batch=False)
+            if len(response) < self._compression_threshold:
+              context.disable_next_message_compression()
+            yield response
+          except queue.Empty:
+            pass
+      finally:
+        with self._receivers_lock:
+          del self._receivers[name]
+        if receiver.dropped:
+          self.logger.warn('Listener %s dropped topics: %s', name,
+                           receiver.dropped)
 
   def Dispatch(self, request_iterator, context):
+    link = _remote_node_id(context)
     for request in request_iterator:
-      self._transmitter.transmit(request.topic)
+      if request.topics:
+        self._transmitter.transmit_many(request.topics, link)
+      else:
+        self._transmitter.transmit(request.topic, link)
+    return pubsub_pb2.DispatchResponse()
 
 
 class PubsubServer(pattern.Logger, pattern.Singleton):
 
   _STOP_GRACE_SECS = 5
 
-  def __init__(self, port=50051, *args, **kwargs):
+  def __init__(self,
+               port=50051,
+               queue_size=1000,
+               overflow=OverflowPolicy.DROP_NEWEST,
+               block_timeout=None,
+               linger=0.005,
+               replay_size=1000,
+               compression=None,
+               compression_threshold=1024,
+               unix_socket=True,
+               *args,
+               **kwargs):
+    """Creates a PubsubServer instance.
+
+    Args:
+      port: port to listen on.
+      queue_size: max number of topics pending for each listener.
+      overflow: an OverflowPolicy applied when a listener queue is full.
+      block_timeout: max seconds a publisher waits with OverflowPolicy.BLOCK.
+      linger: max seconds to wait for more topics to fill a batch for
+              listeners that accept batches.
+      replay_size: max number of recent topics kept for clients resuming
+                   after a disconnection. 0 to disable resuming.
+      compression: a grpc.Compression for messages to clients which accept
+                   it, or None for no compression.
+      compression_threshold: messages to clients smaller than this number of
+                             bytes, such as small topics or batches, are sent
+                             uncompressed.
+      unix_socket: True to also listen on net.local_socket_path(port), which
+                   local clients of the same user prefer over TCP, a unix
+                   domain socket path to listen on instead, or False to only
+                   listen on TCP.
+    """
     super(PubsubServer, self).__init__(self, *args, **kwargs)
-    self._server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    pubsub_pb2_grpc.add_PubsubServicer_to_server(_PubsubServicer(),
-                                                 self._server)
-    self._server.add_insecure_port('[::]:{0}'.format(port))
+    self._server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=10), compression=compression)
+    self._servicer = _PubsubServicer({
+        'queue_size': queue_size,
+        'overflow': overflow,
+        'block_timeout': block_timeout,
+    }, linger, replay_size, compression_threshold if compression else 0)
+    _add_pubsub_servicer_to_server(self._servicer, self._server)
+    net.add_insecure_ports(self._server, port, unix_socket)
+
+  @property
+  def dropped(self):
+    """Returns a dict of listener => {topic id: number of topics dropped}."""
+    return self._servicer.dropped
+
+  @property
+  def latency(self):
+    """Returns latency of topics from clients. See _LatencyStats.snapshot()."""
+    return self._servicer.latency
+
+  @property
+  def suppressed(self):
+    """Returns number of topics from clients dropped as loops or duplicates."""
+    return self._servicer.suppressed
+
+  @property
+  def interest(self):
+    """Returns a frozenset of topic ids listened to, or None for all topics."""
+    return self._servicer.hub.interest
+
+  def watch_interest(self, callback):
+    """Calls callback without arguments whenever interest changes."""
+    self._servicer.hub.watch_interest(callback)
+
+  def unwatch_interest(self, callback):
+    self._servicer.hub.unwatch_interest(callback)
 
   def start(self):
     self.logger.info('Starting Pubsub server...')
+    self._servicer.start()
     self._server.start()
     self.logger.info('Pubsub server started.')
 
   def stop(self):
     self.logger.info('Stopping Pubsub server...')
     self._server.stop(grace=self._STOP_GRACE_SECS)
+    self._servicer.stop()
     self.logger.info('Pubsub server stopped.')
 
 
+class _Backoff(object):
+  """Jittered exponential delays between reconnection attempts.
+
+  Each delay is picked at random between half and all of the current limit,
+  so clients disconnected together do not reconnect together.
+  """
+
+  def __init__(self, initial=0.1, maximum=10, multiplier=2):
+    self._initial = initial
+    self._maximum = maximum
+    self._multiplier = multiplier
+    self._limit = initial
+
+  def next(self):
+    """Returns seconds to wait before next attempt."""
+    delay = random.uniform(self._limit / 2, self._limit)
+    self._limit = min(self._maximum, self._limit * self._multiplier)
+    return delay
+
+  def reset(self):
+    self._limit = self._initial
+
+
 class PubsubClient(pattern.Logger):
 
   def __init__(self,
                service_target,
                inbound_topics=None,
                outbound_topics=None,
+               queue_size=1000,
+               overflow=OverflowPolicy.DROP_NEWEST,
+               block_timeout=None,
+               max_batch_size=100,
+               linger=0.005,
+               max_reconnect_delay=10,
+               compression=None,
+               prefer_local=True,
+               relay_for=None,
+               set_clock=True,
                *args,
                **kwargs):
     """Creates a PubsubClient instance to pass given topics between client and server.
 
+    After a disconnection, the client reconnects with jittered exponential
+    backoff and resumes listening from the last topic received, so topics
+    published meanwhile are replayed if the server still holds them.
+
+    Topics received from the server are relayed to other links of this node,
+    such as listeners of a PubsubServer on this node, and topics from other
+    links are relayed to the server, so nodes can be chained into a tree.
+    Topics never go back to the link they come from.
+
     Args:
-      service_target: a host:port string for connecting to server.
+      service_target: a host:port or unix:path string for connecting to
+                      server.
       inbound_topics: a list of topic ids. Only topics of this list will be received from server.
       outbound_topics: a list of topic ids. Only topics of this list will be sent to server.
+      queue_size: max number of topics pending for dispatch to server.
+      overflow: an OverflowPolicy applied when the dispatch queue is full.
+      block_timeout: max seconds a publisher waits with OverflowPolicy.BLOCK.
+      max_batch_size: max number of topics in a message to or from server. 0
+                      to send each topic in its own message.
+      linger: max seconds to wait for more topics to fill a batch.
+      max_reconnect_delay: max seconds to wait between reconnection attempts.
+      compression: a grpc.Compression for messages to server, or None for no
+                   compression. Whether messages from server are compressed
+                   is up to the server.
+      prefer_local: whether to connect through the unix domain socket of a
+                    server of this user on this host instead of its TCP port.
+      relay_for: a PubsubServer or AsyncPubsubServer on this node. Topics its
+                 listeners listen to are received from server too, and the
+                 client listens again as they change, so server only sends
+                 topics wanted downstream. Listening to all topics with
+                 inbound_topics=None makes this moot; use an empty list to
+                 only receive topics wanted downstream.
+      set_clock: whether to set system time to time of server on registering,
+                 which requires root.
     """
     super(PubsubClient, self).__init__(*args, **kwargs)
     self._inbound_topics = inbound_topics
     self._outbound_topics = outbound_topics
+    self._receiver_options = {
+        'queue_size': queue_size,
+        'overflow': overflow,
+        'block_timeout': block_timeout,
+    }
+    self._receiver = None
+    self._max_batch_size = max_batch_size
+    self._linger = linger
+    self._batching = False
+    self._max_reconnect_delay = max_reconnect_delay
+    self._last_sequence = 0
     self._transmitter = _PubsubTransmitter()
-
-    self.logger.info('Starting Pubsub client...')
-    channel = grpc.insecure_channel(service_target)
+    self._server_node_id = service_target
+    self._metadata = ((_NODE_ID_METADATA_KEY, _node_id),)
+    self._relay_for = relay_for
+    self._set_clock = set_clock
+    self._interest_changed = threading.Event()
+    self._listen_topic_ids = None
+
+    if prefer_local:
+      service_target = net.prefer_local_target(service_target)
+    self.logger.info('Starting Pubsub client to %s...', service_target)
+    channel = grpc.insecure_channel(service_target, compression=compression)
     self._stub = pubsub_pb2_grpc.PubsubStub(channel)
     self._register()
 
-    self._abort = False
+    self._abort = threading.Event()
+    self._abort_lock = threading.Lock()
+    self._listen_call = None
+    if relay_for:
+      relay_for.watch_interest(self._on_interest_changed)
     self._dispatch_thread = threading.Thread(
         name='PubsubClient.Dispatch', target=self._dispatch)
     self._listen_thread = threading.Thread(
-        target='PubsubClient.Listen', self._listen)
+        name='PubsubClient.Listen', target=self._listen)
     self._dispatch_thread.start()
     self._listen_thread.start()
 
   def stop(self):
-    self._abort = True
+    if self._relay_for:
+      self._relay_for.unwatch_interest(self._on_interest_changed)
+    with self._abort_lock:
+      self._abort.set()
+      self._interest_changed.set()
+      if self._listen_call:
+        self._listen_call.cancel()
+      if self._receiver:
+        self._receiver.topics.close()
     self.logger.info('Stopping dispatching...')
     self._dispatch_thread.join()
     self._dispatch_thread = None
@@ -347,43 +2349,146 @@ class PubsubClient(pattern.Logger):
     self._listen_thread = None
     self.logger.info('Pubsub client stopped.')
 
+  @property
+  def dropped(self):
+    """Returns a dict of topic id => number of topics dropped for dispatch."""
+    receiver = self._receiver
+    return receiver.dropped if receiver else {}
+
+  @property
+  def latency(self):
+    """Returns latency of topics from server. See _LatencyStats.snapshot()."""
+    return self._transmitter.latency
+
+  @property
+  def suppressed(self):
+    """Returns number of topics from server dropped as loops or duplicates."""
+    return self._transmitter.suppressed
+
   def _register(self):
     self.logger.info('Registering...')
     request = pubsub_pb2.RegisterRequest()
     response = self._stub.Register(request)
+    # Servers predating batches would ignore DispatchRequest.topics.
+    self._batching = response.batching and self._max_batch_size > 0
+    if response.node_id:
+      self._server_node_id = response.node_id
+    if not self._set_clock:
+      return
 
-    now = datetime.datetime.fromtimestamp(response.timestamp)
+    if response.timestamp_ns:
+      now = datetime.datetime.fromtimestamp(response.timestamp_ns / 1e9)
+    else:
+      now = datetime.datetime.fromtimestamp(response.timestamp)
     self.logger.info('Updating system time to %s...', now)
     clocks.set_system_time(now)
 
+  def _get_listen_topic_ids(self):
+    """Returns a sorted list of topic ids to listen to, or None for all topics.
+
+    The list is empty if the client relays for a server without listeners
+    and has no inbound topics of its own, in which case it does not listen.
+    """
+    topic_ids = [_topic_value(x) for x in self._inbound_topics or ()]
+    if not self._relay_for:
+      return topic_ids or None
+    interest = self._relay_for.interest
+    if self._inbound_topics is None or interest is None:
+      return None
+    return sorted(set(topic_ids) | set(_topic_value(x) for x in interest))
+
+  def _on_interest_changed(self):
+    with self._abort_lock:
+      if self._get_listen_topic_ids() == self._listen_topic_ids:
+        return
+      self.logger.info('Listening again for new interest...')
+      self._interest_changed.set()
+      if self._listen_call:
+        self._listen_call.cancel()
+
   def _listen(self):
-    if _topic_enum_class:
-      topic_ids = [x.value for x in self._inbound_topics]
-    else:
-      topic_ids = self._inbound_topics
-    request = pubsub_pb2.ListenRequest(topic_id=topic_ids)
-    while not self._abort:
+    backoff = _Backoff(maximum=self._max_reconnect_delay)
+    while True:
+      with self._abort_lock:
+        if self._abort.is_set():
+          break
+        self._interest_changed.clear()
+        topic_ids = self._listen_topic_ids = self._get_listen_topic_ids()
+        if topic_ids == []:
+          self._listen_call = None
+        else:
+          request = pubsub_pb2.ListenRequest(
+              topic_id=topic_ids,
+              max_batch_size=self._max_batch_size,
+              resume_after=self._last_sequence)
+          self._listen_call = self._stub.Listen(
+              request, metadata=self._metadata)
+      if not self._listen_call:
+        self._interest_changed.wait()
+        continue
+
       try:
-        for response in self._stub.Listen(request):
-          self._transmitter.transmit(response.topic)
-      except grpc._channel._Rendezvous:
-        self.logger.warn('gRPC connection disconnected for listen.')
-        pass
+        for response in self._listen_call:
+          backoff.reset()
+          if response.topics:
+            self._on_topics(response.topics)
+          elif response.HasField('topic'):
+            self._on_topics([response.topic])
+      except grpc.RpcError:
+        if not self._abort.is_set() and not self._interest_changed.is_set():
+          self.logger.warn('gRPC connection disconnected for listen.')
+      # Listens again right away for new interest, resuming from the last
+      # topic received.
+      if not self._interest_changed.is_set():
+        self._abort.wait(backoff.next())
+
+  def _on_topics(self, topics):
+    # Retained topics have no sequence number.
+    self._last_sequence = max(self._last_sequence,
+                              max(x.sequence for x in topics))
+    if len(topics) == 1:
+      self._transmitter.transmit(topics[0], self._server_node_id)
+    else:
+      self._transmitter.transmit_many(topics, self._server_node_id)
 
   def _dispatch(self):
-    while not self._abort:
+    backoff = _Backoff(maximum=self._max_reconnect_delay)
+    while not self._abort.is_set():
       try:
-        self._stub.Dispatch(self._dispatch_request_iterator())
-      except grpc._channel._Rendezvous:
+        self._stub.Dispatch(
+            self._dispatch_request_iterator(backoff), metadata=self._metadata)
+      except grpc.RpcError:
         self.logger.warn('gRPC connection disconnected for dispatch.')
         pass
-
-  def _dispatch_request_iterator(self):
-    with _PubsubReceiver(self._outbound_topics) as receiver:
-      while not self._abort:
+      finally:
+        # Releases the request iterator, which may still be blocked on the
+        # queue if the call ended on the server side.
+        with self._abort_lock:
+          if self._receiver:
+            self._receiver.topics.close()
+      self._abort.wait(backoff.next())
+
+  def _dispatch_request_iterator(self, backoff):
+    with _PubsubReceiver(
+        self._outbound_topics,
+        link=self._server_node_id,
+        **self._receiver_options) as receiver:
+      with self._abort_lock:
+        if self._abort.is_set():
+          return
+        self._receiver = receiver
+      while not receiver.topics.closed:
         try:
-          topic = receiver.topics.get(block=True, timeout=1)
-          self.logger.debug('Dispatching topic %s...', topic.id)
-          yield pubsub_pb2.DispatchRequest(topic=topic)
+          if self._batching:
+            topics = receiver.topics.get_many(
+                self._max_batch_size, linger=self._linger)
+            self.logger.debug('Dispatching %d topics...', len(topics))
+            yield pubsub_pb2.DispatchRequest(topics=topics)
+          else:
+            topic = receiver.topics.get()
+            self.logger.debug('Dispatching topic %s...', topic.id)
+            yield pubsub_pb2.DispatchRequest(topic=topic)
+          # Asked for more, so the connection is up.
+          backoff.reset()
         except queue.Empty:
           pass
@@ -0,0 +1,423 @@
+import asyncio
+import collections
+import threading
+import time
+
+import grpc
+
+from common import net
+from common import pattern
+from common import pubsub
+from common.proto import pubsub_pb2
+from common.proto import pubsub_pb2_grpc
+
+
+class AsyncPubsub(pattern.Logger):
+  """asyncio facade of Pubsub.
+
+  Topics published here reach all subscribers of the wrapped Pubsub, and
+  streams receive topics published from any thread, so coroutines and
+  thread-based code can share the Pubsub singleton.
+
+  Use it as:
+    pubsub = AsyncPubsub()
+    await pubsub.publish(topic, data)
+    async with pubsub.stream([topic]) as stream:
+      async for topic, data in stream:
+        ...
+  """
+
+  def __init__(self, sync_pubsub=None, *args, **kwargs):
+    super(AsyncPubsub, self).__init__(*args, **kwargs)
+    self._pubsub = sync_pubsub or pubsub.Pubsub.get_instance()
+
+  async def publish(self, topic, data):
+    self._pubsub.publish(topic, data)
+
+  async def publish_many(self, topics):
+    self._pubsub.publish_many(topics)
+
+  def stream(self,
+             topics=None,
+             maxsize=100,
+             overflow=pubsub.OverflowPolicy.DROP_OLDEST):
+    """Subscribes to topics and returns an async iterator of (topic, data).
+
+    Must be called from a coroutine, as the stream is bound to its running
+    event loop. The subscription starts immediately and lasts until the
+    stream is closed, either explicitly with aclose() or by leaving an
+    "async with" block.
+
+    Args:
+      topics: a list of topic ids or patterns, or None to receive all topics.
+      maxsize: max number of topics buffered for this stream.
+      overflow: OverflowPolicy.DROP_OLDEST or OverflowPolicy.DROP_NEWEST,
+                applied when the buffer is full. Blocking is not supported
+                since publishers may run on the event loop itself.
+    """
+    return _Stream(self._pubsub, topics, maxsize, overflow,
+                   asyncio.get_running_loop())
+
+
+class _Stream(object):
+  """Buffers topics from Pubsub and hands them out to a coroutine.
+
+  The event loop is only woken up when the consumer is waiting for an empty
+  buffer, not for every topic.
+  """
+
+  def __init__(self, sync_pubsub, topics, maxsize, overflow, loop):
+    assert overflow in (pubsub.OverflowPolicy.DROP_OLDEST,
+                        pubsub.OverflowPolicy.DROP_NEWEST)
+    self._pubsub = sync_pubsub
+    self._topics = list(set(topics)) if topics else [None]
+    self._maxsize = maxsize
+    self._overflow = overflow
+    self._loop = loop
+    self._buffer = collections.deque()
+    self._lock = threading.Lock()
+    self._waiter = None
+    self._closed = False
+    self._dropped = 0
+
+    for topic in self._topics:
+      self._pubsub.subscribe(topic, self._on_topics, batch=True)
+
+  @property
+  def dropped(self):
+    return self._dropped
+
+  def __aiter__(self):
+    return self
+
+  async def __anext__(self):
+    while True:
+      with self._lock:
+        if self._buffer:
+          return self._buffer.popleft()
+        if self._closed:
+          raise StopAsyncIteration()
+        waiter = self._waiter = self._loop.create_future()
+      await waiter
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, exc_type, exc_val, exc_tb):
+    await self.aclose()
+
+  async def aclose(self):
+    with self._lock:
+      if self._closed:
+        return
+      self._closed = True
+      waiter, self._waiter = self._waiter, None
+    for topic in self._topics:
+      self._pubsub.unsubscribe(topic, self._on_topics)
+    if waiter:
+      self._wake_up(waiter)
+
+  def _on_topics(self, topics):
+    with self._lock:
+      if self._closed:
+        return
+      for topic in topics:
+        if len(self._buffer) >= self._maxsize:
+          self._dropped += 1
+          if self._overflow == pubsub.OverflowPolicy.DROP_NEWEST:
+            continue
+          self._buffer.popleft()
+        self._buffer.append(topic)
+      waiter, self._waiter = self._waiter, None
+
+    if waiter:
+      if _in_loop(self._loop):
+        self._wake_up(waiter)
+      else:
+        self._loop.call_soon_threadsafe(self._wake_up, waiter)
+
+  @staticmethod
+  def _wake_up(waiter):
+    if not waiter.done():
+      waiter.set_result(None)
+
+
+def _in_loop(loop):
+  try:
+    return asyncio.get_running_loop() is loop
+  except RuntimeError:
+    return False
+
+
+class _AsyncListener(pubsub._HubListener):
+  """Queues encoded topics for a listener stream served on an event loop."""
+
+  def __init__(self,
+               topic_ids,
+               loop,
+               queue_size=1000,
+               overflow=pubsub.OverflowPolicy.DROP_NEWEST,
+               *args,
+               **kwargs):
+    # Blocking is not supported since publishers may run on the event loop.
+    assert overflow != pubsub.OverflowPolicy.BLOCK
+    super(_AsyncListener, self).__init__(topic_ids, queue_size, overflow, *args,
+                                         **kwargs)
+    self._loop = loop
+    self._lock = threading.Lock()
+    self._waiter = None
+    self._wanted = 1
+
+  async def get_many(self, max_items, linger=0):
+    """Waits for topics and returns up to max_items of them.
+
+    Args:
+      max_items: max number of topics to return.
+      linger: max seconds to wait for more topics after the first one, until
+              max_items topics are available.
+    """
+    deadline = None
+    while True:
+      with self._lock:
+        if self._topics:
+          if deadline is None:
+            deadline = self._loop.time() + linger
+          if (len(self._topics) >= max_items or
+              self._loop.time() >= deadline):
+            break
+          self._wanted = max_items
+        else:
+          self._wanted = 1
+        # A topic may be queued before the waiter is visible, so topics are
+        # counted again under the lock put_many() takes to wake it up.
+        waiter = self._waiter = self._loop.create_future()
+      if deadline is None:
+        await waiter
+      else:
+        try:
+          await asyncio.wait_for(waiter, deadline - self._loop.time())
+        except asyncio.TimeoutError:
+          pass
+    return self._topics.get_many(max_items, timeout=0)
+
+  def put_many(self, topics, block=True):
+    super(_AsyncListener, self).put_many(topics, block)
+    with self._lock:
+      if not self._waiter or len(self._topics) < self._wanted:
+        return
+      waiter, self._waiter = self._waiter, None
+    if _in_loop(self._loop):
+      _Stream._wake_up(waiter)
+    else:
+      self._loop.call_soon_threadsafe(_Stream._wake_up, waiter)
+
+
+class _AsyncPubsubServicer(pubsub_pb2_grpc.PubsubServicer, pattern.Logger):
+  """Serves the Pubsub service with coroutines instead of threads."""
+
+  def __init__(self,
+               receiver_options,
+               linger,
+               replay_size,
+               compression_threshold=0,
+               *args,
+               **kwargs):
+    super(_AsyncPubsubServicer, self).__init__(*args, **kwargs)
+    self._compression_threshold = compression_threshold
+    self._transmitter = pubsub._PubsubTransmitter()
+    self._hub = pubsub._FanoutHub(replay_size)
+    self._receiver_options = receiver_options
+    self._linger = linger
+    self._receivers = set()
+
+  @property
+  def dropped(self):
+    """Returns a dict of topic id => number of topics dropped."""
+    dropped = collections.Counter()
+    for receiver in list(self._receivers):
+      dropped.update(receiver.dropped)
+    return dict(dropped)
+
+  @property
+  def streams(self):
+    return len(self._receivers)
+
+  @property
+  def latency(self):
+    return self._transmitter.latency
+
+  @property
+  def suppressed(self):
+    return self._transmitter.suppressed
+
+  @property
+  def hub(self):
+    return self._hub
+
+  def start(self):
+    self._hub.__enter__()
+
+  def stop(self):
+    self._hub.__exit__(None, None, None)
+
+  async def Register(self, request, context):
+    now = time.time_ns()
+    return pubsub_pb2.RegisterResponse(
+        timestamp=now / 1e9,
+        timestamp_ns=now,
+        batching=True,
+        node_id=pubsub.get_node_id())
+
+  async def Listen(self, request, context):
+    if pubsub._topic_enum_class:
+      topic_ids = [pubsub._topic_enum_class(x) for x in request.topic_id]
+    else:
+      topic_ids = request.topic_id
+
+    listener = _AsyncListener(
+        topic_ids,
+        asyncio.get_running_loop(),
+        link=pubsub._remote_node_id(context),
+        **self._receiver_options)
+    with self._hub.listen(listener, request.resume_after) as receiver:
+      self._receivers.add(receiver)
+      try:
+        while True:
+          if request.max_batch_size:
+            topics = await receiver.get_many(request.max_batch_size,
+                                             self._linger)
+            response = pubsub._encode_listen_response(topics, batch=True)
+          else:
+            topics = await receiver.get_many(1)
+            response = pubsub._encode_listen_response(topics, batch=False)
+          if len(response) < self._compression_threshold:
+            context.disable_next_message_compression()
+          yield response
+      finally:
+        self._receivers.discard(receiver)
+
+  async def Dispatch(self, request_iterator, context):
+    link = pubsub._remote_node_id(context)
+    async for request in request_iterator:
+      if request.topics:
+        self._transmitter.transmit_many(request.topics, link)
+      else:
+        self._transmitter.transmit(request.topic, link)
+    return pubsub_pb2.DispatchResponse()
+
+
+class AsyncPubsubServer(pattern.Logger):
+  """PubsubServer running all streams as coroutines on one event loop.
+
+  It speaks the same protocol as PubsubServer, so PubsubClient can connect to
+  either, but idle streams hold no thread.
+
+  Use it as:
+    server = AsyncPubsubServer(port)
+    await server.start()
+    ...
+    await server.stop()
+  """
+
+  _STOP_GRACE_SECS = 5
+
+  def __init__(self,
+               port=50051,
+               queue_size=1000,
+               overflow=pubsub.OverflowPolicy.DROP_NEWEST,
+               linger=0.005,
+               replay_size=1000,
+               compression=None,
+               compression_threshold=1024,
+               unix_socket=True,
+               *args,
+               **kwargs):
+    """Creates an AsyncPubsubServer instance.
+
+    Args:
+      port: port to listen on, or 0 to pick a free port.
+      queue_size: max number of topics pending for each listener.
+      overflow: an OverflowPolicy other than BLOCK, applied when a listener
+                queue is full.
+      linger: max seconds to wait for more topics to fill a batch for
+              listeners that accept batches.
+      replay_size: max number of recent topics kept for clients resuming
+                   after a disconnection. 0 to disable resuming.
+      compression: a grpc.Compression for messages to clients which accept
+                   it, or None for no compression.
+      compression_threshold: messages to clients smaller than this number of
+                             bytes are sent uncompressed.
+      unix_socket: True to also listen on net.local_socket_path() of the port,
+                   a unix domain socket path to listen on instead, or False to
+                   only listen on TCP.
+    """
+    super(AsyncPubsubServer, self).__init__(*args, **kwargs)
+    self._requested_port = port
+    self._port = None
+    self._servicer = _AsyncPubsubServicer({
+        'queue_size': queue_size,
+        'overflow': overflow,
+    }, linger, replay_size, compression_threshold if compression else 0)
+    self._compression = compression
+    self._unix_socket = unix_socket
+    self._server = None
+
+  @property
+  def port(self):
+    """Returns the port listened on once started."""
+    return self._port
+
+  @property
+  def streams(self):
+    """Returns the number of open listener streams."""
+    return self._servicer.streams
+
+  @property
+  def dropped(self):
+    """Returns a dict of topic id => number of topics dropped."""
+    return self._servicer.dropped
+
+  @property
+  def latency(self):
+    """Returns latency of topics from clients. See _LatencyStats.snapshot()."""
+    return self._servicer.latency
+
+  @property
+  def suppressed(self):
+    """Returns number of topics from clients dropped as loops or duplicates."""
+    return self._servicer.suppressed
+
+  @property
+  def interest(self):
+    """Returns a frozenset of topic ids listened to, or None for all topics."""
+    return self._servicer.hub.interest
+
+  def watch_interest(self, callback):
+    """Calls callback without arguments whenever interest changes.
+
+    Callback runs on the event loop, so it must not block.
+    """
+    self._servicer.hub.watch_interest(callback)
+
+  def unwatch_interest(self, callback):
+    self._servicer.hub.unwatch_interest(callback)
+
+  async def start(self):
+    self.logger.info('Starting Pubsub server...')
+    self._server = grpc.aio.server(compression=self._compression)
+    pubsub._add_pubsub_servicer_to_server(self._servicer, self._server)
+    self._port = net.add_insecure_ports(self._server, self._requested_port,
+                                        self._unix_socket)
+    self._servicer.start()
+    await self._server.start()
+    self.logger.info('Pubsub server started on port %s.', self._port)
+
+  async def stop(self):
+    self.logger.info('Stopping Pubsub server...')
+    await self._server.stop(grace=self._STOP_GRACE_SECS)
+    self._servicer.stop()
+    self._server = None
+    self.logger.info('Pubsub server stopped.')
+
+  async def wait_for_termination(self):
+    await self._server.wait_for_termination()
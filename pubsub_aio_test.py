@@ -0,0 +1,199 @@
+import asyncio
+import threading
+import unittest
+
+import grpc
+
+from common import net
+from common import pubsub
+from common import pubsub_aio
+from common.proto import pubsub_pb2
+from common.proto import pubsub_pb2_grpc
+
+
+class AsyncPubsubTests(unittest.TestCase):
+  def setUp(self):
+    self._sync_pubsub = pubsub.Pubsub()
+    self._pubsub = pubsub_aio.AsyncPubsub(self._sync_pubsub)
+
+  def test_stream(self):
+    async def run():
+      async with self._pubsub.stream(['a']) as stream:
+        await self._pubsub.publish('a', 1)
+        await self._pubsub.publish('b', 2)
+        self._sync_pubsub.publish_many([('a', 3), ('a', 4)])
+        return [await stream.__anext__() for _ in range(3)]
+
+    self.assertEqual(
+        asyncio.run(run()), [('a', 1), ('a', 3), ('a', 4)])
+
+  def test_stream_from_other_thread(self):
+    async def run():
+      received = []
+      stream = self._pubsub.stream()
+      thread = threading.Thread(
+          target=lambda: [self._sync_pubsub.publish('a', i) for i in range(3)])
+      thread.start()
+      async for topic, data in stream:
+        received.append(data)
+        if len(received) == 3:
+          await stream.aclose()
+      thread.join()
+      return received
+
+    self.assertEqual(asyncio.run(run()), [0, 1, 2])
+
+  def test_drop_oldest(self):
+    async def run():
+      async with self._pubsub.stream(maxsize=2) as stream:
+        for i in range(5):
+          await self._pubsub.publish('a', i)
+        self.assertEqual(stream.dropped, 3)
+        return [await stream.__anext__() for _ in range(2)]
+
+    self.assertEqual(asyncio.run(run()), [('a', 3), ('a', 4)])
+
+  def test_stream_outside_event_loop(self):
+    with self.assertRaises(RuntimeError):
+      self._pubsub.stream(['a'])
+
+
+class AsyncListenerTests(unittest.TestCase):
+  def test_get_many_without_linger(self):
+    async def run():
+      listener = pubsub_aio._AsyncListener(None, asyncio.get_running_loop())
+      asyncio.get_running_loop().call_soon(
+          listener.put_many, [pubsub_pb2.Topic(id=1)])
+      return await listener.get_many(10)
+
+    self.assertEqual(asyncio.run(run()), [pubsub_pb2.Topic(id=1)])
+
+  def test_get_many_returns_full_batch_before_linger(self):
+    async def run():
+      listener = pubsub_aio._AsyncListener(None, asyncio.get_running_loop())
+      thread = threading.Thread(target=lambda: [
+          listener.put_many([pubsub_pb2.Topic(id=i)]) for i in range(3)
+      ])
+      loop = asyncio.get_running_loop()
+      start = loop.time()
+      loop.call_soon(thread.start)
+      topics = await listener.get_many(3, linger=10)
+      thread.join()
+      return topics, loop.time() - start
+
+    topics, elapsed = asyncio.run(run())
+    self.assertEqual([topic.id for topic in topics], [0, 1, 2])
+    self.assertLess(elapsed, 5)
+
+  def test_get_many_lingers_for_partial_batch(self):
+    async def run():
+      listener = pubsub_aio._AsyncListener(None, asyncio.get_running_loop())
+      listener.put_many([pubsub_pb2.Topic(id=1)])
+      return await listener.get_many(3, linger=0.05)
+
+    self.assertEqual(asyncio.run(run()), [pubsub_pb2.Topic(id=1)])
+
+
+class AsyncPubsubServerTests(unittest.TestCase):
+  def setUp(self):
+    self._received = []
+    pubsub.Pubsub.get_instance().subscribe(2, self._on_topic)
+
+  def tearDown(self):
+    pubsub.Pubsub.get_instance().unsubscribe(2, self._on_topic)
+
+  def _on_topic(self, topic, data):
+    self._received.append(data)
+
+  def test_listen_and_dispatch(self):
+    # More streams than the worker threads of PubsubServer.
+    listeners = 20
+
+    async def listen(stub, max_batch_size):
+      request = pubsub_pb2.ListenRequest(
+          topic_id=[1], max_batch_size=max_batch_size)
+      async for response in stub.Listen(request):
+        topics = response.topics or [response.topic]
+        return [x.integer_value for x in topics]
+
+    async def run():
+      server = pubsub_aio.AsyncPubsubServer(port=0)
+      await server.start()
+      try:
+        async with grpc.aio.insecure_channel('localhost:{0}'.format(
+            server.port)) as channel:
+          stub = pubsub_pb2_grpc.PubsubStub(channel)
+          tasks = [
+              asyncio.ensure_future(listen(stub, i % 2))
+              for i in range(listeners)
+          ]
+          while server.streams < listeners:
+            await asyncio.sleep(0.01)
+          pubsub.Pubsub.get_instance().publish(1, 7)
+          await stub.Dispatch(
+              iter([
+                  pubsub_pb2.DispatchRequest(
+                      topic=pubsub_pb2.Topic(id=2, integer_value=8))
+              ]))
+          return await asyncio.wait_for(asyncio.gather(*tasks), 5)
+      finally:
+        await server.stop()
+
+    self.assertEqual(asyncio.run(run()), [[7]] * listeners)
+    self.assertEqual(self._received, [8])
+
+  def test_compression(self):
+    # Only the long topic exceeds the threshold and is compressed.
+    values = ['short', 'long ' * 1000]
+
+    async def run():
+      server = pubsub_aio.AsyncPubsubServer(
+          port=0,
+          compression=grpc.Compression.Gzip,
+          compression_threshold=100)
+      await server.start()
+      try:
+        async with grpc.aio.insecure_channel('localhost:{0}'.format(
+            server.port)) as channel:
+          stub = pubsub_pb2_grpc.PubsubStub(channel)
+          call = stub.Listen(pubsub_pb2.ListenRequest(topic_id=[1]))
+          while server.streams < 1:
+            await asyncio.sleep(0.01)
+          for value in values:
+            pubsub.Pubsub.get_instance().publish(1, value)
+          received = []
+          async for response in call:
+            received.append(response.topic.string_value)
+            if len(received) == len(values):
+              call.cancel()
+              return received
+      finally:
+        await server.stop()
+
+    self.assertEqual(asyncio.run(run()), values)
+
+  def test_unix_socket(self):
+    async def run():
+      server = pubsub_aio.AsyncPubsubServer(port=0)
+      await server.start()
+      try:
+        target = net.prefer_local_target('localhost:{0}'.format(server.port))
+        self.assertEqual(target,
+                         'unix:' + net.local_socket_path(server.port))
+        async with grpc.aio.insecure_channel(target) as channel:
+          stub = pubsub_pb2_grpc.PubsubStub(channel)
+          call = stub.Listen(pubsub_pb2.ListenRequest(topic_id=[1]))
+          while server.streams < 1:
+            await asyncio.sleep(0.01)
+          pubsub.Pubsub.get_instance().publish(1, 7)
+          async for response in call:
+            call.cancel()
+            return response.topic.integer_value
+      finally:
+        await server.stop()
+
+    self.assertEqual(asyncio.run(run()), 7)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,307 @@
+"""Records topics of Pubsub to files, and plays them back.
+
+PubsubRecorder appends topics as length-prefixed pubsub_pb2.Topic records to
+files rotated over time and size. PubsubPlayer publishes recorded topics
+again, at recorded pace, faster, or as fast as possible.
+
+Use it as:
+  recorder = PubsubRecorder('/var/log/pubsub')
+  recorder.start()
+  ...
+  recorder.stop()
+
+  player = PubsubPlayer('/var/log/pubsub', speed=10)
+  player.start()
+  player.wait()
+"""
+import datetime
+import glob
+import os
+import queue
+
+from common import clocks
+from common import file
+from common import pattern
+from common import pubsub
+from common.proto import pubsub_pb2
+
+_EXTENSION = 'journal'
+
+
+def _frame(topic):
+  data = topic.SerializeToString()
+  return pubsub._varint(len(data)) + data
+
+
+def _read_varint(buf, pos):
+  """Returns (value, position after value), or (None, pos) if incomplete."""
+  value = 0
+  shift = 0
+  end = pos
+  while end < len(buf):
+    byte = buf[end]
+    end += 1
+    value |= (byte & 0x7f) << shift
+    if not byte & 0x80:
+      return value, end
+    shift += 7
+  return None, pos
+
+
+def _parse_topics(buf):
+  """Returns (list of pubsub_pb2.Topic, position after the last whole record).
+
+  Raises:
+    google.protobuf.message.DecodeError: if a record is not a Topic.
+  """
+  topics = []
+  pos = 0
+  while True:
+    size, start = _read_varint(buf, pos)
+    if size is None or start + size > len(buf):
+      return topics, pos
+    topics.append(pubsub_pb2.Topic.FromString(buf[start:start + size]))
+    pos = start + size
+
+
+def _read_topics(filepath, block_size=1 << 20):
+  """Yields pubsub_pb2.Topic records of a journal file.
+
+  A record cut short at the end of the file, as left by a crash, is ignored.
+  """
+  with open(filepath, 'rb') as f:
+    buf = b''
+    while True:
+      block = f.read(block_size)
+      if not block:
+        return
+      buf += block
+      topics, pos = _parse_topics(buf)
+      for topic in topics:
+        yield topic
+      buf = buf[pos:]
+
+
+class PubsubRecorder(pattern.Worker):
+  """Records topics of local Pubsub into rotating journal files.
+
+  Topics are queued on the publisher's thread and written in batches by the
+  worker thread, so recording adds no disk I/O to publishing. Topics arriving
+  while the queue is full are dropped and counted.
+
+  Files are named <prefix><interval start><postfix>_<chunk>.journal, where
+  postfix is the start time of the recorder, so names sort in recording
+  order.
+  """
+
+  def __init__(self,
+               path,
+               topics=None,
+               prefix='pubsub_',
+               interval=datetime.timedelta(hours=1),
+               max_file_size=None,
+               queue_size=10000,
+               max_batch_size=1000,
+               linger=0.1,
+               *args,
+               **kwargs):
+    """Creates a PubsubRecorder instance.
+
+    Args:
+      path: directory to write journal files to.
+      topics: a list of topic ids to record, or None for all topics.
+      prefix: prefix of journal file names.
+      interval: a datetime.timedelta of time covered by each file.
+      max_file_size: max size of a file in bytes, after which a new chunk is
+                     started. None for no limit.
+      queue_size: max number of topics pending for write.
+      max_batch_size: max number of topics in a write.
+      linger: max seconds to wait for more topics to fill a write.
+    """
+    super(PubsubRecorder, self).__init__(
+        worker_name='PubsubRecorder', *args, **kwargs)
+    self._path = path
+    self._topics = topics
+    self._prefix = prefix
+    self._interval = interval
+    self._max_file_size = max_file_size
+    self._queue_size = queue_size
+    self._max_batch_size = max_batch_size
+    self._linger = linger
+    self._receiver = None
+    self._timed_file = None
+    self._writer = None
+    self._recorded = 0
+
+  @property
+  def recorded(self):
+    """Returns number of topics written."""
+    return self._recorded
+
+  @property
+  def dropped(self):
+    """Returns a dict of topic id => number of topics dropped."""
+    return self._receiver.dropped if self._receiver else {}
+
+  def stop(self):
+    # Wakes up the worker thread, which writes what is left before stopping.
+    if self._receiver:
+      self._receiver.topics.close()
+    super(PubsubRecorder, self).stop()
+
+  def _on_start(self):
+    postfix = '_{0:%Y%m%dT%H%M%S}'.format(datetime.datetime.now())
+    self._timed_file = file.TimedFile(
+        self._path, _EXTENSION, self._interval, self._prefix, postfix)
+    self._receiver = pubsub._PubsubReceiver(
+        self._topics,
+        queue_size=self._queue_size,
+        overflow=pubsub.OverflowPolicy.DROP_NEWEST)
+    self._receiver.__enter__()
+
+  def _on_run(self):
+    try:
+      topics = self._receiver.topics.get_many(
+          self._max_batch_size, timeout=1, linger=self._linger)
+    except queue.Empty:
+      return
+    self._write(topics)
+
+  def _on_stop(self):
+    self._receiver.__exit__(None, None, None)
+    self._receiver.topics.close()
+    while True:
+      try:
+        self._write(
+            self._receiver.topics.get_many(self._max_batch_size, timeout=0))
+      except queue.Empty:
+        break
+    if self._writer:
+      self._writer.close()
+      self._writer = None
+
+  def _write(self, topics):
+    if self._timed_file.expired():
+      if self._writer:
+        self._writer.close()
+      self._timed_file.refresh()
+      self._writer = file.ChunkFileWriter(self._timed_file.name, 'wb',
+                                          self._max_file_size)
+    self._writer.write(b''.join(_frame(x) for x in topics))
+    self._recorded += len(topics)
+
+
+class PubsubPlayer(pattern.Worker):
+  """Publishes topics recorded by PubsubRecorder to local Pubsub.
+
+  Topics are published again as local topics, spaced as recorded by
+  clocks.ReplayClock at given speed. Topics without publish time, such as
+  retained topics, are published right away.
+  """
+
+  def __init__(self,
+               path,
+               prefix='pubsub_',
+               speed=1,
+               topics=None,
+               max_batch_size=1000,
+               *args,
+               **kwargs):
+    """Creates a PubsubPlayer instance.
+
+    Args:
+      path: directory of journal files, or a list of journal files to play.
+      prefix: prefix of journal file names, if path is a directory.
+      speed: pace relative to recording, such as 1 or 10, or None to publish
+             as fast as possible.
+      topics: a list of topic ids to play, or None for all topics.
+      max_batch_size: max number of due topics published together.
+    """
+    super(PubsubPlayer, self).__init__(
+        worker_name='PubsubPlayer', *args, **kwargs)
+    assert speed is None or speed > 0
+    if isinstance(path, str):
+      self._filepaths = sorted(
+          glob.glob(
+              os.path.join(path, '{0}*.{1}'.format(prefix, _EXTENSION))))
+    else:
+      self._filepaths = list(path)
+    self._speed = speed
+    self._topic_ids = set(pubsub._topic_value(x)
+                          for x in topics) if topics else None
+    self._max_batch_size = max_batch_size
+    self._pubsub = pubsub.Pubsub.get_instance()
+    self._records = None
+    self._pending = None
+    self._replay_clock = None
+    self._played = 0
+
+  @property
+  def played(self):
+    """Returns number of topics published."""
+    return self._played
+
+  def wait(self, timeout=None):
+    """Waits until all topics are played or player is stopped."""
+    thread = self._worker_thread
+    if thread:
+      thread.join(timeout)
+
+  def _on_start(self):
+    self._records = self._read()
+    self._pending = None
+    self._replay_clock = None
+
+  def _on_run(self):
+    topic = self._pending or next(self._records, None)
+    self._pending = None
+    if topic is None:
+      self.logger.info('Played %d topics.', self._played)
+      return False
+
+    delay = self._delay(topic)
+    if delay > 0:
+      self._pending = topic
+      # Wakes up at least every second to check for stop.
+      self._sleep(min(delay, 1))
+      return
+
+    batch = [topic]
+    while len(batch) < self._max_batch_size:
+      topic = next(self._records, None)
+      if topic is None:
+        break
+      if self._delay(topic) > 0:
+        self._pending = topic
+        break
+      batch.append(topic)
+    self._publish(batch)
+
+  def _read(self):
+    for filepath in self._filepaths:
+      self.logger.info('Playing %s...', filepath)
+      for topic in _read_topics(filepath):
+        if self._topic_ids is None or topic.id in self._topic_ids:
+          yield topic
+
+  def _delay(self, topic):
+    """Returns seconds to wait before publishing topic."""
+    if not self._speed or not topic.timestamp_ns:
+      return 0
+    recorded = datetime.datetime.utcfromtimestamp(topic.timestamp_ns / 1e9)
+    if not self._replay_clock:
+      self._replay_clock = clocks.ReplayClock(recorded, self._speed)
+      return 0
+    return (recorded - self._replay_clock.utc).total_seconds() / self._speed
+
+  def _publish(self, topics):
+    decoded = []
+    for topic in topics:
+      topic_id, decoder = pubsub._get_decoder(topic.id,
+                                              topic.WhichOneof('data'))
+      if decoder:
+        decoded.append((topic_id, decoder(topic)))
+      else:
+        self.logger.warn('Unable to decode topic %s.', topic_id)
+    self._pubsub.publish_many(decoded)
+    self._played += len(decoded)
@@ -0,0 +1,75 @@
+import os
+import tempfile
+import time
+import unittest
+
+from common import pubsub
+from common import pubsub_journal
+
+
+class PubsubJournalTests(unittest.TestCase):
+  def setUp(self):
+    self._dir = tempfile.TemporaryDirectory()
+    self._received = []
+
+  def tearDown(self):
+    self._dir.cleanup()
+
+  def _on_topic(self, topic, data):
+    self._received.append((topic, data, time.time()))
+
+  def _record(self, topics, interval=0, **kwargs):
+    recorder = pubsub_journal.PubsubRecorder(
+        self._dir.name, topics=[1, 2], linger=0, **kwargs)
+    recorder.start()
+    instance = pubsub.Pubsub.get_instance()
+    for topic, data in topics:
+      instance.publish(topic, data)
+      time.sleep(interval)
+    recorder.stop()
+    return recorder
+
+  def _play(self, **kwargs):
+    instance = pubsub.Pubsub.get_instance()
+    instance.subscribe(None, self._on_topic)
+    try:
+      player = pubsub_journal.PubsubPlayer(self._dir.name, **kwargs)
+      player.start()
+      player.wait(5)
+    finally:
+      instance.unsubscribe(None, self._on_topic)
+    return player
+
+  def test_record_and_play(self):
+    recorder = self._record([(1, 1), (2, 'x'), (3, 3), (1, [1.5, 2])])
+    self.assertEqual(recorder.recorded, 3)
+
+    player = self._play(speed=None)
+    self.assertEqual(player.played, 3)
+    self.assertEqual([x[:2] for x in self._received], [(1, 1), (2, 'x'),
+                                                        (1, [1.5, 2])])
+
+  def test_play_at_speed(self):
+    self._record([(1, 1), (1, 2)], interval=0.2)
+    self._play(speed=2, topics=[1])
+    self.assertEqual([x[1] for x in self._received], [1, 2])
+    self.assertAlmostEqual(
+        self._received[1][2] - self._received[0][2], 0.1, delta=0.05)
+
+  def test_rotate_chunks(self):
+    self._record([(1, 'x' * 100)] * 3, interval=0.05, max_file_size=150)
+    self.assertEqual(len(os.listdir(self._dir.name)), 2)
+    player = self._play(speed=None)
+    self.assertEqual(player.played, 3)
+
+  def test_truncated_record(self):
+    self._record([(1, 1), (1, 2)])
+    filepath = os.path.join(self._dir.name, os.listdir(self._dir.name)[0])
+    with open(filepath, 'rb+') as f:
+      f.truncate(os.path.getsize(filepath) - 1)
+    self._play(speed=None)
+    self.assertEqual([x[1] for x in self._received], [1])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,223 @@
+"""Bridges Pubsub topics to and from Kafka.
+
+PubsubKafkaProducer sends topics of local Pubsub to a Kafka topic, packing
+batches of topics into each Kafka message, as each send costs far more than
+encoding a topic. PubsubKafkaConsumer publishes topics of those messages to
+local Pubsub, handing over all topics of a poll at once.
+
+Messages hold length-prefixed pubsub_pb2.Topic records, as journal files of
+pubsub_journal do. Topics keep their origin, so a node does not consume its
+own topics back, and topics consumed from Kafka are not sent to it again.
+
+Use it as:
+  producer = PubsubKafkaProducer(
+      lambda: kafka.KafkaProducer(bootstrap_servers=...), 'pubsub',
+      topics=[...])
+  producer.start()
+
+  consumer = PubsubKafkaConsumer(
+      lambda topic, group: kafka.KafkaConsumer(
+          topic, group_id=group, bootstrap_servers=...),
+      'pubsub', 'my-group')
+  consumer.start()
+
+kafka_util.InMemoryKafka stands in for Kafka in tests.
+"""
+import queue
+
+from google.protobuf import message as protobuf_message
+
+from common import kafka_util
+from common import pattern
+from common import pubsub
+from common import pubsub_journal
+
+
+def _link(kafka_topic):
+  """Returns the name of the link to given Kafka topic."""
+  return 'kafka:' + kafka_topic
+
+
+class PubsubKafkaProducer(pattern.Worker):
+  """Sends topics of local Pubsub to a Kafka topic in batches.
+
+  Topics are queued on the publisher's thread and sent by the worker thread,
+  up to max_batch_size topics per Kafka message, waiting up to linger for a
+  batch to fill. Topics arriving while the queue is full are dropped and
+  counted.
+  """
+
+  def __init__(self,
+               kafka_producer_builder,
+               kafka_topic,
+               topics=None,
+               key=None,
+               queue_size=100000,
+               max_batch_size=1000,
+               max_message_size=1000000,
+               linger=0.005,
+               *args,
+               **kwargs):
+    """Creates a PubsubKafkaProducer instance.
+
+    Args:
+      kafka_producer_builder: a function returning a kafka.KafkaProducer, or
+                              anything with the same send(), flush() and
+                              close(). Values are sent as bytes.
+      kafka_topic: Kafka topic to send to.
+      topics: a list of topic ids to send, or None for all topics.
+      key: key of Kafka messages as bytes, such as the node name, so that
+           messages go to the same partition and stay in order. None to
+           spread messages over partitions.
+      queue_size: max number of topics pending for send.
+      max_batch_size: max number of topics in a Kafka message.
+      max_message_size: max size of a Kafka message in bytes, as configured
+                        on brokers. A larger topic is sent on its own.
+      linger: max seconds to wait for more topics to fill a Kafka message.
+    """
+    super(PubsubKafkaProducer, self).__init__(
+        worker_name='PubsubKafkaProducer: {0}'.format(kafka_topic),
+        *args,
+        **kwargs)
+    self._kafka_producer_builder = kafka_producer_builder
+    self._kafka_topic = kafka_topic
+    self._topics = topics
+    self._key = key
+    self._queue_size = queue_size
+    self._max_batch_size = max_batch_size
+    self._max_message_size = max_message_size
+    self._linger = linger
+    self._producer = None
+    self._receiver = None
+    self._sent = 0
+    self._failed = 0
+
+  @property
+  def sent(self):
+    """Returns number of topics handed to the Kafka producer."""
+    return self._sent
+
+  @property
+  def failed(self):
+    """Returns number of topics the Kafka producer failed to take."""
+    return self._failed
+
+  @property
+  def dropped(self):
+    """Returns a dict of topic id => number of topics dropped."""
+    return self._receiver.dropped if self._receiver else {}
+
+  def stop(self):
+    # Wakes up the worker thread, which sends what is left before stopping.
+    if self._receiver:
+      self._receiver.topics.close()
+    super(PubsubKafkaProducer, self).stop()
+
+  def _on_start(self):
+    self._producer = self._kafka_producer_builder()
+    self._receiver = pubsub._PubsubReceiver(
+        self._topics,
+        queue_size=self._queue_size,
+        overflow=pubsub.OverflowPolicy.DROP_NEWEST,
+        link=_link(self._kafka_topic))
+    self._receiver.__enter__()
+
+  def _on_run(self):
+    try:
+      topics = self._receiver.topics.get_many(
+          self._max_batch_size, timeout=1, linger=self._linger)
+    except queue.Empty:
+      return
+    self._send(topics)
+
+  def _on_stop(self):
+    self._receiver.__exit__(None, None, None)
+    self._receiver.topics.close()
+    while True:
+      try:
+        self._send(
+            self._receiver.topics.get_many(self._max_batch_size, timeout=0))
+      except queue.Empty:
+        break
+    self._producer.flush()
+    self._producer.close()
+    self._producer = None
+
+  def _send(self, topics):
+    frames = []
+    size = 0
+    for topic in topics:
+      frame = pubsub_journal._frame(topic)
+      if frames and size + len(frame) > self._max_message_size:
+        self._send_frames(frames)
+        frames = []
+        size = 0
+      frames.append(frame)
+      size += len(frame)
+    if frames:
+      self._send_frames(frames)
+
+  def _send_frames(self, frames):
+    try:
+      self._producer.send(
+          self._kafka_topic, value=b''.join(frames), key=self._key)
+    except Exception as ex:
+      self._failed += len(frames)
+      self.logger.warn('Failed to send %d topics to Kafka: %s', len(frames),
+                       ex)
+      return
+    self._sent += len(frames)
+
+
+class PubsubKafkaConsumer(kafka_util.EventConsumer):
+  """Publishes topics sent by PubsubKafkaProducer to local Pubsub.
+
+  Topics of messages polled from a partition are published with one call,
+  each keeping its origin and publish time. Topics of this node are dropped,
+  as are topics also received from a closer link, such as a PubsubClient to
+  their origin.
+  """
+
+  def __init__(self, kafka_consumer_builder, kafka_topic, group, *args,
+               **kwargs):
+    """Creates a PubsubKafkaConsumer instance.
+
+    Args:
+      kafka_consumer_builder: a function taking (Kafka topic, group) and
+                              returning a kafka.KafkaConsumer, or anything
+                              with the same poll() and close(). Values must
+                              be polled as bytes.
+      kafka_topic: Kafka topic to consume.
+      group: Kafka consumer group.
+    """
+    super(PubsubKafkaConsumer, self).__init__(
+        kafka_consumer_builder, kafka_topic, group, *args, **kwargs)
+    self._transmitter = pubsub._PubsubTransmitter()
+    self._received = 0
+
+  @property
+  def received(self):
+    """Returns number of topics read from Kafka messages."""
+    return self._received
+
+  @property
+  def suppressed(self):
+    """Returns number of topics dropped as looped back or duplicated."""
+    return self._transmitter.suppressed
+
+  def _on_messages(self, messages):
+    topics = []
+    for message in messages:
+      try:
+        parsed, end = pubsub_journal._parse_topics(message.value)
+      except protobuf_message.DecodeError as ex:
+        self.logger.warn('[{0}:{1}] Failed to decode message {2}: {3}'.format(
+            message.topic, self._group, message.offset, ex))
+        continue
+      if end < len(message.value):
+        self.logger.warn('[{0}:{1}] Message {2} is cut short.'.format(
+            message.topic, self._group, message.offset))
+      topics.extend(parsed)
+    if topics:
+      self._received += len(topics)
+      self._transmitter.transmit_many(topics, _link(self._topic))
@@ -0,0 +1,115 @@
+import time
+import unittest
+
+from common import kafka_util
+from common import pubsub
+from common import pubsub_journal
+from common import pubsub_kafka
+
+
+class PubsubKafkaTests(unittest.TestCase):
+  def setUp(self):
+    self._node_id = pubsub.get_node_id()
+    self._kafka = kafka_util.InMemoryKafka()
+    self._pubsub = pubsub.Pubsub.get_instance()
+    self._received = []
+
+  def tearDown(self):
+    pubsub.set_node_id(self._node_id)
+
+  def _on_topics(self, topics):
+    self._received.append(topics)
+
+  def _produce(self, topics, **kwargs):
+    producer = pubsub_kafka.PubsubKafkaProducer(
+        self._kafka.producer, 'pubsub', **kwargs)
+    producer.start()
+    self._pubsub.publish_many(topics)
+    producer.stop()
+    return producer
+
+  def _consume(self, count):
+    consumer = pubsub_kafka.PubsubKafkaConsumer(self._kafka.consumer,
+                                                'pubsub', 'test')
+    self._pubsub.subscribe(None, self._on_topics, batch=True)
+    consumer.start()
+    try:
+      deadline = time.time() + 5
+      while consumer.received < count and time.time() < deadline:
+        time.sleep(0.01)
+    finally:
+      consumer.stop()
+      self._pubsub.unsubscribe(None, self._on_topics)
+    return consumer
+
+  def _messages(self):
+    return [[(x.id, x.integer_value)
+             for x in pubsub_journal._parse_topics(record.value)[0]]
+            for record in self._kafka.records('pubsub')]
+
+  def test_produce_in_batches(self):
+    producer = self._produce([(1, 1), (2, 2), (3, 3), (1, 4), (1, 5), (2, 6)],
+                             max_batch_size=2)
+    self.assertEqual(producer.sent, 6)
+    self.assertEqual(self._messages(), [[(1, 1), (2, 2)], [(3, 3), (1, 4)],
+                                        [(1, 5), (2, 6)]])
+
+  def test_max_message_size(self):
+    pubsub.set_node_id('node')
+    self._produce([(1, 'x' * 100)] * 3, max_message_size=300)
+    self.assertEqual([len(x) for x in self._messages()], [2, 1])
+
+  def test_consume(self):
+    pubsub.set_node_id('producer')
+    self._produce([(1, 1), (2, 'x')])
+    self._produce([(1, [1.5, 2])])
+    pubsub.set_node_id('consumer')
+
+    consumer = self._consume(3)
+    self.assertEqual(consumer.received, 3)
+    self.assertEqual(self._received, [[(1, 1), (2, 'x'), (1, [1.5, 2])]])
+
+  def test_consume_topics_published_one_by_one(self):
+    pubsub.set_node_id('producer')
+    producer = pubsub_kafka.PubsubKafkaProducer(self._kafka.producer, 'pubsub')
+    producer.start()
+    for i in range(5):
+      self._pubsub.publish(1, i)
+    producer.stop()
+    pubsub.set_node_id('consumer')
+
+    self._consume(5)
+    self.assertEqual(self._received, [[(1, i) for i in range(5)]])
+
+  def test_skip_own_topics(self):
+    self._produce([(1, 1), (2, 2)])
+    consumer = self._consume(2)
+    self.assertEqual(consumer.suppressed, 2)
+    self.assertEqual(self._received, [])
+
+  def test_consumed_topics_not_sent_back(self):
+    pubsub.set_node_id('producer')
+    self._produce([(1, 1)])
+    pubsub.set_node_id('consumer')
+
+    producer = pubsub_kafka.PubsubKafkaProducer(self._kafka.producer, 'pubsub')
+    producer.start()
+    try:
+      self._consume(1)
+    finally:
+      producer.stop()
+    self.assertEqual(producer.sent, 0)
+    self.assertEqual(len(self._kafka.records('pubsub')), 1)
+
+  def test_corrupted_message(self):
+    self._kafka.producer().send('pubsub', value=b'\x05\xff\xff\xff\xff\xff')
+    pubsub.set_node_id('producer')
+    self._produce([(1, 1)])
+    pubsub.set_node_id('consumer')
+
+    self._consume(1)
+    self.assertEqual(self._received, [[(1, 1)]])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,594 @@
+"""Pubsub between processes on the same host over shared memory.
+
+An alternative to PubsubServer/PubsubClient that skips gRPC and TCP. Every
+endpoint owns an inbox: a multi-producer, single-consumer ring buffer of
+framed pubsub_pb2.Topic messages in shared memory. Clients announce their
+inbox to the server, which then writes topics straight into it.
+
+Topics a client writes to the server inbox are prefixed with the node id of
+the client, which the server transmits them with as link, so topics relayed
+from behind a client are not sent back to it.
+
+Doorbell and lock files of rings live in a directory private to the user,
+and rings are only attached to if the user owns them.
+
+Each end checks every second that the consumer of the inbox it writes to is
+still there. A client whose server stopped announces itself again as soon
+as the server is back, and a server forgets clients which went away.
+
+  Server process                                      Client process(es)
+   Local Pubsub                                         Local Pubsub
+     => _RingWriter => [client inbox] => SharedMemoryClient => _PubsubTransmitter =>
+     <= _PubsubTransmitter <= SharedMemoryServer <= [server inbox] <= _RingWriter <=
+"""
+
+import fcntl
+import json
+import os
+import select
+import struct
+import tempfile
+import threading
+import time
+
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+
+from common import net
+from common import pattern
+from common import pubsub
+from common.proto import pubsub_pb2
+
+_TOPIC = 1
+_HELLO = 2
+_BYE = 3
+
+# Length of the node id of the sender preceding topics from clients.
+_SENDER = struct.Struct('=H')
+
+# Names of rings created by this process.
+_created_rings = set()
+
+# Seconds between checks that the consumer of a ring written to is alive.
+_LIVENESS_CHECK_SECS = 1
+
+_register_lock = threading.Lock()
+
+
+def _ring_dir():
+  """Returns the directory of doorbell and lock files of rings of this user.
+
+  Like net.local_socket_dir(), it is only used if no other user may enter it,
+  so other users can neither take the path of a file nor hold the lock.
+
+  Raises:
+    PermissionError: if the directory is not private to this user.
+  """
+  base = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+  path = os.path.join(base, 'pubsub-shm-{0}'.format(os.getuid()))
+  if not net._make_private_dir(path):
+    raise PermissionError('{0} is not private to this user.'.format(path))
+  return path
+
+
+def _with_sender(sender, payload):
+  data = sender.encode('utf-8')
+  return _SENDER.pack(len(data)) + data + payload
+
+
+def _split_sender(payload):
+  """Returns (sender, payload) of a payload prefixed by _with_sender()."""
+  size = _SENDER.unpack_from(payload)[0]
+  offset = _SENDER.size + size
+  return payload[_SENDER.size:offset].decode('utf-8'), payload[offset:]
+
+
+def _attach(name):
+  """Attaches to an existing shared memory segment without tracking it.
+
+  Only the creator may unlink the segment, so it must not be tracked (and
+  unlinked at exit) by producers. Before Python 3.13, attaching always
+  registers the segment with the resource tracker, which a spawned process
+  shares with its parent, so unregistering it afterwards would drop the
+  registration of the creator. Registration is skipped instead.
+  """
+  try:
+    return shared_memory.SharedMemory(name=name, track=False)
+  except TypeError:
+    pass
+
+  with _register_lock:
+    register = resource_tracker.register
+
+    def register_others(resource, rtype):
+      if rtype != 'shared_memory' or resource.lstrip('/') != name:
+        register(resource, rtype)
+
+    resource_tracker.register = register_others
+    try:
+      return shared_memory.SharedMemory(name=name)
+    finally:
+      resource_tracker.register = register
+
+
+class _Ring(object):
+  """Multi-producer, single-consumer ring buffer of frames in shared memory.
+
+  Producers of any process serialize on a file lock, append frames and
+  advance the head. The consumer reads up to the head and advances the tail
+  without locking. A consumer about to sleep raises a waiting flag in the
+  header and blocks on a FIFO, which producers only write to while that flag
+  is set, so a busy ring costs no system call beyond the lock.
+  """
+
+  _HEAD = struct.Struct('=Q')
+  _TAIL = struct.Struct('=Q')
+  _CAPACITY = struct.Struct('=Q')
+  _WAITING = struct.Struct('=I')
+  _CLOSED = struct.Struct('=I')
+  _OWNER = struct.Struct('=Q')
+  _FRAME = struct.Struct('=IB')
+  _HEADER_SIZE = 64
+
+  def __init__(self, name, capacity=None, create=False):
+    """Creates or attaches to a ring.
+
+    Args:
+      name: name of the shared memory segment.
+      capacity: size of the data area in bytes. Only used with create=True.
+      create: True to create the ring as its consumer, False to attach to an
+              existing ring as a producer.
+    Raises:
+      FileNotFoundError: if the ring to attach to does not exist or is not
+                         ready yet.
+      PermissionError: if the ring to attach to is owned by another user.
+    """
+    self._name = name
+    self._create = create
+    base_path = os.path.join(_ring_dir(), name)
+    self._doorbell_path = base_path + '.doorbell'
+    self._lock_path = base_path + '.lock'
+
+    if create:
+      self._memory = shared_memory.SharedMemory(
+          name=name, create=True, size=self._HEADER_SIZE + capacity)
+      _created_rings.add(name)
+      self._memory.buf[:self._HEADER_SIZE] = bytes(self._HEADER_SIZE)
+      self._CAPACITY.pack_into(self._memory.buf, 16, capacity)
+      self._OWNER.pack_into(self._memory.buf, 32, os.getpid())
+      if os.path.exists(self._doorbell_path):
+        os.remove(self._doorbell_path)
+      os.mkfifo(self._doorbell_path)
+      # Opened for writing as well, so the FIFO never reports EOF.
+      self._doorbell = os.open(self._doorbell_path, os.O_RDWR | os.O_NONBLOCK)
+    else:
+      self._memory = self._attach(name)
+      self._doorbell = None
+
+    self._buf = self._memory.buf
+    self._capacity = self._CAPACITY.unpack_from(self._buf, 16)[0]
+    self._tail = self._TAIL.unpack_from(self._buf, 8)[0]
+    self._thread_lock = threading.Lock()
+    self._file_lock = os.open(self._lock_path,
+                              os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    self._dropped = 0
+
+  def _attach(self, name):
+    try:
+      memory = _attach(name)
+    except ValueError:
+      # The creator has not sized the segment yet.
+      raise FileNotFoundError('Ring {0} is not ready.'.format(name)) from None
+    if os.fstat(memory._fd).st_uid != os.getuid():
+      memory.close()
+      raise PermissionError('Ring {0} is owned by another user.'.format(name))
+    # The creator writes the owner last, once the header is complete.
+    if not self._OWNER.unpack_from(memory.buf, 32)[0]:
+      memory.close()
+      raise FileNotFoundError('Ring {0} is not ready.'.format(name))
+    return memory
+
+  @property
+  def name(self):
+    return self._name
+
+  @property
+  def dropped(self):
+    return self._dropped
+
+  @property
+  def alive(self):
+    """Returns whether the consumer of the ring still consumes it."""
+    if self._CLOSED.unpack_from(self._buf, 28)[0]:
+      return False
+    # A consumer which crashed could not mark the ring as closed.
+    try:
+      os.kill(self._OWNER.unpack_from(self._buf, 32)[0], 0)
+    except ProcessLookupError:
+      return False
+    except PermissionError:
+      pass
+    return True
+
+  def put(self, kind, payload):
+    return self.put_many(kind, [payload])
+
+  def put_many(self, kind, payloads):
+    """Appends frames to the ring.
+
+    Frames that do not fit, or are put after the ring is closed, are dropped.
+
+    Returns:
+      True if all frames were written.
+    """
+    frames = []
+    for payload in payloads:
+      frames.append(self._FRAME.pack(len(payload), kind))
+      frames.append(payload)
+
+    with self._thread_lock:
+      # Publishers may still be writing as a writer of the ring is removed.
+      if self._buf is None:
+        self._dropped += len(payloads)
+        return False
+      fcntl.flock(self._file_lock, fcntl.LOCK_EX)
+      try:
+        head = self._HEAD.unpack_from(self._buf, 0)[0]
+        tail = self._TAIL.unpack_from(self._buf, 8)[0]
+        free = self._capacity - (head - tail)
+        data = b''.join(frames)
+        written = len(payloads)
+        if len(data) > free:
+          data, written = self._fit(frames, free)
+          self._dropped += len(payloads) - written
+        if data:
+          self._write(head, data)
+          self._HEAD.pack_into(self._buf, 0, head + len(data))
+      finally:
+        fcntl.flock(self._file_lock, fcntl.LOCK_UN)
+
+      # Read after unlocking, which orders it after the head update.
+      waiting = data and self._WAITING.unpack_from(self._buf, 24)[0]
+    if waiting:
+      self._ring_doorbell()
+    return written == len(payloads)
+
+  def get_many(self, timeout):
+    """Removes and returns all available frames.
+
+    Args:
+      timeout: max seconds to wait if the ring is empty.
+    Returns:
+      A list of (kind, payload) tuples. Empty on timeout.
+    """
+    assert self._create, 'Only the creator of a ring may consume it.'
+    head = self._HEAD.unpack_from(self._buf, 0)[0]
+    if head == self._tail:
+      self._WAITING.pack_into(self._buf, 24, 1)
+      # Taking the lock orders the flag update before re-reading the head, so
+      # a producer either sees the flag or its frames are seen here.
+      fcntl.flock(self._file_lock, fcntl.LOCK_EX)
+      head = self._HEAD.unpack_from(self._buf, 0)[0]
+      fcntl.flock(self._file_lock, fcntl.LOCK_UN)
+      if head == self._tail:
+        readable, _, _ = select.select([self._doorbell], [], [], timeout)
+        if readable:
+          try:
+            os.read(self._doorbell, 4096)
+          except BlockingIOError:
+            pass
+      self._WAITING.pack_into(self._buf, 24, 0)
+      head = self._HEAD.unpack_from(self._buf, 0)[0]
+      if head == self._tail:
+        return []
+
+    data = self._read(self._tail, head - self._tail)
+    self._tail = head
+    self._TAIL.pack_into(self._buf, 8, head)
+
+    frames = []
+    offset = 0
+    while offset < len(data):
+      size, kind = self._FRAME.unpack_from(data, offset)
+      offset += self._FRAME.size
+      frames.append((kind, data[offset:offset + size]))
+      offset += size
+    return frames
+
+  def close(self):
+    with self._thread_lock:
+      if self._create:
+        # Producers still attached to the unlinked segment find out they have
+        # to attach again.
+        self._CLOSED.pack_into(self._buf, 28, 1)
+      self._buf = None
+    self._memory.close()
+    os.close(self._file_lock)
+    if self._doorbell is not None:
+      os.close(self._doorbell)
+    if self._create:
+      self._memory.unlink()
+      _created_rings.discard(self._name)
+      for path in (self._doorbell_path, self._lock_path):
+        if os.path.exists(path):
+          os.remove(path)
+
+  def _fit(self, frames, free):
+    size = 0
+    count = 0
+    for i in range(0, len(frames), 2):
+      frame_size = len(frames[i]) + len(frames[i + 1])
+      if size + frame_size > free:
+        break
+      size += frame_size
+      count += 1
+    return b''.join(frames[:count * 2]), count
+
+  def _write(self, position, data):
+    start = self._HEADER_SIZE + position % self._capacity
+    first = min(len(data), self._HEADER_SIZE + self._capacity - start)
+    self._buf[start:start + first] = data[:first]
+    if first < len(data):
+      rest = len(data) - first
+      self._buf[self._HEADER_SIZE:self._HEADER_SIZE + rest] = data[first:]
+
+  def _read(self, position, size):
+    start = self._HEADER_SIZE + position % self._capacity
+    first = min(size, self._HEADER_SIZE + self._capacity - start)
+    data = bytes(self._buf[start:start + first])
+    if first < size:
+      rest = size - first
+      data += bytes(self._buf[self._HEADER_SIZE:self._HEADER_SIZE + rest])
+    return data
+
+  def _ring_doorbell(self):
+    try:
+      fd = os.open(self._doorbell_path,
+                   os.O_WRONLY | os.O_NONBLOCK | os.O_NOFOLLOW)
+    except OSError:
+      return
+    try:
+      os.write(fd, b'\0')
+    except BlockingIOError:
+      # Doorbell is already full of unread signals.
+      pass
+    finally:
+      os.close(fd)
+
+
+class _RingWriter(pubsub._PubsubReceiver):
+  """Writes local topics into a ring on the publisher's thread."""
+
+  def __init__(self, ring, topic_ids, sender=None, *args, **kwargs):
+    """Creates a _RingWriter instance.
+
+    Args:
+      ring: the _Ring to write to.
+      topic_ids: a list of topic ids to write. None for all topics.
+      sender: node id to prefix topics with, if the ring is shared by several
+              senders.
+    """
+    super(_RingWriter, self).__init__(topic_ids, *args, **kwargs)
+    self._ring = ring
+    self._sender = sender
+
+  @property
+  def ring(self):
+    return self._ring
+
+  def _on_topics(self, topics):
+    payloads = []
+    for topic_id, data, ts, source in self._sources(topics,
+                                                    self._current_inbound()):
+      if source and source.link == self._link:
+        continue
+      topic = self._convert(topic_id, data, ts, source)
+      if topic:
+        payload = topic.SerializeToString()
+        if self._sender is not None:
+          payload = _with_sender(self._sender, payload)
+        payloads.append(payload)
+    if payloads:
+      self._ring.put_many(_TOPIC, payloads)
+
+
+def _topic_values(topic_ids):
+  if not topic_ids:
+    return []
+  return [x.value if hasattr(x, 'value') else x for x in topic_ids]
+
+
+def _topic_ids(values):
+  if not values:
+    return None
+  if pubsub._topic_enum_class:
+    return [pubsub._topic_enum_class(x) for x in values]
+  return values
+
+
+class SharedMemoryServer(pattern.Worker):
+  """Passes topics between local Pubsub and SharedMemoryClients on this host."""
+
+  def __init__(self, name='pubsub', capacity=1 << 22, *args, **kwargs):
+    """Creates a SharedMemoryServer instance.
+
+    Args:
+      name: name of the server inbox, shared with clients.
+      capacity: size of the server inbox in bytes.
+    """
+    super(SharedMemoryServer, self).__init__(
+        worker_name='SharedMemoryServer', *args, **kwargs)
+    self._name = name
+    self._capacity = capacity
+    self._inbox = None
+    self._transmitter = pubsub._PubsubTransmitter()
+    self._clients = {}
+    self._next_check = 0
+
+  @property
+  def latency(self):
+    """Returns latency of topics from clients, with node id of clients as link.
+
+    See pubsub._LatencyStats.snapshot().
+    """
+    return self._transmitter.latency
+
+  def _on_start(self):
+    self._inbox = _Ring(self._name, self._capacity, create=True)
+
+  def _on_run(self):
+    for kind, payload in self._inbox.get_many(timeout=1):
+      if kind == _TOPIC:
+        # All clients share the inbox, so topics tell which client sent them.
+        sender, payload = _split_sender(payload)
+        self._transmitter.transmit(pubsub_pb2.Topic.FromString(payload), sender)
+      elif kind == _HELLO:
+        self._add_client(json.loads(payload.decode('utf-8')))
+      elif kind == _BYE:
+        self._remove_client(payload.decode('utf-8'))
+
+    now = time.monotonic()
+    if now >= self._next_check:
+      self._next_check = now + _LIVENESS_CHECK_SECS
+      for inbox_name, writer in list(self._clients.items()):
+        if not writer.ring.alive:
+          self.logger.warn('Client %s went away.', inbox_name)
+          self._remove_client(inbox_name)
+
+  def _on_stop(self):
+    for inbox_name in list(self._clients):
+      self._remove_client(inbox_name)
+    self._inbox.close()
+    self._inbox = None
+
+  def _add_client(self, hello):
+    inbox_name = hello['inbox']
+    self._remove_client(inbox_name)
+    self.logger.info('Adding client %s...', inbox_name)
+    try:
+      ring = _Ring(inbox_name)
+    except FileNotFoundError:
+      self.logger.warn('Inbox of client %s not found.', inbox_name)
+      return
+    except PermissionError as e:
+      self.logger.warn('Inbox of client %s refused: %s', inbox_name, e)
+      return
+    # Topics from the client are transmitted with its node id as link.
+    writer = _RingWriter(
+        ring, _topic_ids(hello['topic_ids']), link=hello.get('node_id'))
+    writer.__enter__()
+    self._clients[inbox_name] = writer
+
+  def _remove_client(self, inbox_name):
+    writer = self._clients.pop(inbox_name, None)
+    if writer:
+      self.logger.info('Removing client %s...', inbox_name)
+      writer.__exit__(None, None, None)
+      writer.ring.close()
+
+
+class SharedMemoryClient(pattern.Worker):
+  """Passes topics between local Pubsub and a SharedMemoryServer on this host.
+
+  The server does not need to be up when the client starts. Until the client
+  is connected, and while the server restarts, topics for the server are
+  dropped.
+  """
+
+  def __init__(self,
+               name='pubsub',
+               inbound_topics=None,
+               outbound_topics=None,
+               capacity=1 << 22,
+               *args,
+               **kwargs):
+    """Creates a SharedMemoryClient instance.
+
+    Args:
+      name: name of the server inbox.
+      inbound_topics: a list of topic ids. Only topics of this list will be
+                      received from server.
+      outbound_topics: a list of topic ids. Only topics of this list will be
+                       sent to server.
+      capacity: size of the client inbox in bytes.
+    """
+    super(SharedMemoryClient, self).__init__(
+        worker_name='SharedMemoryClient', *args, **kwargs)
+    self._server_name = name
+    self._inbox_name = '{0}.{1}'.format(name, os.getpid())
+    self._inbound_topics = inbound_topics
+    self._outbound_topics = outbound_topics
+    self._capacity = capacity
+    self._inbox = None
+    self._server = None
+    self._writer = None
+    self._transmitter = pubsub._PubsubTransmitter()
+    self._next_check = 0
+
+  @property
+  def connected(self):
+    """Returns whether the client has announced itself to a running server."""
+    return self._server is not None
+
+  @property
+  def latency(self):
+    """Returns latency of topics from server. See pubsub._LatencyStats."""
+    return self._transmitter.latency
+
+  def _on_start(self):
+    self._inbox = _Ring(self._inbox_name, self._capacity, create=True)
+    self._connect()
+
+  def _on_run(self):
+    for kind, payload in self._inbox.get_many(timeout=_LIVENESS_CHECK_SECS):
+      if kind == _TOPIC:
+        self._transmitter.transmit(
+            pubsub_pb2.Topic.FromString(payload), self._server_name)
+
+    now = time.monotonic()
+    if now >= self._next_check:
+      self._next_check = now + _LIVENESS_CHECK_SECS
+      if self._server and not self._server.alive:
+        self.logger.warn('Server %s went away.', self._server_name)
+        self._disconnect()
+      if not self._server:
+        self._connect()
+
+  def _on_stop(self):
+    if self._server:
+      self._server.put(_BYE, self._inbox_name.encode('utf-8'))
+      self._disconnect()
+    self._inbox.close()
+    self._inbox = None
+
+  def _connect(self):
+    """Announces the inbox of this client to the server, if it is running."""
+    try:
+      server = _Ring(self._server_name)
+    except FileNotFoundError:
+      return
+    except PermissionError as e:
+      self.logger.warn('Server %s refused: %s', self._server_name, e)
+      return
+    if not server.alive:
+      server.close()
+      return
+
+    self.logger.info('Connecting to server %s...', self._server_name)
+    node_id = pubsub.get_node_id()
+    hello = {
+        'inbox': self._inbox_name,
+        'node_id': node_id,
+        'topic_ids': _topic_values(self._inbound_topics),
+    }
+    server.put(_HELLO, json.dumps(hello).encode('utf-8'))
+    self._server = server
+    self._writer = _RingWriter(
+        server, self._outbound_topics, sender=node_id, link=self._server_name)
+    self._writer.__enter__()
+
+  def _disconnect(self):
+    self._writer.__exit__(None, None, None)
+    self._writer = None
+    self._server.close()
+    self._server = None
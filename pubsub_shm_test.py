@@ -0,0 +1,198 @@
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import stat
+import tempfile
+import time
+import unittest
+
+from multiprocessing import shared_memory
+
+from common import pubsub
+from common import pubsub_shm
+from common.proto import pubsub_pb2
+
+_REQUEST_TOPIC_ID = 1
+_ECHO_TOPIC_ID = 2
+
+
+def _echo(name, stop):
+  """Echoes topics from a SharedMemoryServer back to it until stop is set."""
+  instance = pubsub.Pubsub.get_instance()
+  # Echoes are published from the callback, as replies.
+  instance.subscribe(
+      _REQUEST_TOPIC_ID,
+      lambda topic, data: instance.publish(_ECHO_TOPIC_ID, data))
+  client = pubsub_shm.SharedMemoryClient(
+      name,
+      inbound_topics=[_REQUEST_TOPIC_ID],
+      outbound_topics=[_ECHO_TOPIC_ID])
+  client.start()
+  stop.wait()
+  client.stop()
+
+
+class RingTests(unittest.TestCase):
+  def setUp(self):
+    name = 'pubsub_shm_test.{0}'.format(os.getpid())
+    self._consumer = pubsub_shm._Ring(name, capacity=64, create=True)
+    self._producer = pubsub_shm._Ring(name)
+
+  def tearDown(self):
+    self._producer.close()
+    self._consumer.close()
+
+  def test_put_and_get(self):
+    self.assertTrue(self._producer.put_many(1, [b'a', b'bc']))
+    self.assertEqual(self._consumer.get_many(timeout=0), [(1, b'a'),
+                                                           (1, b'bc')])
+    self.assertEqual(self._consumer.get_many(timeout=0), [])
+
+  def test_wrap_around(self):
+    for i in range(10):
+      payload = bytes([i]) * 20
+      self.assertTrue(self._producer.put(2, payload))
+      self.assertEqual(self._consumer.get_many(timeout=0), [(2, payload)])
+
+  def test_drop_when_full(self):
+    self.assertFalse(self._producer.put_many(1, [b'x' * 20] * 3))
+    self.assertEqual(self._producer.dropped, 1)
+    self.assertEqual(len(self._consumer.get_many(timeout=0)), 2)
+
+  def test_files_are_private(self):
+    info = os.lstat(os.path.dirname(self._producer._lock_path))
+    self.assertTrue(stat.S_ISDIR(info.st_mode))
+    self.assertEqual(info.st_uid, os.getuid())
+    self.assertEqual(info.st_mode & (stat.S_IRWXG | stat.S_IRWXO), 0)
+
+  def test_attach_before_ready(self):
+    # A segment whose creator has not written the header yet.
+    name = 'pubsub_shm_test.{0}.unready'.format(os.getpid())
+    memory = shared_memory.SharedMemory(name=name, create=True, size=128)
+    try:
+      with self.assertRaises(FileNotFoundError):
+        pubsub_shm._Ring(name)
+    finally:
+      memory.close()
+      memory.unlink()
+
+
+class RingDirTests(unittest.TestCase):
+  def setUp(self):
+    self._runtime_dir = tempfile.mkdtemp()
+    self._xdg_runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    os.environ['XDG_RUNTIME_DIR'] = self._runtime_dir
+
+  def tearDown(self):
+    if self._xdg_runtime_dir is None:
+      del os.environ['XDG_RUNTIME_DIR']
+    else:
+      os.environ['XDG_RUNTIME_DIR'] = self._xdg_runtime_dir
+    shutil.rmtree(self._runtime_dir)
+
+  def test_shared_dir_is_refused(self):
+    path = os.path.join(self._runtime_dir,
+                        'pubsub-shm-{0}'.format(os.getuid()))
+    os.mkdir(path)
+    os.chmod(path, 0o777)
+    with self.assertRaises(PermissionError):
+      pubsub_shm._Ring('pubsub_shm_test.{0}'.format(os.getpid()),
+                       capacity=64, create=True)
+
+
+class ServerClientTests(unittest.TestCase):
+  def setUp(self):
+    self._name = 'pubsub_shm_test.{0}.server'.format(os.getpid())
+    self._echoes = queue.Queue()
+
+  def _on_echo(self, topic, data):
+    self._echoes.put(data)
+
+  def _wait_for_echo(self, value, timeout=10):
+    """Publishes value until it is echoed back. Returns whether it was."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+      pubsub.Pubsub.get_instance().publish(_REQUEST_TOPIC_ID, value)
+      try:
+        while self._echoes.get(timeout=0.1) != value:
+          pass
+        return True
+      except queue.Empty:
+        pass
+    return False
+
+  def _run(self, start_method):
+    context = multiprocessing.get_context(start_method)
+    stop = context.Event()
+    # Forked before anything is subscribed here.
+    child = context.Process(target=_echo, args=(self._name, stop))
+    child.start()
+    instance = pubsub.Pubsub.get_instance()
+    server = pubsub_shm.SharedMemoryServer(self._name)
+    server.start()
+    instance.subscribe(_ECHO_TOPIC_ID, self._on_echo)
+    try:
+      self.assertTrue(self._wait_for_echo('first'))
+      # The client announces itself again to a new server.
+      server.stop()
+      server = pubsub_shm.SharedMemoryServer(self._name)
+      server.start()
+      self.assertTrue(self._wait_for_echo('second'))
+    finally:
+      instance.unsubscribe(_ECHO_TOPIC_ID, self._on_echo)
+      stop.set()
+      child.join()
+      server.stop()
+    self.assertEqual(child.exitcode, 0)
+
+  def test_relayed_topics_are_not_sent_back(self):
+    instance = pubsub.Pubsub.get_instance()
+    received = queue.Queue()
+    callback = lambda topic, data: received.put(data)
+    server = pubsub_shm.SharedMemoryServer(self._name)
+    server.start()
+    inbox = pubsub_shm._Ring(self._name + '.inbox', capacity=1 << 16,
+                             create=True)
+    server_ring = pubsub_shm._Ring(self._name)
+    instance.subscribe(_REQUEST_TOPIC_ID, callback)
+    try:
+      # Announces a client without running one.
+      server_ring.put(pubsub_shm._HELLO, json.dumps({
+          'inbox': inbox.name,
+          'node_id': 'client',
+          'topic_ids': [_REQUEST_TOPIC_ID],
+      }).encode('utf-8'))
+      # A topic the client relays from another node behind it.
+      topic = pubsub_pb2.Topic(id=_REQUEST_TOPIC_ID,
+                               origin='pubsub_shm_test.relayed',
+                               hops=1,
+                               string_value='relayed')
+      server_ring.put(
+          pubsub_shm._TOPIC,
+          pubsub_shm._with_sender('client', topic.SerializeToString()))
+      self.assertEqual(received.get(timeout=10), 'relayed')
+      instance.publish(_REQUEST_TOPIC_ID, 'local')
+
+      deadline = time.time() + 10
+      values = []
+      while 'local' not in values and time.time() < deadline:
+        for kind, payload in inbox.get_many(timeout=0.1):
+          values.append(pubsub_pb2.Topic.FromString(payload).string_value)
+    finally:
+      instance.unsubscribe(_REQUEST_TOPIC_ID, callback)
+      server.stop()
+      server_ring.close()
+      inbox.close()
+    self.assertEqual(values, ['local'])
+
+  def test_spawned_client(self):
+    self._run('spawn')
+
+  def test_forked_client(self):
+    self._run('fork')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,909 @@
+import datetime
+import multiprocessing
+import queue
+import threading
+import time
+import unittest
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+from common import pubsub
+from common.proto import pubsub_pb2
+
+
+def _send_topic(connection, topic_id, data):
+  """Sends a topic published on this process as a serialized Topic."""
+  topic = pubsub._PubsubReceiver(None)._convert(topic_id, data, 0)
+  connection.send_bytes(topic.SerializeToString())
+
+
+_REQUEST_TOPIC_ID = 1
+_ECHO_TOPIC_ID = 2
+
+
+def _connect(port, timeout=10, **kwargs):
+  """Returns a PubsubClient to localhost:port once its server is up."""
+  deadline = time.time() + timeout
+  while True:
+    try:
+      return pubsub.PubsubClient(
+          'localhost:{0}'.format(port),
+          prefer_local=False,
+          set_clock=False,
+          **kwargs)
+    except Exception:
+      if time.time() > deadline:
+        raise
+      time.sleep(0.1)
+
+
+def _serve_root(port, connection):
+  """Runs a PubsubServer echoing requests, until connection sends None.
+
+  Lists of values sent through connection are published as echoes, then
+  acknowledged.
+  """
+  server = pubsub.PubsubServer(port=port, unix_socket=False)
+  instance = pubsub.Pubsub.get_instance()
+  # Echoes are published from the callback, as replies.
+  instance.subscribe(
+      _REQUEST_TOPIC_ID,
+      lambda topic, data: instance.publish(_ECHO_TOPIC_ID, data))
+  server.start()
+  for values in iter(connection.recv, None):
+    instance.publish_many([(_ECHO_TOPIC_ID, x) for x in values])
+    connection.send(None)
+  server.stop()
+
+
+def _serve_relay(port, root_port, connection):
+  """Runs a PubsubServer relaying for a root server, until connection sends."""
+  server = pubsub.PubsubServer(port=port, unix_socket=False)
+  server.start()
+  client = _connect(root_port, inbound_topics=[], relay_for=server)
+  connection.send(None)
+  connection.recv()
+  client.stop()
+  server.stop()
+
+
+class PubsubTests(unittest.TestCase):
+  def setUp(self):
+    self._pubsub = pubsub.Pubsub()
+    self._received = []
+
+  def _on_topic(self, topic, data):
+    self._received.append((topic, data))
+
+  def test_publish_to_topic_subscribers(self):
+    self._pubsub.subscribe('a', self._on_topic)
+    self._pubsub.publish('a', 1)
+    self._pubsub.publish('b', 2)
+    self.assertEqual(self._received, [('a', 1)])
+
+  def test_publish_to_default_subscribers(self):
+    self._pubsub.subscribe(None, self._on_topic)
+    self._pubsub.publish('a', 1)
+    self._pubsub.publish('b', 2)
+    self.assertEqual(self._received, [('a', 1), ('b', 2)])
+
+  def test_publish_to_pattern_subscribers(self):
+    self._pubsub.subscribe('sensors/*/temp', self._on_topic)
+    self._pubsub.subscribe('gps/#', self._on_topic)
+    for topic in ('sensors/1/temp', 'sensors/1/humidity', 'sensors/temp',
+                  'gps', 'gps/fix/quality', 'gpsx'):
+      self._pubsub.publish(topic, 1)
+    self.assertEqual(self._received, [('sensors/1/temp', 1), ('gps', 1),
+                                      ('gps/fix/quality', 1)])
+
+  def test_unsubscribe_pattern(self):
+    self._pubsub.publish('gps/fix', 1)
+    self._pubsub.subscribe('gps/#', self._on_topic)
+    self._pubsub.publish('gps/fix', 2)
+    self._pubsub.unsubscribe('gps/#', self._on_topic)
+    self._pubsub.publish('gps/fix', 3)
+    self.assertEqual(self._received, [('gps/fix', 2)])
+
+  def test_invalid_pattern(self):
+    with self.assertRaises(ValueError):
+      self._pubsub.subscribe('a/#/b', self._on_topic)
+    # Nothing is left of the invalid subscription.
+    self._pubsub.subscribe('a/#', self._on_topic)
+    self._pubsub.publish('a/c/b', 1)
+    self.assertEqual(self._received, [('a/c/b', 1)])
+
+  def test_publish_many(self):
+    batches = []
+    self._pubsub.subscribe('a', self._on_topic)
+    self._pubsub.subscribe(None, batches.append, batch=True)
+    self._pubsub.publish_many([('a', 1), ('b', 2), ('a', 3)])
+    self.assertEqual(self._received, [('a', 1), ('a', 3)])
+    self.assertEqual(batches, [[('a', 1), ('b', 2), ('a', 3)]])
+
+  def test_retention(self):
+    self._pubsub.enable_retention(max_topics=2)
+    self._pubsub.set_retention('c', False)
+    for topic in ('a/1', 'a/2', 'b', 'c', 'a/1'):
+      self._pubsub.publish(topic, topic)
+    self._pubsub.subscribe('a/#', self._on_topic)
+    self.assertEqual(self._received, [('a/1', 'a/1')])
+    self.assertEqual(self._pubsub.get_retained(), [('b', 'b'), ('a/1', 'a/1')])
+
+  def test_retention_with_concurrent_publish(self):
+    self._pubsub.enable_retention()
+    self._pubsub.publish('a', 1)
+    retained = self._pubsub._retained
+    get = retained.get
+
+    def get_and_publish(key):
+      # A publish racing with the new subscriber, after retained values are
+      # read.
+      values = get(key)
+      self._pubsub.publish('a', 2)
+      return values
+
+    retained.get = get_and_publish
+    self._pubsub.subscribe('a', self._on_topic)
+    self.assertEqual(self._received, [('a', 2)])
+
+  def test_instrumentation(self):
+    def fail(topic, data):
+      raise ValueError()
+
+    self._pubsub.enable_instrumentation()
+    self._pubsub.subscribe('a', self._on_topic)
+    self._pubsub.subscribe(
+        'a', fail, min_interval=datetime.timedelta(seconds=60))
+    self._pubsub.subscribe('b', fail)
+    self._pubsub.publish('a', 'xyz')
+    self._pubsub.publish_many([('a', 'x'), ('b', 'y'), ('a', 'z')])
+    stats = self._pubsub.get_stats()
+
+    self.assertEqual(stats['topics']['a']['publishes'], 3)
+    self.assertEqual(stats['topics']['a']['average_fanout'], 2)
+    self.assertEqual(stats['topics']['a']['bytes'], 5)
+    self.assertEqual(stats['topics']['b']['publishes'], 1)
+    subscribers = {
+        name.split(':')[0] + '.' + name.split('@')[0].split('.')[-1]: x
+        for name, x in stats['subscribers'].items()
+    }
+    self.assertEqual(subscribers['a._on_topic']['deliveries'], 3)
+    self.assertEqual(subscribers['a.fail']['suppressed'], 3)
+    self.assertEqual(subscribers['b.fail']['exceptions'], 1)
+
+    self._pubsub.disable_instrumentation()
+    self._pubsub.publish('a', 'xyz')
+    self.assertEqual(self._pubsub.get_stats(), {})
+
+  def test_disable_instrumentation_when_disabled(self):
+    self._pubsub.disable_instrumentation()
+    self._pubsub.subscribe('a', self._on_topic)
+    self._pubsub.publish('a', 1)
+    self.assertEqual(self._received, [('a', 1)])
+    self.assertEqual(self._pubsub.get_stats(), {})
+
+  def test_unsubscribe(self):
+    self._pubsub.subscribe('a', self._on_topic)
+    self._pubsub.unsubscribe('a', self._on_topic)
+    self._pubsub.publish('a', 1)
+    self.assertEqual(self._received, [])
+    with self.assertRaises(AssertionError):
+      self._pubsub.unsubscribe('a', self._on_topic)
+
+  def test_subscribe_twice(self):
+    self._pubsub.subscribe('a', self._on_topic)
+    with self.assertRaises(AssertionError):
+      self._pubsub.subscribe('a', self._on_topic)
+
+  def test_min_interval(self):
+    self._pubsub.subscribe(
+        'a', self._on_topic, min_interval=datetime.timedelta(seconds=60))
+    self._pubsub.publish('a', 1)
+    self.assertEqual(self._received, [])
+
+  def test_out_of_order_offers(self):
+    self._pubsub.subscribe('a', self._on_topic)
+    self._pubsub.subscribe('b', self._received.extend, batch=True)
+    # Concurrent publishers may offer a topic stamped before the last one.
+    for topic in ('a', 'b'):
+      info = self._pubsub._table.lookup(topic)[0]
+      self.assertTrue(info.offer(info.last_transmission - 1, topic, 1))
+    self.assertEqual(self._received, [('a', 1), ('b', 1)])
+
+  def test_conflate(self):
+    done = threading.Event()
+
+    def on_topic(topic, data):
+      self._on_topic(topic, data)
+      if topic == 'b':
+        done.set()
+
+    self._pubsub.subscribe(
+        None,
+        on_topic,
+        min_interval=datetime.timedelta(seconds=0.1),
+        conflate=True)
+    for i in range(3):
+      self._pubsub.publish('a', i)
+      self._pubsub.publish('b', i)
+    self.assertEqual(self._received, [])
+    self.assertTrue(done.wait(5))
+    self.assertEqual(self._received, [('a', 2), ('b', 2)])
+
+  def test_subscribe_during_publish(self):
+    def on_topic(topic, data):
+      self._pubsub.unsubscribe('a', on_topic)
+      self._pubsub.subscribe('a', self._on_topic)
+
+    self._pubsub.subscribe('a', on_topic)
+    self._pubsub.publish('a', 1)
+    self.assertEqual(self._received, [])
+    self._pubsub.publish('a', 2)
+    self.assertEqual(self._received, [('a', 2)])
+
+  def test_concurrent_publish_and_subscribe(self):
+    counts = []
+    abort = threading.Event()
+
+    def publish():
+      while not abort.is_set():
+        self._pubsub.publish('a', 1)
+
+    thread = threading.Thread(target=publish)
+    thread.start()
+    try:
+      for _ in range(200):
+        callback = lambda topic, data: counts.append(data)
+        self._pubsub.subscribe('a', callback)
+        self._pubsub.unsubscribe('a', callback)
+    finally:
+      abort.set()
+      thread.join()
+    self.assertTrue(all(x == 1 for x in counts))
+
+  def test_async_preserves_order(self):
+    done = threading.Event()
+
+    def on_topic(topic, data):
+      self._received.append(data)
+      if data == 999:
+        done.set()
+
+    self._pubsub.subscribe('a', on_topic, mode='async', queue_size=1000)
+    for i in range(1000):
+      self._pubsub.publish('a', i)
+    self.assertTrue(done.wait(5))
+    self.assertEqual(self._received, list(range(1000)))
+
+  def test_async_does_not_block_publisher(self):
+    release = threading.Event()
+    self._pubsub.subscribe(
+        'a', lambda topic, data: release.wait(), mode='async', queue_size=2)
+    for i in range(10):
+      self._pubsub.publish('a', i)
+    release.set()
+
+  def _publish_with_blocked_async_subscriber(self, overflow):
+    started = threading.Event()
+    release = threading.Event()
+    done = threading.Event()
+
+    def on_topic(topic, data):
+      started.set()
+      release.wait()
+      self._received.append(data)
+      if len(self._received) == 3:
+        done.set()
+
+    self._pubsub.subscribe(
+        'a', on_topic, mode='async', queue_size=2, overflow=overflow)
+    self._pubsub.publish('a', 0)
+    self.assertTrue(started.wait(5))
+    for i in range(1, 10):
+      self._pubsub.publish('a', i)
+    release.set()
+    self.assertTrue(done.wait(5))
+
+  def test_async_drop_newest(self):
+    self._publish_with_blocked_async_subscriber(
+        pubsub.OverflowPolicy.DROP_NEWEST)
+    self.assertEqual(self._received, [0, 1, 2])
+
+  def test_async_drop_oldest(self):
+    self._publish_with_blocked_async_subscriber(
+        pubsub.OverflowPolicy.DROP_OLDEST)
+    self.assertEqual(self._received, [0, 8, 9])
+
+
+class PubsubReceiverTests(unittest.TestCase):
+  def test_publish_many(self):
+    with pubsub._PubsubReceiver([1, 2]) as receiver:
+      pubsub.Pubsub.get_instance().publish_many([(1, 1), (2, 'x'), (3, 2)])
+      first = receiver.topics.get(block=False)
+      second = receiver.topics.get(block=False)
+      with self.assertRaises(queue.Empty):
+        receiver.topics.get(block=False)
+    self.assertEqual(first.integer_value, 1)
+    self.assertEqual(second.string_value, 'x')
+    self.assertAlmostEqual(first.timestamp_ns / 1e9, time.time(), delta=1)
+    self.assertEqual(first.origin, pubsub.get_node_id())
+
+  def test_relay(self):
+    instance = pubsub.Pubsub.get_instance()
+    with pubsub._PubsubReceiver([1], link='a') as to_a, \
+        pubsub._PubsubReceiver([1], link='b') as to_b:
+      item = (1, 1)
+      inbound = pubsub._InboundBatch(
+          'a', {id(item): pubsub._Inbound('a', 'x', 1, 5)})
+      with pubsub._PubsubReceiver.receiving(inbound):
+        instance.publish_many([item])
+      self.assertEqual(len(to_a.topics), 0)
+      topic = to_b.topics.get(block=False)
+    self.assertEqual(topic.origin, 'x')
+    self.assertEqual(topic.hops, 2)
+    self.assertEqual(topic.timestamp_ns, 5)
+
+  def test_messages(self):
+    pubsub.register_message(1, pubsub_pb2.DoubleArray)
+    try:
+      with pubsub._PubsubReceiver([1]) as receiver:
+        pubsub.Pubsub.get_instance().publish(1,
+                                             pubsub_pb2.DoubleArray(values=[1]))
+        topic = receiver.topics.get(block=False)
+      decoded = pubsub._PubsubTransmitter()._decode(topic)
+    finally:
+      del pubsub._message_classes[1]
+      pubsub._decoders.clear()
+    self.assertEqual(decoded, (1, pubsub_pb2.DoubleArray(values=[1])))
+
+  def test_unsupported_data(self):
+    with pubsub._PubsubReceiver([1]) as receiver:
+      pubsub.Pubsub.get_instance().publish_many([(1, object()), (1, [1, 'x'])])
+      with self.assertRaises(queue.Empty):
+        receiver.topics.get(block=False)
+
+  @unittest.skipIf(np is None, 'NumPy is not installed.')
+  def test_arrays(self):
+    spectrum = [0, 1.5, 2]
+    points = np.arange(6, dtype=np.float32).reshape(2, 3)
+    with pubsub._PubsubReceiver([1, 2, 3]) as receiver:
+      pubsub.Pubsub.get_instance().publish_many([(1, spectrum), (2, [1, -2]),
+                                                 (3, points)])
+      topics = receiver.topics.get_many(3, timeout=0)
+
+    transmitter = pubsub._PubsubTransmitter()
+    decoded = [transmitter._decode(x)[1] for x in topics]
+    self.assertEqual(topics[0].WhichOneof('data'), 'double_array')
+    self.assertEqual(decoded[0], spectrum)
+    self.assertEqual(topics[1].WhichOneof('data'), 'int64_array')
+    self.assertEqual(decoded[1], [1, -2])
+    self.assertEqual(decoded[2].dtype, np.float32)
+    np.testing.assert_array_equal(decoded[2], points)
+
+  def test_values_out_of_range(self):
+    with pubsub._PubsubReceiver([1, 2, 3]) as receiver:
+      pubsub.Pubsub.get_instance().publish_many([(1, 2**40), (2, [2**70, 1]),
+                                                 (3, [10**400]), (1, 5)])
+      topics = receiver.topics.get_many(10, timeout=0)
+
+    # Values which can't be sent are lost alone.
+    topics = {x.id: x for x in topics}
+    self.assertEqual(sorted(topics), [1, 2])
+    self.assertEqual(topics[1].integer_value, 5)
+    self.assertEqual(topics[2].WhichOneof('data'), 'double_array')
+    self.assertEqual(list(topics[2].double_array.values), [2.0**70, 1])
+
+  def test_retained_topics(self):
+    instance = pubsub.Pubsub.get_instance()
+    instance.enable_retention()
+    try:
+      instance.publish(1, 1)
+      with pubsub._PubsubReceiver([1, 2]) as receiver:
+        self.assertEqual(receiver.topics.get(block=False).integer_value, 1)
+    finally:
+      instance._retained = None
+
+
+class PubsubTransmitterTests(unittest.TestCase):
+  def setUp(self):
+    pubsub._routes.clear()
+
+  def tearDown(self):
+    pubsub._routes.clear()
+
+  def test_latency(self):
+    transmitter = pubsub._PubsubTransmitter()
+    now = time.time_ns()
+    transmitter.transmit_many([
+        pubsub_pb2.Topic(id=1, timestamp_ns=now - 2000000, integer_value=1),
+        pubsub_pb2.Topic(id=2, timestamp_ns=now - 1000000, integer_value=2),
+        pubsub_pb2.Topic(id=2, integer_value=3),
+    ], 'a')
+    transmitter.transmit(
+        pubsub_pb2.Topic(id=1, timestamp_ns=now, integer_value=4), 'b')
+    latency = transmitter.latency
+
+    self.assertEqual(latency['topics'][1]['count'], 2)
+    self.assertEqual(latency['topics'][2]['count'], 1)
+    self.assertGreaterEqual(latency['topics'][2]['max_latency'], 0.001)
+    self.assertEqual(latency['links']['a']['count'], 2)
+    self.assertGreaterEqual(latency['links']['a']['max_latency'], 0.002)
+    self.assertEqual(latency['links']['b']['count'], 1)
+
+  def test_loop_suppression(self):
+    transmitter = pubsub._PubsubTransmitter()
+    received = []
+    callback = lambda topic, data: received.append(data)
+    pubsub.Pubsub.get_instance().subscribe(1, callback)
+    try:
+      transmitter.transmit_many([
+          pubsub_pb2.Topic(id=1, origin=pubsub.get_node_id(), integer_value=1),
+          pubsub_pb2.Topic(id=1, origin='x', hops=100, integer_value=2),
+          pubsub_pb2.Topic(id=1, origin='x', hops=1, integer_value=3),
+      ], 'a')
+    finally:
+      pubsub.Pubsub.get_instance().unsubscribe(1, callback)
+    self.assertEqual(received, [3])
+    self.assertEqual(transmitter.suppressed, 2)
+
+  def test_duplicate_suppression(self):
+    transmitter = pubsub._PubsubTransmitter()
+    received = []
+    callback = lambda topic, data: received.append(data)
+    pubsub.Pubsub.get_instance().subscribe(1, callback)
+    try:
+      transmitter.transmit(
+          pubsub_pb2.Topic(id=1, origin='x', hops=2, integer_value=1), 'a')
+      # Same topic over a longer path.
+      transmitter.transmit(
+          pubsub_pb2.Topic(id=1, origin='x', hops=3, integer_value=1), 'b')
+      # A shorter path takes over.
+      transmitter.transmit(
+          pubsub_pb2.Topic(id=1, origin='x', hops=1, integer_value=2), 'c')
+      transmitter.transmit(
+          pubsub_pb2.Topic(id=1, origin='x', hops=2, integer_value=2), 'a')
+    finally:
+      pubsub.Pubsub.get_instance().unsubscribe(1, callback)
+    self.assertEqual(received, [1, 2])
+    self.assertEqual(transmitter.suppressed, 2)
+
+  def test_duplicate_suppression_across_transmitters(self):
+    received = []
+    callback = lambda topic, data: received.append(data)
+    pubsub.Pubsub.get_instance().subscribe(1, callback)
+    try:
+      # Such as a PubsubClient and a PubsubServer of a mesh.
+      client, server = pubsub._PubsubTransmitter(), pubsub._PubsubTransmitter()
+      client.transmit(
+          pubsub_pb2.Topic(id=1, origin='x', hops=1, integer_value=1), 'a')
+      server.transmit(
+          pubsub_pb2.Topic(id=1, origin='x', hops=2, integer_value=1), 'b')
+    finally:
+      pubsub.Pubsub.get_instance().unsubscribe(1, callback)
+    self.assertEqual(received, [1])
+    self.assertEqual(server.suppressed, 1)
+
+  def test_transmit_many_in_one_batch(self):
+    batches = []
+    instance = pubsub.Pubsub.get_instance()
+    instance.subscribe(1, batches.append, batch=True)
+    try:
+      with pubsub._PubsubReceiver([1], link='b') as receiver:
+        # Topics published one by one at their origin.
+        pubsub._PubsubTransmitter().transmit_many([
+            pubsub_pb2.Topic(
+                id=1, origin='x', hops=i, timestamp_ns=i, integer_value=i)
+            for i in range(1, 6)
+        ], 'a')
+        topics = receiver.topics.get_many(10, timeout=0)
+    finally:
+      instance.unsubscribe(1, batches.append)
+    self.assertEqual(batches, [[(1, i) for i in range(1, 6)]])
+    self.assertEqual([(x.hops, x.timestamp_ns) for x in topics],
+                     [(i + 1, i) for i in range(1, 6)])
+
+  def test_skip_topics_without_codec(self):
+    received = []
+    callback = lambda topic, data: received.append(data)
+    pubsub.Pubsub.get_instance().subscribe(1, callback)
+    try:
+      with self.assertLogs(level='WARNING'):
+        pubsub._PubsubTransmitter().transmit_many([
+            pubsub_pb2.Topic(id=1, bytes_value=b'x'),
+            pubsub_pb2.Topic(id=1, integer_value=1),
+        ], 'a')
+    finally:
+      pubsub.Pubsub.get_instance().unsubscribe(1, callback)
+    self.assertEqual(received, [1])
+
+  def test_reply_from_callback(self):
+    instance = pubsub.Pubsub.get_instance()
+    reply = lambda topic, data: instance.publish(2, data + 1)
+    instance.subscribe(1, reply)
+    try:
+      with pubsub._PubsubReceiver([1, 2], link='a') as receiver:
+        transmitter = pubsub._PubsubTransmitter()
+        transmitter.transmit(
+            pubsub_pb2.Topic(
+                id=1, origin='x', hops=1, timestamp_ns=5, integer_value=1),
+            'a')
+        transmitter.transmit_many([
+            pubsub_pb2.Topic(
+                id=1, origin='x', hops=1, timestamp_ns=5, integer_value=i)
+            for i in (3, 5)
+        ], 'a')
+        topics = receiver.topics.get_many(10, timeout=0)
+    finally:
+      instance.unsubscribe(1, reply)
+    # Replies go back to the link of requests, as topics of this node.
+    self.assertEqual([(x.id, x.integer_value) for x in topics],
+                     [(2, 2), (2, 4), (2, 6)])
+    for topic in topics:
+      self.assertEqual((topic.origin, topic.hops), (pubsub.get_node_id(), 0))
+      self.assertGreater(topic.timestamp_ns, 5)
+
+  def test_topics_of_forked_process(self):
+    received = []
+    callback = lambda topic, data: received.append(data)
+    context = multiprocessing.get_context('fork')
+    reader, writer = context.Pipe(duplex=False)
+    child = context.Process(target=_send_topic, args=(writer, 1, 2))
+    child.start()
+    topic = pubsub_pb2.Topic.FromString(reader.recv_bytes())
+    child.join()
+
+    pubsub.Pubsub.get_instance().subscribe(1, callback)
+    try:
+      pubsub._PubsubTransmitter().transmit(topic, 'child')
+    finally:
+      pubsub.Pubsub.get_instance().unsubscribe(1, callback)
+    self.assertEqual(topic.origin.rpartition(':')[2], str(child.pid))
+    self.assertEqual(received, [2])
+
+
+class FanoutHubTests(unittest.TestCase):
+  def setUp(self):
+    self._hub = pubsub._FanoutHub(replay_size=3)
+    self._hub.__enter__()
+
+  def tearDown(self):
+    self._hub.__exit__(None, None, None)
+
+  def _decode(self, listener, batch):
+    topics = listener.topics.get_many(10, timeout=0)
+    response = pubsub_pb2.ListenResponse.FromString(
+        pubsub._encode_listen_response(topics, batch))
+    if batch:
+      return [(x.id, x.integer_value) for x in response.topics]
+    return [(response.topic.id, response.topic.integer_value)]
+
+  def test_sequence_order_with_concurrent_publishers(self):
+    entered = threading.Event()
+    release = threading.Event()
+
+    class SlowListener(pubsub._HubListener):
+      def put_many(self, topics, block=True):
+        if not entered.is_set():
+          entered.set()
+          release.wait(5)
+        super(SlowListener, self).put_many(topics, block)
+
+    listener = SlowListener([1])
+    instance = pubsub.Pubsub.get_instance()
+    with self._hub.listen(listener):
+      first = threading.Thread(target=instance.publish, args=(1, 1))
+      first.start()
+      entered.wait(5)
+      # Numbered after the first topic, which is still being queued.
+      second = threading.Thread(target=instance.publish, args=(1, 2))
+      second.start()
+      second.join(0.1)
+      release.set()
+      first.join()
+      second.join()
+      topics = [
+          pubsub_pb2.Topic.FromString(x.data[1:])
+          for x in listener.topics.get_many(10, timeout=0)
+      ]
+    self.assertEqual([x.integer_value for x in topics], [1, 2])
+    self.assertLess(topics[0].sequence, topics[1].sequence)
+
+  def test_remove_wakes_up_blocked_publishers(self):
+    listener = pubsub._HubListener(
+        [1], queue_size=1, overflow=pubsub.OverflowPolicy.BLOCK)
+    instance = pubsub.Pubsub.get_instance()
+    with self._hub.listen(listener):
+      instance.publish(1, 1)
+      publisher = threading.Thread(target=instance.publish, args=(1, 2))
+      publisher.start()
+      publisher.join(0.1)
+      self.assertTrue(publisher.is_alive())
+    publisher.join(5)
+    self.assertFalse(publisher.is_alive())
+    self.assertEqual(listener.dropped, {1: 1})
+
+  def test_encode_once_for_all_listeners(self):
+    first = pubsub._HubListener([1])
+    second = pubsub._HubListener(None)
+    with self._hub.listen(first), self._hub.listen(second):
+      pubsub.Pubsub.get_instance().publish_many([(1, 1), (2, 2)])
+      self.assertIs(first.topics.get(block=False).data,
+                    second.topics.get(block=False).data)
+      self.assertEqual(len(first.topics), 0)
+      self.assertEqual(len(second.topics), 1)
+    pubsub.Pubsub.get_instance().publish(1, 3)
+    self.assertEqual(len(first.topics), 0)
+
+  def test_resume(self):
+    instance = pubsub.Pubsub.get_instance()
+    listener = pubsub._HubListener([1])
+    with self._hub.listen(listener):
+      instance.publish(1, 1)
+      last = listener.topics.get(block=False)
+    sequence = pubsub_pb2.Topic.FromString(last.data[1:]).sequence
+
+    instance.publish_many([(1, 2), (2, 3), (1, 4)])
+    listener = pubsub._HubListener([1])
+    with self._hub.listen(listener, resume_after=sequence):
+      self.assertEqual(self._decode(listener, True), [(1, 2), (1, 4)])
+
+  def test_resume_after_lost_topics(self):
+    instance = pubsub.Pubsub.get_instance()
+    instance.enable_retention()
+    try:
+      with self._hub.listen(pubsub._HubListener([1])):
+        pass
+      instance.publish_many([(1, 1), (1, 2), (1, 3), (1, 4)])
+      listener = pubsub._HubListener([1])
+      with self._hub.listen(listener, resume_after=1):
+        # Retained topic, then what is left in the replay ring.
+        self.assertEqual(
+            self._decode(listener, True), [(1, 4), (1, 2), (1, 3), (1, 4)])
+    finally:
+      instance._retained = None
+
+  def test_skip_topics_without_listeners(self):
+    instance = pubsub.Pubsub.get_instance()
+    with self._hub.listen(pubsub._HubListener([1])):
+      instance.publish_many([(1, 1), (2, 2)])
+    self.assertEqual([x[1] for x in self._hub._replay], [1])
+
+    # Topics of a listener which left are kept for it to resume, for a while.
+    instance.publish(1, 3)
+    self.assertEqual(len(self._hub._replay), 2)
+    self._hub._lingering[1] = 0
+    instance.publish(1, 4)
+    self.assertEqual(len(self._hub._replay), 2)
+    self.assertEqual(self._hub._lingering, {})
+
+  def test_listen_response_framing(self):
+    listener = pubsub._HubListener([1, 2])
+    with self._hub.listen(listener):
+      pubsub.Pubsub.get_instance().publish_many([(1, 300), (2, 2)])
+      self.assertEqual(self._decode(listener, True), [(1, 300), (2, 2)])
+      pubsub.Pubsub.get_instance().publish(2, 3)
+      self.assertEqual(self._decode(listener, False), [(2, 3)])
+
+  def test_relay(self):
+    instance = pubsub.Pubsub.get_instance()
+    to_a = pubsub._HubListener([1], link='a')
+    to_b = pubsub._HubListener([1], link='b')
+    with self._hub.listen(to_a), self._hub.listen(to_b):
+      item = (1, 1)
+      inbound = pubsub._InboundBatch(
+          'a', {id(item): pubsub._Inbound('a', 'x', 0, 5)})
+      with pubsub._PubsubReceiver.receiving(inbound):
+        instance.publish_many([item])
+      self.assertEqual(len(to_a.topics), 0)
+      topic = pubsub_pb2.Topic.FromString(to_b.topics.get(block=False).data[1:])
+    self.assertEqual((topic.origin, topic.hops, topic.timestamp_ns), ('x', 1, 5))
+
+    # Replayed topics do not go back to their link either.
+    to_a = pubsub._HubListener([1], link='a')
+    with self._hub.listen(to_a, resume_after=topic.sequence - 1):
+      self.assertEqual(len(to_a.topics), 0)
+
+  def test_interest(self):
+    changes = []
+    self._hub.watch_interest(lambda: changes.append(self._hub.interest))
+    with self._hub.listen(pubsub._HubListener([1])):
+      with self._hub.listen(pubsub._HubListener([1, 2])):
+        with self._hub.listen(pubsub._HubListener(None)):
+          pass
+    self.assertEqual(changes, [{1}, {1, 2}, None, {1, 2}, {1}, frozenset()])
+
+  def test_retained_topics(self):
+    instance = pubsub.Pubsub.get_instance()
+    instance.enable_retention()
+    try:
+      instance.publish(1, 1)
+      first = pubsub._HubListener([1])
+      second = pubsub._HubListener([1])
+      with self._hub.listen(first), self._hub.listen(second):
+        self.assertEqual(self._decode(first, True), [(1, 1)])
+        self.assertEqual(self._decode(second, True), [(1, 1)])
+    finally:
+      instance._retained = None
+
+  def test_retained_topics_beyond_blocking_queue(self):
+    instance = pubsub.Pubsub.get_instance()
+    instance.enable_retention()
+    try:
+      instance.publish_many([(1, 1), (2, 2), (3, 3)])
+      listener = pubsub._HubListener([1, 2, 3],
+                                     queue_size=2,
+                                     overflow=pubsub.OverflowPolicy.BLOCK)
+      # Neither registering nor publishing other topics waits for the listener.
+      with self._hub.listen(listener):
+        instance.publish(4, 4)
+        self.assertEqual(self._decode(listener, True), [(1, 1), (2, 2)])
+      self.assertEqual(listener.dropped, {3: 1})
+    finally:
+      instance._retained = None
+
+
+class TopicQueueTests(unittest.TestCase):
+  def _put_and_drain(self, overflow, **kwargs):
+    topics = pubsub._TopicQueue(2, overflow, **kwargs)
+    topics.put_many([
+        pubsub_pb2.Topic(id=topic_id, integer_value=value)
+        for topic_id, value in ((1, 1), (2, 2), (1, 3), (3, 4))
+    ])
+    values = []
+    while True:
+      try:
+        values.append(topics.get(block=False).integer_value)
+      except queue.Empty:
+        return values, topics.dropped
+
+  def test_drop_newest(self):
+    self.assertEqual(
+        self._put_and_drain(pubsub.OverflowPolicy.DROP_NEWEST),
+        ([1, 2], {1: 1, 3: 1}))
+
+  def test_drop_oldest(self):
+    self.assertEqual(
+        self._put_and_drain(pubsub.OverflowPolicy.DROP_OLDEST),
+        ([3, 4], {1: 1, 2: 1}))
+
+  def test_coalesce(self):
+    self.assertEqual(
+        self._put_and_drain(pubsub.OverflowPolicy.COALESCE),
+        ([2, 4], {1: 2}))
+
+  def test_block_with_timeout(self):
+    self.assertEqual(
+        self._put_and_drain(pubsub.OverflowPolicy.BLOCK, block_timeout=0.01),
+        ([1, 2], {1: 1, 3: 1}))
+
+  def test_block_until_get(self):
+    topics = pubsub._TopicQueue(1, pubsub.OverflowPolicy.BLOCK)
+    topics.put(pubsub_pb2.Topic(id=1))
+    thread = threading.Thread(target=topics.put, args=(pubsub_pb2.Topic(id=2),))
+    thread.start()
+    self.assertEqual(topics.get(timeout=1).id, 1)
+    self.assertEqual(topics.get(timeout=1).id, 2)
+    thread.join()
+    self.assertEqual(topics.dropped, {})
+
+  def test_close_wakes_up_readers(self):
+    topics = pubsub._TopicQueue(1)
+    timer = threading.Timer(0.05, topics.close)
+    timer.start()
+    with self.assertRaises(queue.Empty):
+      topics.get()
+    with self.assertRaises(queue.Empty):
+      topics.get_many(2)
+    timer.join()
+
+  def test_get_many(self):
+    topics = pubsub._TopicQueue(10)
+    topics.put_many([pubsub_pb2.Topic(id=i) for i in range(3)])
+    self.assertEqual([x.id for x in topics.get_many(2, linger=0.01)], [0, 1])
+    self.assertEqual([x.id for x in topics.get_many(2, linger=0.01)], [2])
+    with self.assertRaises(queue.Empty):
+      topics.get_many(2, timeout=0.01)
+
+  def test_get_many_lingers_for_more_topics(self):
+    topics = pubsub._TopicQueue(10)
+    topics.put(pubsub_pb2.Topic(id=1))
+    timer = threading.Timer(0.05, topics.put, args=(pubsub_pb2.Topic(id=2),))
+    timer.start()
+    self.assertEqual([x.id for x in topics.get_many(2, linger=5)], [1, 2])
+    timer.join()
+
+
+class PubsubClientServerTests(unittest.TestCase):
+  _ROOT_PORT = 50291
+  _RELAY_PORT = 50292
+
+  def setUp(self):
+    self._context = multiprocessing.get_context('spawn')
+    self._children = []
+    self._condition = threading.Condition()
+    self._received = []
+    pubsub.Pubsub.get_instance().subscribe(_ECHO_TOPIC_ID, self._on_echo)
+
+  def tearDown(self):
+    pubsub.Pubsub.get_instance().unsubscribe(_ECHO_TOPIC_ID, self._on_echo)
+    for child, connection in reversed(self._children):
+      connection.send(None)
+      child.join()
+
+  def _start(self, target, *args):
+    """Runs target in a child process, with a connection to it."""
+    connection, child_connection = self._context.Pipe()
+    child = self._context.Process(
+        target=target, args=args + (child_connection,), daemon=True)
+    child.start()
+    self._children.append((child, connection))
+    return connection
+
+  def _on_echo(self, topic, data):
+    with self._condition:
+      self._received.append(data)
+      self._condition.notify_all()
+
+  def _wait_for(self, count, timeout=10):
+    with self._condition:
+      self._condition.wait_for(lambda: len(self._received) >= count, timeout)
+      return list(self._received)
+
+  def _wait_for_stream(self):
+    """Publishes requests until one is echoed, then forgets echoes."""
+    instance = pubsub.Pubsub.get_instance()
+    deadline = time.time() + 10
+    while not self._wait_for(1, 0.1):
+      self.assertLess(time.time(), deadline)
+      instance.publish(_REQUEST_TOPIC_ID, -1)
+    with self._condition:
+      self._received = []
+
+  def test_relay_chain(self):
+    self._start(_serve_root, self._ROOT_PORT)
+    relay = self._start(_serve_relay, self._RELAY_PORT, self._ROOT_PORT)
+    self.assertTrue(relay.poll(10))
+    relay.recv()
+    client = _connect(
+        self._RELAY_PORT,
+        inbound_topics=[_ECHO_TOPIC_ID],
+        outbound_topics=[_REQUEST_TOPIC_ID])
+    try:
+      self._wait_for_stream()
+      # Requests go up the chain to the root, and echoes come back down.
+      pubsub.Pubsub.get_instance().publish_many(
+          [(_REQUEST_TOPIC_ID, i) for i in range(5)])
+      self.assertEqual(self._wait_for(5), list(range(5)))
+    finally:
+      client.stop()
+
+  def test_resume_after_reconnect(self):
+    root = self._start(_serve_root, self._ROOT_PORT)
+    client = _connect(
+        self._ROOT_PORT,
+        inbound_topics=[_ECHO_TOPIC_ID],
+        outbound_topics=[_REQUEST_TOPIC_ID],
+        linger=0)
+    try:
+      self._wait_for_stream()
+      root.send([0, 1])
+      root.recv()
+      self.assertEqual(self._wait_for(2), [0, 1])
+
+      # Keeps the client from listening again until topics are published.
+      with client._abort_lock:
+        client._listen_call.cancel()
+        root.send([2, 3, 4])
+        root.recv()
+      # Topics published while disconnected are replayed once, in order.
+      self.assertEqual(self._wait_for(5), list(range(5)))
+      self.assertEqual(self._wait_for(6, timeout=0.2), list(range(5)))
+    finally:
+      client.stop()
+
+
+if __name__ == '__main__':
+  unittest.main()